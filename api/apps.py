@@ -0,0 +1,31 @@
+from __future__ import unicode_literals
+
+from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+
+class ApiConfig(AppConfig):
+    name = 'api'
+
+    def ready(self):
+        from pttrack.models import Patient, todo_list_models
+        from workup.models import ClinicDate, Workup
+        from . import caching
+
+        for model in [Patient, Workup] + todo_list_models():
+            post_save.connect(caching.invalidate, sender=model,
+                              dispatch_uid='pt_list_cache_save_%s' %
+                              model._meta.label_lower)
+            post_delete.connect(caching.invalidate, sender=model,
+                                dispatch_uid='pt_list_cache_delete_%s' %
+                                model._meta.label_lower)
+
+        # moving a clinic date moves the latest activity of its patients,
+        # whose summaries are updated without any signals being sent (see
+        # resummarize_clinic_date_patients)
+        post_save.connect(caching.invalidate, sender=ClinicDate,
+                          dispatch_uid='pt_list_cache_save_clinic_date')
+
+        m2m_changed.connect(caching.invalidate,
+                            sender=Patient.case_managers.through,
+                            dispatch_uid='pt_list_cache_case_managers')
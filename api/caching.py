@@ -0,0 +1,67 @@
+'''Caching of the ordered lists of patient ids behind the patient list API.
+
+Every cached list is stored under a key containing the current
+"generation", which is bumped whenever anything the lists depend on is
+saved or deleted (see ApiConfig.ready()). Bumping the generation makes
+every cached list unreachable at once, and stale lists simply expire.
+
+The generation is bumped both when the change is made and again once its
+transaction commits, so that a list built by another request from the
+data before the commit isn't kept under the new generation.
+'''
+from __future__ import unicode_literals
+from builtins import str
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'pt_list_generation'
+
+
+def generation():
+    '''The current generation of the patient list cache.'''
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        current = uuid.uuid4().hex
+        cache.add(GENERATION_KEY, current, None)
+        # another process may have got there first
+        current = cache.get(GENERATION_KEY, current)
+
+    return current
+
+
+def bump_generation():
+    '''Move the patient list cache on to a new generation. Generations
+    are random, rather than counted up with incr(), because incr() isn't
+    atomic on every cache backend (e.g. the database cache), and two
+    processes bumping at once mustn't land on the same generation.'''
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate(*args, **kwargs):
+    '''Invalidate every cached patient list, now and when the current
+    transaction commits. Takes (and ignores) any arguments, so that it can
+    be connected to signals directly.'''
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+
+def patient_ids(key_parts, build_queryset):
+    '''Get the ordered list of patient ids identified by key_parts (e.g.
+    the filter name and the date) from the cache, building it from the
+    queryset returned by build_queryset if it isn't there.
+    '''
+
+    key = 'pt_list:%s:%s' % (
+        generation(),
+        hashlib.sha1(str(key_parts).encode('utf-8')).hexdigest())
+
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(build_queryset().values_list('pk', flat=True))
+        cache.set(key, ids, settings.OSLER_PT_LIST_CACHE_TIMEOUT)
+
+    return ids
@@ -0,0 +1,186 @@
+from __future__ import unicode_literals
+from builtins import zip
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    '''DjangoJSONEncoder, except that datetimes keep their microseconds,
+    which a cursor needs to pick up exactly where the last page ended.'''
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super(CursorEncoder, self).default(o)
+
+
+class KeysetPagination(BasePagination):
+    '''Opt-in keyset (a.k.a. "seek") pagination.
+
+    Pagination only happens if the request asks for it by providing a
+    page_size or a cursor; otherwise the full result set is returned, as
+    before. To paginate a queryset, the view must provide
+    get_keyset_ordering(), which returns the fields (e.g. ('last_name',
+    'pk')) that the queryset is ordered on. The last of these must be
+    unique, and none of them may be null.
+
+    The cursor is the ordering key of the last row of the previous page,
+    so fetching a page is an indexed range scan no matter how deep into
+    the list the client has scrolled, and rows added or removed between
+    requests don't shift the page boundaries.
+
+    Querysets that can't be filtered once built (e.g. unions) can still be
+    paginated if the view provides filter_after_cursor(queryset, position),
+    returning the rows of queryset that come after position. Rows may be
+    model instances or dicts (from values()).
+
+    An already-ordered list (e.g. of cached primary keys) can also be
+    paginated, in which case the cursor is the last item of the previous
+    page and its index in the list.
+    '''
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (self.page_size_query_param not in params and
+                self.cursor_query_param not in params):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        if isinstance(queryset, list):
+            return self.paginate_list(queryset)
+
+        self.ordering = view.get_keyset_ordering()
+
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = self.decode_cursor(request, len(self.ordering))
+        if cursor is not None:
+            if hasattr(view, 'filter_after_cursor'):
+                queryset = view.filter_after_cursor(queryset, cursor)
+            else:
+                queryset = queryset.filter(self.after_cursor(cursor))
+
+        # fetch one extra row to find out if there's a next page.
+        page = list(queryset[:self.page_size + 1])
+
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            last = page[-1]
+            self.next_position = [
+                last[field.lstrip('-')] if isinstance(last, dict)
+                else getattr(last, field.lstrip('-'))
+                for field in self.ordering]
+        else:
+            self.next_position = None
+
+        return page
+
+    def paginate_list(self, items):
+        cursor = self.decode_cursor(self.request, 2)
+        if cursor is None:
+            start = 0
+        else:
+            index, last_item = cursor
+            if not isinstance(index, int):
+                raise NotFound(self.invalid_cursor_message)
+
+            # if the list has changed since the last page, pick up after
+            # the last item wherever it is now (or, if it's gone, from
+            # the same place).
+            if 0 <= index < len(items) and items[index] == last_item:
+                start = index + 1
+            elif last_item in items:
+                start = items.index(last_item) + 1
+            else:
+                start = index + 1
+
+        page = items[start:start + self.page_size]
+
+        if start + self.page_size < len(items):
+            self.next_position = [start + self.page_size - 1, page[-1]]
+        else:
+            self.next_position = None
+
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def after_cursor(self, position):
+        '''Build a Q object selecting the rows that come after position
+        in self.ordering, i.e. (a > x) OR (a = x AND b > y) for an
+        ascending ordering on (a, b).
+        '''
+
+        query = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+
+            clause = Q(**{'%s__%s' % (name, lookup): position[i]})
+            for prev_field, prev_value in zip(self.ordering[:i], position):
+                clause &= Q(**{prev_field.lstrip('-'): prev_value})
+
+            query |= clause
+
+        return query
+
+    def encode_cursor(self, position):
+        encoded = json.dumps(position, cls=CursorEncoder)
+        return urlsafe_b64encode(encoded.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request, length):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            position = json.loads(
+                urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != length:
+            raise NotFound(self.invalid_cursor_message)
+
+        return position
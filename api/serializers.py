@@ -3,7 +3,6 @@ from builtins import object
 from rest_framework import serializers
 from pttrack import models
 from workup import models as workupModels
-from simple_history.models import HistoricalRecords
 # from django.core.urlresolvers import reverse
 
 
@@ -15,14 +14,6 @@ class UrlReverser(object):
         return reverse(self.url_name, args=(obj.id,))
 
 
-class lastHistorySerializer(serializers.Serializer):
-    history_date = serializers.DateTimeField()
-
-
-class HistorySerializer(serializers.Serializer):
-    last = lastHistorySerializer()
-
-
 class ClinicDateSerializer(serializers.ModelSerializer):
     class Meta(object):
         model = workupModels.ClinicDate
@@ -48,20 +39,82 @@ class CaseManagerSerializer(serializers.ModelSerializer):
 
 
 class PatientSerializer(serializers.ModelSerializer):
+    '''Serializes a Patient and a summary of their chart.
+
+    Most of the summary is expensive to compute, so the fields to include
+    can be restricted with the 'fields' argument.
+    '''
+
     class Meta(object):
         model = models.Patient
-        exclude = []
+        exclude = ['first_name_key', 'last_name_key', 'first_name_sound',
+                   'last_name_sound']
 
-    history = HistorySerializer()
-    latest_workup = WorkupSerializer()
+    latest_workup = WorkupSerializer(source='summary.latest_workup')
     gender = serializers.StringRelatedField(read_only=True)
     age = serializers.StringRelatedField(read_only=True)
     name = serializers.StringRelatedField(read_only=True)
     pk = serializers.StringRelatedField(read_only=True)
-    status = serializers.StringRelatedField(read_only=True)
+    status = serializers.StringRelatedField(source='summary.status',
+                                            read_only=True)
     case_managers = CaseManagerSerializer(many=True)
 
     # Put urls as model properties because unable to do: patient_url = UrlReverser('patient-detail')
     detail_url = serializers.StringRelatedField(read_only=True)
     update_url = serializers.StringRelatedField(read_only=True)
     activate_url = serializers.StringRelatedField(read_only=True)
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+
+        super(PatientSerializer, self).__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None):
+        '''Load the related objects needed to serialize fields (or all
+        fields, if fields is None) for every patient in queryset at once,
+        rather than once per patient.'''
+
+        def wanted(field_name):
+            return fields is None or field_name in fields
+
+        if wanted('gender'):
+            queryset = queryset.select_related('gender')
+        for many_field in ['case_managers', 'languages', 'ethnicities']:
+            if wanted(many_field):
+                queryset = queryset.prefetch_related(many_field)
+        if wanted('status'):
+            queryset = queryset.select_related('summary')
+        if wanted('latest_workup'):
+            queryset = queryset.select_related(
+                'summary__latest_workup__clinic_day',
+                'summary__latest_workup__signer')
+
+        return queryset
+
+
+class PatientPhoneSerializer(serializers.ModelSerializer):
+    '''Serializes a normalized phone number and who it belongs to.'''
+
+    class Meta(object):
+        model = models.PatientPhone
+        fields = ['number', 'owner', 'patient']
+
+    patient = PatientSerializer(
+        fields=['id', 'name', 'date_of_birth', 'phone', 'detail_url'])
+
+
+class TimelineNoteSerializer(serializers.Serializer):
+    '''Serializes a note of any type from a patient's timeline, as loaded
+    by pttrack.models.timeline_notes().'''
+
+    note_type = serializers.CharField(read_only=True)
+    pk = serializers.IntegerField(read_only=True)
+    written_datetime = serializers.DateTimeField(read_only=True)
+    author = serializers.StringRelatedField(read_only=True)
+    author_type = serializers.StringRelatedField(read_only=True)
+    short_text = serializers.CharField(read_only=True)
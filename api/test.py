@@ -1,18 +1,25 @@
 from __future__ import unicode_literals
 import datetime
+import json
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 from rest_framework.test import APITestCase
 from rest_framework import status
 
 from pttrack import models
 from referral.models import Referral, FollowupRequest, PatientContact
-from followup.models import ContactResult
+from followup.models import ContactResult, GeneralFollowup, LabFollowup
 from referral.forms import PatientContactForm
 from workup import models as workupModels
 from pttrack.test_views import build_provider, log_in_provider
 
+from . import caching
+from .views import active_ai_patients_filter
+
 BASIC_FIXTURE = 'api.json'
 
 
@@ -169,10 +176,318 @@ class APITest(APITestCase):
         self.assertNotEqual(response.data[3]['latest_workup'], None) # pt1, workup date now()-5days
 
         # Check that dates are correcly sorted
-        self.assertGreaterEqual(response.data[0]['latest_workup']['clinic_day']['clinic_date'],response.data[1]['history']['last']['history_date'])
-        self.assertGreaterEqual(response.data[1]['history']['last']['history_date'],response.data[2]['latest_workup']['clinic_day']['clinic_date'])
+        self.assertGreaterEqual(response.data[0]['latest_workup']['clinic_day']['clinic_date'],response.data[1]['intake_datetime'])
+        self.assertGreaterEqual(response.data[1]['intake_datetime'],response.data[2]['latest_workup']['clinic_day']['clinic_date'])
         self.assertGreaterEqual(response.data[2]['latest_workup']['clinic_day']['clinic_date'],response.data[3]['latest_workup']['clinic_day']['clinic_date'])
 
+    def test_latest_activity_date_sorts_in_database(self):
+        # The latest_workup sort must be a single query regardless of the
+        # number of patients, and must give back a real queryset.
+        qs = models.Patient.objects \
+            .order_by('-summary__latest_activity_date', '-pk')
+
+        with self.assertNumQueries(1):
+            pks = list(qs.values_list('pk', flat=True))
+
+        # pt2 (workup tomorrow), pt4 (intake today), pt3 (workup yesterday),
+        # pt1 (workup five days ago)
+        self.assertEqual(pks, [2, 4, 3, 1])
+
+        # since it's a queryset, it can be filtered further.
+        self.assertEqual(
+            list(qs.filter(workup=None).values_list('pk', flat=True)), [4])
+
+    def test_api_list_patients_keyset_pagination(self):
+        # pages should follow on from one another without gaps or repeats
+        # for the default (last name), latest workup and due date orderings.
+        for data, pages in [
+                ({'page_size': 3}, [[4, 2, 3], [1]]),
+                ({'page_size': 2, 'sort': 'latest_workup'}, [[2, 4], [3, 1]]),
+                ({'page_size': 1, 'filter': 'ai_active'}, [[3], [2]])]:
+
+            response = self.client.get(reverse("pt_list_api"), data)
+            for i, expected_pks in enumerate(pages):
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(
+                    [pt['id'] for pt in response.data['results']],
+                    expected_pks)
+
+                if i + 1 < len(pages):
+                    self.assertIsNotNone(response.data['next'])
+                    response = self.client.get(response.data['next'])
+                else:
+                    self.assertIsNone(response.data['next'])
+
+        # pagination is opt-in, so without a page_size we get a bare list.
+        response = self.client.get(reverse("pt_list_api"))
+        self.assertEqual(len(response.data), 4)
+
+        response = self.client.get(reverse("pt_list_api"),
+                                   {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_api_search_patients(self):
+        def search(query, **params):
+            params.update({'q': query, 'fields': 'id'})
+            response = self.client.get(reverse("pt_search_api"), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [pt['id'] for pt in response.data]
+
+        # names, phone numbers (or their ends) and dates of birth, in any
+        # of the usual formats, and combinations of them.
+        self.assertEqual(search("brod"), [2])
+        self.assertEqual(search("McNath, Frankie"), [1])
+        self.assertEqual(search("5288"), [2, 3])
+        self.assertEqual(search("501-233"), [1])
+        self.assertEqual(search("01/01/1990"), [4, 2, 3])
+        self.assertEqual(search("1990-01-01 lk"), [3])
+        self.assertEqual(search("1990-01-02"), [])
+        self.assertEqual(search(""), [])
+        self.assertEqual(len(search("01/01/1990", limit=1)), 1)
+
+        # whole words rank above the beginnings of words, and the index
+        # follows changes to patients.
+        pt3 = models.Patient.objects.get(pk=3)
+        pt3.middle_name = "It"
+        pt3.save()
+        self.assertEqual(search("it"), [3, 4])
+
+        pt3.last_name = "Brodeltein"
+        pt3.save()
+        self.assertEqual(search("lkjh"), [])
+        self.assertEqual(search("brodeltein"), [3, 2])
+
+    def test_api_phone_lookup(self):
+        pt4 = models.Patient.objects.get(pk=4)
+        pt4.alternate_phone_1 = '(314) 555-0123'
+        pt4.alternate_phone_1_owner = 'Sister'
+        pt4.save()
+
+        def lookup(number):
+            response = self.client.get(reverse("pt_phone_api"),
+                                       {'number': number})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [(phone['patient']['id'], phone['owner'])
+                    for phone in response.data]
+
+        self.assertEqual(lookup('+49 178 236 5288'), [(2, ''), (3, '')])
+        self.assertEqual(lookup('4917823-65288'), [(2, ''), (3, '')])
+        # with or without the US country code
+        self.assertEqual(lookup('3145550123'), [(4, 'Sister')])
+        self.assertEqual(lookup('+1 314 555 0123'), [(4, 'Sister')])
+        self.assertEqual(lookup('555-0123'), [])
+        self.assertEqual(lookup(''), [])
+
+        # numbers and their patients are found in a single query
+        with self.assertNumQueries(1):
+            phones = list(models.PatientPhone.objects.lookup('491782365288'))
+            self.assertEqual([phone.patient.name() for phone in phones],
+                             ["Brodeltein, Juggie B.", "Lkjh, Asdf B."])
+
+        # numbers are kept up to date as patients change
+        pt4.alternate_phone_1 = ''
+        pt4.save()
+        self.assertEqual(lookup('3145550123'), [])
+
+    def test_api_patient_timeline(self):
+        pt1 = models.Patient.objects.get(pk=1)
+        note_kwargs = {
+            'author': models.Provider.objects.first(),
+            'author_type': models.ProviderType.objects.first(),
+            'patient': pt1,
+        }
+        followup_kwargs = dict(
+            note_kwargs,
+            contact_method=models.ContactMethod.objects.first(),
+            contact_resolution=ContactResult.objects.create(name="Reached"))
+
+        for i in range(2):
+            GeneralFollowup.objects.create(comments="general %s" % i,
+                                           **followup_kwargs)
+        LabFollowup.objects.create(communication_success=True,
+                                   **followup_kwargs)
+        models.Document.objects.create(
+            title="Silly", image="silly.jpg", comments="",
+            document_type=models.DocumentType.objects.first(),
+            **note_kwargs)
+
+        # the followups were all written at the same moment, so the
+        # timeline has to break ties consistently.
+        moment = now() - datetime.timedelta(days=1)
+        GeneralFollowup.objects.update(written_datetime=moment)
+        LabFollowup.objects.update(written_datetime=moment)
+
+        expected = [
+            (note._meta.model_name, note.pk) for note in sorted(
+                pt1.notes(), reverse=True,
+                key=lambda n: (n.written_datetime, n._meta.model_name, n.pk))]
+        self.assertEqual(len(expected), 5)
+
+        url = reverse("pt_timeline_api", args=(pt1.pk,))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(note['note_type'], note['pk']) for note in response.data],
+            expected)
+        # the backdated followups come after the document and the workup,
+        # ties broken by type and then pk, both descending.
+        self.assertEqual(
+            [note['short_text'] for note in response.data[2:]],
+            ["successfully reached patient regarding lab results.",
+             "general 1", "general 0"])
+
+        # pages follow on from one another without gaps or repeats, and
+        # each is found with a single union.
+        timeline = []
+        response = self.client.get(url, {'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            timeline.extend((note['note_type'], note['pk'])
+                            for note in response.data['results'])
+            if response.data['next'] is None:
+                break
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            self.assertEqual(
+                len([q for q in queries if 'UNION' in q['sql']]), 1)
+
+        self.assertEqual(timeline, expected)
+
+        response = self.client.get(reverse("pt_timeline_api", args=(999,)))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_api_list_patients_etag(self):
+        data = {'filter': 'ai_active'}
+        response = self.client.get(reverse("pt_list_api"), data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # unchanged lists aren't rebuilt or sent again
+        response = self.client.get(reverse("pt_list_api"), data,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        # other lists have other versions
+        response = self.client.get(reverse("pt_list_api"),
+                                   {'filter': 'ai_inactive'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # completing an action item changes the version
+        ai = models.ActionItem.objects.get(pk=3)
+        ai.mark_done(models.Provider.objects.first())
+        ai.save()
+
+        response = self.client.get(reverse("pt_list_api"), data,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # and so does deleting one
+        etag = response['ETag']
+        models.ActionItem.objects.get(pk=1).delete()
+        response = self.client.get(reverse("pt_list_api"), data,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_api_list_patients_cache(self):
+        data = {'filter': 'ai_active'}
+        response = self.client.get(reverse("pt_list_api"), data)
+        self.assertEqual([pt['id'] for pt in response.data], [3, 2])
+
+        # bulk updates don't send signals, so the cached list is used
+        models.ActionItem.objects.filter(pk=3).update(
+            completion_date=now(),
+            completion_author=models.Provider.objects.first())
+        response = self.client.get(reverse("pt_list_api"), data)
+        self.assertEqual([pt['id'] for pt in response.data], [3, 2])
+
+        # but saving a note invalidates it
+        models.ActionItem.objects.get(pk=3).save()
+        response = self.client.get(reverse("pt_list_api"), data)
+        self.assertEqual([pt['id'] for pt in response.data], [2])
+
+        # as does changing case managers
+        provider = log_in_provider(
+            self.client, build_provider(["Coordinator"]))
+        response = self.client.get(reverse("pt_list_api"),
+                                   {'filter': 'user_cases'})
+        self.assertEqual(len(response.data), 0)
+
+        models.Patient.objects.get(pk=1).case_managers.add(provider)
+        response = self.client.get(reverse("pt_list_api"),
+                                   {'filter': 'user_cases'})
+        self.assertEqual([pt['id'] for pt in response.data], [1])
+
+        # and moving a clinic date, which moves its patients' latest
+        # activity
+        data = {'sort': 'latest_workup'}
+        response = self.client.get(reverse("pt_list_api"), data)
+        self.assertNotEqual(response.data[0]['id'], 1)
+
+        clinic_date = models.Patient.objects.get(pk=1) \
+            .latest_workup().clinic_day
+        clinic_date.clinic_date = now().date() + datetime.timedelta(days=10)
+        clinic_date.save()
+        response = self.client.get(reverse("pt_list_api"), data)
+        self.assertEqual(response.data[0]['id'], 1)
+
+    @override_settings(OSLER_PT_LIST_STREAM_CHUNK_SIZE=3)
+    def test_api_list_patients_stream(self):
+        for data in [{}, {'sort': 'latest_workup'}, {'filter': 'ai_active'}]:
+            response = self.client.get(reverse("pt_list_api"), data)
+            expected = json.loads(response.content.decode('utf-8'))
+
+            data['stream'] = 'true'
+            response = self.client.get(reverse("pt_list_api"), data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            streamed = json.loads(
+                b''.join(response.streaming_content).decode('utf-8'))
+
+            self.assertEqual(streamed, expected)
+
+    def test_api_list_patients_sparse_fields(self):
+        data = {'fields': 'id,name,age'}
+        response = self.client.get(reverse("pt_list_api"), data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 4)
+        for pt in response.data:
+            self.assertEqual(set(pt.keys()), {'id', 'name', 'age'})
+
+        # without the chart summary fields, adding patients with workups
+        # and action items shouldn't add queries.
+        caching.invalidate()
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse("pt_list_api"), data)
+
+        pt5 = models.Patient.objects.create(
+            first_name="Artur",
+            last_name="Meller",
+            middle_name="Bayer",
+            phone='+49 178 236 5288',
+            gender=models.Gender.objects.first(),
+            address='Schulstrasse 9',
+            city='Munich',
+            state='BA',
+            zip_code='63108',
+            pcp_preferred_zip='63018',
+            date_of_birth=datetime.date(1990, 1, 1),
+            patient_comfortable_with_english=False,
+            preferred_contact_method=models.ContactMethod.objects.first(),
+        )
+        models.ActionItem.objects.create(
+            due_date=now().date(), patient=pt5, **self.ai_base_kwargs)
+
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(reverse("pt_list_api"), data)
+
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(len(before), len(after))
+
     def test_api_list_patients_with_unsigned_workup(self):
         # Test for unsigned_workup
         data = {'filter':'unsigned_workup'}
@@ -220,6 +535,12 @@ class APITest(APITestCase):
         self.assertEqual(response.data[0]['id'], 3)
         self.assertEqual(response.data[1]['id'], 2)
 
+        # action items and referral followups are searched in one query
+        with self.assertNumQueries(1):
+            pks = [pt.pk for pt in
+                   active_ai_patients_filter(models.Patient.objects.all())]
+        self.assertEqual(pks, [3, 2])
+
 
     def test_api_list_patients_with_inactive_action_item(self):
         # Test displaying patients with inactive action items
@@ -11,6 +11,15 @@ unwrapped_urlpatterns = [  # pylint: disable=invalid-name
     url(r'^pt_list/$',
         views.PtList.as_view(),
         name='pt_list_api'),
+    url(r'^pt_search/$',
+        views.PatientSearch.as_view(),
+        name='pt_search_api'),
+    url(r'^pt_phone/$',
+        views.PhoneLookup.as_view(),
+        name='pt_phone_api'),
+    url(r'^pt_timeline/(?P<pk>[0-9]+)/$',
+        views.PatientTimeline.as_view(),
+        name='pt_timeline_api'),
 ]
 
 wrap_config = {}
@@ -1,19 +1,34 @@
 from __future__ import unicode_literals
 from builtins import str
+from builtins import range
 from functools import partial
+import hashlib
 
 import django.utils.timezone
-from django.db.models import Min
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from rest_framework import generics
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
 
 from pttrack import models as coremodels
 from workup import models as workupmodels
-from referral import models as referrals
 
+from . import caching
+from . import pagination
 from . import serializers
 
 
+# the ordering of the action item lists, as annotated by
+# PatientQuerySet.with_action_items()
+SOONEST_DUE_ORDERING = ('soonest_due_date', 'pk')
+
+
 def active_patients_filter(qs):
     '''Filter a queryset of patients for those that are listed as
     active. This is used to display a subset of patients for voluneers
@@ -23,127 +38,146 @@ def active_patients_filter(qs):
 
     return qs.filter(needs_workup__exact=True).order_by('last_name')
 
-def merge_pt_querysets_by_soonest_date(qs1, qs2):
-    '''Utility function to merge two patient querysets by the
-    soonest due date. Called by active_ai_patients_filter and
-    inactive_ai_patients_filter. Requires that inputs both
-    have soonest_due_date annotated.
-    '''
-
-    patient_dict = {p: p.soonest_due_date for p in qs1}
-
-    for p in qs2:
-        if p not in patient_dict:
-            patient_dict[p] = p.soonest_due_date
-        else:
-            patient_dict[p] = min(patient_dict[p], p.soonest_due_date)
-
-    out_list = [t[0] for t in sorted(
-        [(p, soonest_due_date) for p, soonest_due_date
-         in list(patient_dict.items())],
-        key=lambda x: x[1])
-    ]
-
-    return out_list
 
 def active_ai_patients_filter(qs):
     '''Filter a queryset of patients for those that have overdue action
-    items.
+    items or referral followup requests, most overdue first.
     '''
 
-    ai_qs = coremodels.ActionItem.objects \
-        .filter(due_date__lte=django.utils.timezone.now().date()) \
-        .filter(completion_date=None) \
-        .select_related('patient')
-
-    pts_with_active_ais = coremodels.Patient.objects \
-        .filter(actionitem__in=ai_qs) \
-        .distinct().annotate(soonest_due_date=Min('actionitem__due_date'))
-
-    referral_qs = referrals.FollowupRequest.objects \
-        .filter(due_date__lte=django.utils.timezone.now().date()) \
-        .filter(completion_date=None) \
-        .select_related('patient')
-
-    pts_with_active_referrals = coremodels.Patient.objects \
-        .filter(followuprequest__in=referral_qs) \
-        .distinct().annotate(soonest_due_date=Min('followuprequest__due_date'))
-
-    out_list = merge_pt_querysets_by_soonest_date(pts_with_active_ais, pts_with_active_referrals)
-
-    return out_list
+    return qs.with_action_items(
+        Q(due_date__lte=django.utils.timezone.now().date()) &
+        Q(completion_date=None)).order_by(*SOONEST_DUE_ORDERING)
 
 
 def inactive_ai_patients_filter(qs):
-    '''Build a queryset of patients for those that have active action
-    items due in the future.
+    '''Filter a queryset of patients for those that have action items or
+    referral followup requests due in the future, soonest due first.
     '''
 
-    future_ai_pts = coremodels.Patient.objects.filter(
-        actionitem__in=coremodels.ActionItem.objects
-            .filter(due_date__gt=django.utils.timezone.now().date())
-            .filter(completion_date=None)
-            .select_related('patient')
-        ).annotate(soonest_due_date=Min('actionitem__due_date'))
-
-    future_referral_pts = coremodels.Patient.objects.filter(
-        followuprequest__in=referrals.FollowupRequest.objects
-            .filter(due_date__gt=django.utils.timezone.now().date())
-            .filter(completion_date=None)
-            .select_related('patient')
-        ).annotate(soonest_due_date=Min('followuprequest__due_date'))
-
-    out_list = merge_pt_querysets_by_soonest_date(future_ai_pts, future_referral_pts)
-
-    return out_list
+    return qs.with_action_items(
+        Q(due_date__gt=django.utils.timezone.now().date()) &
+        Q(completion_date=None)).order_by(*SOONEST_DUE_ORDERING)
 
 
 def unsigned_workup_patients_filter(qs):
-    '''Build a queryset that returs a list of patients with an unsigned
+    '''Filter a queryset of patients for those with an unsigned
     workup.
     '''
 
-    wu_qs = workupmodels.Workup.objects \
-        .filter(signer__isnull=True) \
-        .order_by('last_name') \
-        .select_related('patient')  # optimization only
+    wu_qs = workupmodels.Workup.objects.filter(signer__isnull=True)
+
+    return qs.filter(pk__in=wu_qs.values('patient'))
 
-    return coremodels.Patient.objects.filter(workup__in=wu_qs)
 
 def priority_ai_patients_filter(qs):
-    '''Build a queryset that returs a list of patients with a high priority
+    '''Filter a queryset of patients for those with a high priority
     action item.
     '''
 
-    priority_ai_pts = coremodels.Patient.objects.filter(
-        actionitem__in=coremodels.ActionItem.objects
-        .filter(priority=True)
+    ai_qs = coremodels.ActionItem.objects \
+        .filter(priority=True) \
         .filter(completion_date=None)
-        .select_related('patient')
-        ).distinct()
 
-    return priority_ai_pts
+    return qs.filter(pk__in=ai_qs.values('patient'))
 
 
 def user_cases(user, qs):
-    '''Build a queryset of the pateints that this user is the case
+    '''Filter a queryset of patients for those that this user is the case
     manager for
     '''
 
-    qs = coremodels.Patient.objects.filter(
-        case_managers=user.provider
-        )
+    return qs.filter(case_managers=user.provider)
 
-    return qs
 
+def pt_list_etag(request, *args, **kwargs):
+    '''Compute a version token for the patient list requested, which
+    changes whenever a patient, action item, referral followup, workup or
+    case manager is added, changed or deleted (i.e. whenever the cached
+    lists are invalidated; see caching.py), and at the start of each day
+    (when action items become overdue). Costs one cache lookup.
+    '''
+
+    versions = [request.get_full_path(), request.user.pk,
+                django.utils.timezone.now().date(), caching.generation()]
+
+    return hashlib.sha1(str(versions).encode('utf-8')).hexdigest()
 
-class PtList(generics.ListAPIView):  # read only
+
+class PatientSerializerMixin(object):
     '''
-    List patients
+    Serializes only the fields of patients that are asked for, loading
+    the patients all at once
     '''
 
     serializer_class = serializers.PatientSerializer
 
+    def get_requested_fields(self):
+        '''
+        The fields listed in the 'fields' query param (e.g.
+        ?fields=id,name), or None if all fields should be serialized.
+        '''
+        fields = self.request.query_params.get('fields', None)
+        if not fields:
+            return None
+
+        return [f.strip() for f in fields.split(',') if f.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'] = self.get_requested_fields()
+        return super(PatientSerializerMixin, self).get_serializer(
+            *args, **kwargs)
+
+    def hydrate(self, patient_ids):
+        '''
+        Load the patients with patient_ids, in that order, along with the
+        related objects needed to serialize the requested fields. They're
+        loaded OSLER_PT_LIST_STREAM_CHUNK_SIZE at a time, so that no query
+        has an unbounded IN list.
+        '''
+        chunk_size = settings.OSLER_PT_LIST_STREAM_CHUNK_SIZE
+        fields = self.get_requested_fields()
+
+        by_id = {}
+        for i in range(0, len(patient_ids), chunk_size):
+            patients = self.get_serializer_class().setup_eager_loading(
+                coremodels.Patient.objects.filter(
+                    pk__in=patient_ids[i:i + chunk_size]),
+                fields)
+            by_id.update((patient.pk, patient) for patient in patients)
+
+        return [by_id[pk] for pk in patient_ids if pk in by_id]
+
+
+@method_decorator(condition(etag_func=pt_list_etag), name='get')
+class PtList(PatientSerializerMixin, generics.ListAPIView):  # read only
+    '''
+    List patients
+    '''
+
+    pagination_class = pagination.KeysetPagination
+
+    def get_cache_key(self):
+        '''
+        The parts of the request that determine which patients are listed,
+        and in what order.
+        '''
+        filter_name = self.request.query_params.get('filter', None)
+        key = [filter_name,
+               self.request.query_params.get('sort', None),
+               django.utils.timezone.now().date()]
+
+        if filter_name == 'user_cases':
+            key.append(self.request.user.pk)
+
+        return key
+
+    def get_patient_ids(self):
+        '''
+        The ids of the patients to list, in order, from the cache if
+        possible.
+        '''
+        return caching.patient_ids(self.get_cache_key(), self.get_queryset)
+
     def get_queryset(self):
         '''
         Restricts returned patients according to query params
@@ -159,26 +193,144 @@ class PtList(generics.ListAPIView):  # read only
             'ai_priority': priority_ai_patients_filter
         }
 
-        def bylatestKey(pt):  # This doesn't sort by latest time, just latest date
-            latestwu = pt.latest_workup()
-            if latestwu is None:
-                latestdate = pt.history.last().history_date.date()
-            else:
-                latestdate = latestwu.clinic_day.clinic_date
-            return latestdate
-
-        queryset = coremodels.Patient.objects
+        queryset = coremodels.Patient.objects.all()
         sort = self.request.query_params.get('sort', None)
         filter_name = self.request.query_params.get('filter', None)
 
+        ordering = ('last_name', 'pk')
+
         if sort is not None:
             if str(sort) == 'latest_workup':
-                pt_list_latest = list(coremodels.Patient.objects.all())
-                pt_list_latest.sort(key=bylatestKey, reverse=True)
-                queryset = pt_list_latest
+                # This doesn't sort by latest time, just latest date. Ties
+                # are broken by putting the most recently added patient first.
+                ordering = ('-summary__latest_activity_date', '-pk')
             else:
-                queryset = queryset.order_by(sort)
+                ordering = (sort, '-pk' if sort.startswith('-') else 'pk')
 
         queryset = filter_funcs[filter_name](queryset)
 
-        return queryset
+        if filter_name in ('ai_active', 'ai_inactive'):
+            # these lists are always ordered by urgency
+            ordering = SOONEST_DUE_ORDERING
+
+        return queryset.order_by(*ordering)
+
+    def stream(self, patient_ids):
+        '''
+        Serialize the patients with patient_ids as a JSON array, a chunk of
+        patients at a time, so that neither the patients nor the JSON are
+        ever all in memory at once.
+        '''
+        renderer = JSONRenderer()
+        chunk_size = settings.OSLER_PT_LIST_STREAM_CHUNK_SIZE
+
+        yield b'['
+        first = True
+        for i in range(0, len(patient_ids), chunk_size):
+            patients = self.hydrate(patient_ids[i:i + chunk_size])
+            if not patients:
+                continue
+
+            data = self.get_serializer(patients, many=True).data
+            # strip the brackets, to splice the chunks into one array
+            chunk = renderer.render(data)[1:-1]
+            yield chunk if first else b',' + chunk
+            first = False
+        yield b']'
+
+    def list(self, request, *args, **kwargs):
+        # only the patients on the requested page are loaded from the
+        # database, and the list they're on usually comes from the cache.
+        patient_ids = self.get_patient_ids()
+
+        if request.query_params.get('stream', None) == 'true':
+            return StreamingHttpResponse(self.stream(patient_ids),
+                                         content_type='application/json')
+
+        page = self.paginate_queryset(patient_ids)
+        patients = self.hydrate(page if page is not None else patient_ids)
+        serializer = self.get_serializer(patients, many=True)
+
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+
+        return Response(serializer.data)
+
+
+class PatientSearch(PatientSerializerMixin, generics.ListAPIView):
+    '''
+    Search patients by (the beginnings of) their names, phone numbers and
+    zip codes, and by their dates of birth, best matches first
+    '''
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params['limit'])
+        except (KeyError, ValueError):
+            return settings.OSLER_PATIENT_SEARCH_LIMIT
+
+        return max(1, min(limit, settings.OSLER_PATIENT_SEARCH_MAX_LIMIT))
+
+    def get_queryset(self):
+        # patients are found through the search index by list(), not by
+        # filtering a queryset.
+        return coremodels.Patient.objects.none()
+
+    def list(self, request, *args, **kwargs):
+        patient_ids = coremodels.PatientSearchToken.objects.search(
+            request.query_params.get('q', ''), self.get_limit())
+
+        serializer = self.get_serializer(self.hydrate(patient_ids),
+                                         many=True)
+        return Response(serializer.data)
+
+
+class PhoneLookup(generics.ListAPIView):  # read only
+    '''
+    List the patients with a phone number, however it's written
+    '''
+
+    serializer_class = serializers.PatientPhoneSerializer
+
+    def get_queryset(self):
+        return coremodels.PatientPhone.objects.lookup(
+            self.request.query_params.get('number', ''))
+
+
+class PatientTimeline(generics.ListAPIView):  # read only
+    '''
+    List a patient's notes of every type, newest first
+    '''
+
+    serializer_class = serializers.TimelineNoteSerializer
+    pagination_class = pagination.KeysetPagination
+
+    def get_keyset_ordering(self):
+        return coremodels.TIMELINE_ORDERING
+
+    def get_patient(self):
+        if not hasattr(self, 'patient'):
+            self.patient = get_object_or_404(coremodels.Patient,
+                                             pk=self.kwargs['pk'])
+        return self.patient
+
+    def get_queryset(self):
+        return self.get_patient().timeline()
+
+    def filter_after_cursor(self, queryset, position):
+        # the timeline is a union, which can't be filtered, so the cursor
+        # is applied to each kind of note before they're merged.
+        return self.get_patient().timeline(after=position)
+
+    def list(self, request, *args, **kwargs):
+        rows = self.get_queryset()
+        page = self.paginate_queryset(rows)
+
+        # only the notes on the requested page are loaded
+        notes = coremodels.timeline_notes(page if page is not None else rows)
+        serializer = self.get_serializer(notes, many=True)
+
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+
+        return Response(serializer.data)
@@ -0,0 +1,195 @@
+'''Which patient (and which of their notes) each page view was of, so that
+everyone who accessed a patient's chart can be found without searching the
+urls of every page view.
+
+The patient and object are worked out from the url (by PAGEVIEW_URLS) as
+the page view is recorded, and stored in PageviewRecord.patient,
+object_type and object_id, so that a patient's access history is one
+query on the (patient, timestamp) index. When the url only identifies the
+object (e.g. a workup), finding its patient takes a query, which is made
+when the record is written (see audit.writer), rather than by the
+middleware. Page views recorded before these fields were added are filled
+in by the backfill_pageview_patients command.
+'''
+from __future__ import unicode_literals
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.urlresolvers import resolve, Resolver404
+
+from .models import PageviewRecord
+
+BACKFILL_KEY = 'audit_backfill_last_pk'
+
+# url name -> (the url kwarg that is the patient's id, the url kwarg that is
+# the id of the object viewed, the object's model label). The label is
+# formatted with the url's kwargs (for the followups, whose urls differ
+# only in their 'model'). If there's no patient kwarg, the patient is the
+# object's.
+PAGEVIEW_URLS = {
+    'patient-detail': ('pk', None, None),
+    'patient-update': ('pk', None, None),
+    'patient-activate-detail': ('pk', None, None),
+    'patient-activate-home': ('pk', None, None),
+    'pt_timeline_api': ('pk', None, None),
+
+    'new-action-item': ('pt_id', None, None),
+    'update-action-item': (None, 'pk', 'pttrack.ActionItem'),
+    'done-action-item': (None, 'ai_id', 'pttrack.ActionItem'),
+    'reset-action-item': (None, 'ai_id', 'pttrack.ActionItem'),
+
+    'new-document': ('pt_id', None, None),
+    'document-detail': (None, 'pk', 'pttrack.Document'),
+    'document-update': (None, 'pk', 'pttrack.Document'),
+
+    'new-note-dispatch': ('pt_id', None, None),
+    'new-workup': ('pt_id', None, None),
+    'workup': (None, 'pk', 'workup.Workup'),
+    'workup-update': (None, 'pk', 'workup.Workup'),
+    'workup-sign': (None, 'pk', 'workup.Workup'),
+    'workup-error': (None, 'pk', 'workup.Workup'),
+    'workup-pdf': (None, 'pk', 'workup.Workup'),
+    'new-progress-note': ('pt_id', None, None),
+    'progress-note-update': (None, 'pk', 'workup.ProgressNote'),
+    'progress-note-sign': (None, 'pk', 'workup.ProgressNote'),
+    'progress-note-detail': (None, 'pk', 'workup.ProgressNote'),
+    'new-clindate': ('pt_id', None, None),
+
+    'followup-choice': ('pt_id', None, None),
+    'new-followup': ('pt_id', None, None),
+    'new-referral-followup': ('pt_id', None, None),
+    'followup': (None, 'pk', 'followup.{model}Followup'),
+
+    'select-referral': ('pt_id', None, None),
+    'select-referral-type': ('pt_id', None, None),
+    'new-referral': ('pt_id', None, None),
+    'new-followup-request': ('pt_id', 'referral_id', 'referral.Referral'),
+    'new-patient-contact': ('pt_id', 'followup_id',
+                            'referral.FollowupRequest'),
+
+    'appointment-update': (None, 'pk', 'appointment.Appointment'),
+    'appointment-mark-no-show': (None, 'pk', 'appointment.Appointment'),
+    'appointment-mark-arrived': (None, 'pk', 'appointment.Appointment'),
+
+    'demographics-create': ('pt_id', None, None),
+    'demographics-detail': (None, 'pk', 'demographics.Demographics'),
+    'demographics-update': (None, 'pk', 'demographics.Demographics'),
+}
+
+
+def resolve_url(url):
+    '''The (patient id, object type, object id) of a page view of url, as
+    far as they can be told from the url alone (so the patient id is None
+    if it's only known from the object), or Nones if it's not of a
+    patient.'''
+    try:
+        match = resolve(url.split('?', 1)[0])
+    except Resolver404:
+        return None, None, None
+
+    patient_kwarg, object_kwarg, label = PAGEVIEW_URLS.get(
+        match.url_name, (None, None, None))
+
+    patient_id = object_type = object_id = None
+    if patient_kwarg is not None:
+        patient_id = int(match.kwargs[patient_kwarg])
+    if object_kwarg is not None:
+        object_type = label.format(**match.kwargs).lower()
+        object_id = int(match.kwargs[object_kwarg])
+
+    return patient_id, object_type, object_id
+
+
+def object_patients(objects):
+    '''The patient id of each (object type, object id) in objects (if the
+    object still exists), by (object type, object id).'''
+    ids = defaultdict(set)
+    for object_type, object_id in objects:
+        ids[object_type].add(object_id)
+
+    patients = {}
+    for object_type, object_ids in ids.items():
+        try:
+            model = apps.get_model(object_type)
+        except (LookupError, ValueError):
+            continue
+
+        for object_id, patient_id in model.objects \
+                .filter(pk__in=object_ids) \
+                .values_list('pk', 'patient_id'):
+            patients[(object_type, object_id)] = patient_id
+
+    return patients
+
+
+def fill_patients(records):
+    '''Fill in the patient of each PageviewRecord in records that is only
+    known from its object (see resolve_url()), with a query per type of
+    object.'''
+    unresolved = [record for record in records
+                  if record.patient_id is None and
+                  record.object_type is not None]
+
+    patients = object_patients((record.object_type, record.object_id)
+                               for record in unresolved)
+    for record in unresolved:
+        record.patient_id = patients.get(
+            (record.object_type, record.object_id))
+
+
+def backfill(batch_size=1000, restart=False):
+    '''Fill in the patient and object of every page view without a
+    patient, returning how many were filled in.
+
+    The last page view looked at is kept in the cache (under
+    BACKFILL_KEY), so that each run only looks at the page views recorded
+    since the last, rather than again at every one that wasn't of a
+    patient; unless restart is set, or the cache has lost it.'''
+    n = 0
+    last_pk = 0 if restart else cache.get(BACKFILL_KEY, 0)
+    while True:
+        batch = list(PageviewRecord.objects
+                     .filter(pk__gt=last_pk, patient=None)
+                     .order_by('pk')
+                     .values_list('pk', 'url', 'object_type')[:batch_size])
+        if not batch:
+            return n
+        last_pk = batch[-1][0]
+
+        resolved = {pk: resolve_url(url) for pk, url, _ in batch}
+        # those whose object was already known, but whose patient can't be
+        # found (e.g. because the object was deleted), have nothing to add
+        known_objects = {pk for pk, _, object_type in batch
+                         if object_type is not None}
+        patients = object_patients(
+            (object_type, object_id) for patient_id, object_type, object_id
+            in resolved.values()
+            if patient_id is None and object_type is not None)
+
+        # page views of the same thing are updated together
+        pks = defaultdict(list)
+        for pk, (patient_id, object_type, object_id) in resolved.items():
+            if patient_id is None and object_type is not None:
+                patient_id = patients.get((object_type, object_id))
+            if patient_id is None and pk in known_objects:
+                continue
+            if patient_id is not None or object_type is not None:
+                pks[(patient_id, object_type, object_id)].append(pk)
+
+        for (patient_id, object_type, object_id), same in pks.items():
+            PageviewRecord.objects.filter(pk__in=same).update(
+                patient_id=patient_id, object_type=object_type,
+                object_id=object_id)
+            n += len(same)
+
+        cache.set(BACKFILL_KEY, last_pk, None)
+
+
+def access_history(patient_id):
+    '''Every page view of the patient with patient_id, or of one of their
+    notes, latest first.'''
+    return PageviewRecord.objects \
+        .filter(patient_id=patient_id) \
+        .select_related('user', 'role') \
+        .order_by('-timestamp', '-pk')
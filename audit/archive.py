@@ -0,0 +1,125 @@
+'''Archival of old page views, out of the database and into compressed
+files.
+
+Page views older than OSLER_AUDIT_ARCHIVE_AFTER_DAYS are moved (by the
+archive_audit_records command) to OSLER_AUDIT_ARCHIVE_DIR, one gzipped
+file of JSON lines per month (in UTC), e.g. pageviews-2019-03.jsonl.gz. A
+batch of page views is appended to its files (as another gzip member) and
+synced to disk before it's deleted from the database, so if archiving is
+interrupted, some page views may be archived twice, but none lost; search()
+(and the search_audit_archive command) skip the repeats.
+'''
+from __future__ import unicode_literals
+from collections import defaultdict
+import glob
+import gzip
+import json
+import os
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import PageviewRecord
+
+ARCHIVE_FIELDS = ['pk', 'log_id', 'timestamp', 'user_id', 'role_id',
+                  'user_ip', 'method', 'url', 'referrer', 'status_code',
+                  'patient_id', 'object_type', 'object_id']
+
+
+def archive_month(timestamp):
+    return timezone.localtime(timestamp, timezone.utc).strftime('%Y-%m')
+
+
+def archive_path(directory, month):
+    return os.path.join(directory, 'pageviews-%s.jsonl.gz' % month)
+
+
+def archive_line(values):
+    '''The values of a page view (as from .values(*ARCHIVE_FIELDS)) as a
+    line of an archive.'''
+    values = dict(values, timestamp=values['timestamp'].isoformat())
+    return json.dumps(values, separators=(',', ':'), sort_keys=True) + '\n'
+
+
+def append_archive(path, lines):
+    '''Append lines to the archive at path, as a new gzip member, and sync
+    it to disk.'''
+    with open(path, 'ab') as f:
+        with gzip.GzipFile(fileobj=f, mode='ab') as archive:
+            archive.write(''.join(lines).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_archive(path):
+    '''The page views in the archive at path, as dicts of ARCHIVE_FIELDS.'''
+    # lines are decoded one by one, as python 2's GzipFile can't be
+    # wrapped in a TextIOWrapper
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            values = json.loads(line.decode('utf-8'))
+            values['timestamp'] = parse_datetime(values['timestamp'])
+            yield values
+
+
+def archive(before, directory, batch_size=1000):
+    '''Move every page view from before the datetime before out of the
+    database and into the archives in directory, oldest first, returning
+    how many were moved.'''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    old = PageviewRecord.objects \
+        .filter(timestamp__lt=before) \
+        .order_by('timestamp', 'pk')
+
+    n = 0
+    while True:
+        batch = list(old.values(*ARCHIVE_FIELDS)[:batch_size])
+        if not batch:
+            return n
+
+        lines = defaultdict(list)
+        for values in batch:
+            lines[archive_month(values['timestamp'])].append(
+                archive_line(values))
+        for month, month_lines in sorted(lines.items()):
+            append_archive(archive_path(directory, month), month_lines)
+
+        PageviewRecord.objects \
+            .filter(pk__in=[values['pk'] for values in batch]) \
+            .delete()
+        n += len(batch)
+
+
+def search(directory, since=None, until=None, user_id=None, url=None,
+           patient_id=None):
+    '''The archived page views (as dicts of ARCHIVE_FIELDS) at or after the
+    datetime since and before until, by the user with user_id, to urls
+    containing url, and of the patient with patient_id, as given. Only the
+    archives of the months between since and until are read.'''
+    paths = sorted(glob.glob(archive_path(directory, '*')))
+    if since is not None:
+        first = archive_path(directory, archive_month(since))
+        paths = [path for path in paths if path >= first]
+    if until is not None:
+        last = archive_path(directory, archive_month(until))
+        paths = [path for path in paths if path <= last]
+
+    for path in paths:
+        # a page view is only ever archived to its month's archive
+        seen = set()
+        for values in read_archive(path):
+            if values['pk'] in seen:
+                continue
+            seen.add(values['pk'])
+
+            if ((since is not None and values['timestamp'] < since) or
+                    (until is not None and values['timestamp'] >= until) or
+                    (user_id is not None and values['user_id'] != user_id) or
+                    (url is not None and url not in values['url']) or
+                    (patient_id is not None and
+                     values.get('patient_id') != patient_id)):
+                continue
+
+            yield values
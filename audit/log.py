@@ -0,0 +1,196 @@
+'''A write-ahead log of page views, in local files, for when the audit
+records must survive the database being briefly unavailable.
+
+With OSLER_AUDIT_LOG_DIR set, each page view is appended to a file in it
+as a line of JSON, rather than written to the database. Each process
+writes its own file, named pageviews-<host>-<pid>-<time>-<n>.jsonl.open.
+Every line is handed to the operating system as it's written (so it
+survives the process dying), but the file is only synced to disk by the
+first write OSLER_AUDIT_LOG_FSYNC_SECONDS after the last sync. Once it
+reaches OSLER_AUDIT_LOG_MAX_BYTES, or OSLER_AUDIT_LOG_ROTATE_SECONDS after
+it was opened (at the next write), or when the process exits, the file is
+synced, closed and renamed to end in .jsonl. The ingest_audit_log
+command then loads the closed files into PageviewRecord and deletes them.
+
+Every line has its own id (PageviewRecord.log_id), so a file can be
+ingested again (e.g. after an ingestion that was interrupted) without
+recording any page view twice.
+'''
+from __future__ import unicode_literals
+from builtins import object
+from builtins import range
+import atexit
+import glob
+import io
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .access import fill_patients
+from .models import PageviewRecord
+
+OPEN_SUFFIX = '.jsonl.open'
+CLOSED_SUFFIX = '.jsonl'
+
+# the keys of each line, by PageviewRecord attribute
+LOG_KEYS = [
+    ('log_id', 'id'),
+    ('timestamp', 't'),
+    ('user_id', 'u'),
+    ('role_id', 'r'),
+    ('user_ip', 'ip'),
+    ('method', 'm'),
+    ('url', 'url'),
+    ('referrer', 'ref'),
+    ('status_code', 's'),
+    ('patient_id', 'p'),
+    ('object_type', 'ot'),
+    ('object_id', 'oid'),
+]
+
+
+def record_line(record):
+    '''record (a PageviewRecord) as a line of the log.'''
+    if record.log_id is None:
+        record.log_id = uuid.uuid4().hex
+
+    values = {key: getattr(record, attr) for attr, key in LOG_KEYS}
+    values['t'] = values['t'].isoformat()
+
+    return json.dumps(values, separators=(',', ':'), sort_keys=True) + '\n'
+
+
+def line_record(line):
+    '''The PageviewRecord that line of the log records.'''
+    values = json.loads(line)
+    values['t'] = parse_datetime(values['t'])
+
+    return PageviewRecord(**{attr: values.get(key)
+                             for attr, key in LOG_KEYS})
+
+
+def read_log(path):
+    '''The PageviewRecords in the log file at path. A line that was only
+    partly written (because the process died while writing it) is
+    skipped.'''
+    records = []
+    with io.open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                records.append(line_record(line))
+            except ValueError:
+                continue
+
+    return records
+
+
+def log_files(directory, include_open=False):
+    '''The log files in directory, oldest first; only the closed ones,
+    unless include_open.'''
+    paths = glob.glob(os.path.join(directory, '*' + CLOSED_SUFFIX))
+    if include_open:
+        paths += glob.glob(os.path.join(directory, '*' + OPEN_SUFFIX))
+
+    return sorted(paths, key=os.path.getmtime)
+
+
+class AuditLog(object):
+    '''Appends PageviewRecords to this process' log file.'''
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.file = None
+        self.path = None
+        self.pid = None
+        self.opened_at = None
+        self.synced_at = None
+        self.count = 0
+        atexit.register(self.close)
+
+    def get_directory(self):
+        return self.directory or settings.OSLER_AUDIT_LOG_DIR
+
+    def open(self):
+        # the count keeps files opened in the same millisecond apart
+        self.count += 1
+        name = 'pageviews-%s-%s-%s-%s' % (
+            socket.gethostname(), os.getpid(), int(time.time() * 1000),
+            self.count)
+        self.path = os.path.join(self.get_directory(), name + OPEN_SUFFIX)
+        self.file = io.open(self.path, 'a', encoding='utf-8')
+        self.pid = os.getpid()
+        self.opened_at = self.synced_at = time.time()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.synced_at = time.time()
+
+    def rotate(self):
+        '''Close the current file and rename it, ready for ingestion.'''
+        self.sync()
+        self.file.close()
+        os.rename(self.path, self.path[:-len(OPEN_SUFFIX)] + CLOSED_SUFFIX)
+        self.file = self.path = None
+
+    def write(self, record):
+        line = record_line(record)
+
+        with self.lock:
+            if self.file is not None and self.pid != os.getpid():
+                # forked since the file was opened: it's the parent's
+                self.file = None
+            if (self.file is not None and time.time() - self.opened_at >=
+                    settings.OSLER_AUDIT_LOG_ROTATE_SECONDS):
+                # so that a quiet process' page views don't wait for its
+                # file to fill up before they're ingested
+                self.rotate()
+            if self.file is None:
+                self.open()
+
+            self.file.write(line)
+            self.file.flush()
+
+            if self.file.tell() >= settings.OSLER_AUDIT_LOG_MAX_BYTES:
+                self.rotate()
+            elif (time.time() - self.synced_at >=
+                    settings.OSLER_AUDIT_LOG_FSYNC_SECONDS):
+                self.sync()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None and self.pid == os.getpid():
+                self.rotate()
+
+
+# each process has its own file
+audit_log = AuditLog()
+
+
+def ingest(path, batch_size=500):
+    '''Load the PageviewRecords in the log file at path that aren't already
+    in the database, returning how many were loaded.'''
+    records = read_log(path)
+
+    n = 0
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        ingested = set(PageviewRecord.objects
+                       .filter(log_id__in=[r.log_id for r in batch])
+                       .values_list('log_id', flat=True))
+
+        new = [r for r in batch if r.log_id not in ingested]
+        fill_patients(new)
+        PageviewRecord.objects.bulk_create(new)
+        n += len(new)
+
+    return n
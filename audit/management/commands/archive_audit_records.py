@@ -0,0 +1,36 @@
+from __future__ import unicode_literals
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from audit.archive import archive
+
+
+class Command(BaseCommand):
+    help = '''Move the page views older than OSLER_AUDIT_ARCHIVE_AFTER_DAYS
+    out of the database, into monthly compressed archives in
+    OSLER_AUDIT_ARCHIVE_DIR, where search_audit_archive can find them.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Archive page views older than this many "
+                            "days, if not OSLER_AUDIT_ARCHIVE_AFTER_DAYS.")
+        parser.add_argument('--dir', default=None,
+                            help="The directory of the archives, if not "
+                            "OSLER_AUDIT_ARCHIVE_DIR.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="The number of page views to move at a "
+                            "time.")
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = settings.OSLER_AUDIT_ARCHIVE_AFTER_DAYS
+
+        n = archive(now() - datetime.timedelta(days=days),
+                    options['dir'] or settings.OSLER_AUDIT_ARCHIVE_DIR,
+                    batch_size=options['batch_size'])
+
+        self.stdout.write("Archived %s page views." % n)
@@ -0,0 +1,27 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from audit.access import backfill
+
+
+class Command(BaseCommand):
+    help = '''Work out which patient (and note) each page view recorded
+    before they were stored was of, from its url, so that they show up in
+    patients' access histories. Needed once after migrating to a version of
+    Osler with access histories. Only page views recorded since the last
+    run are looked at, unless --restart is given.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="The number of page views to fill in at a "
+                            "time.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Look at every page view without a "
+                            "patient again, not just those since the last "
+                            "run.")
+
+    def handle(self, *args, **options):
+        n = backfill(batch_size=options['batch_size'],
+                     restart=options['restart'])
+        self.stdout.write("Filled in %s page views." % n)
@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from audit.log import ingest, log_files
+
+
+class Command(BaseCommand):
+    help = '''Load the page views logged to OSLER_AUDIT_LOG_DIR into the
+    database, deleting each file once it's loaded. Page views already in
+    the database are skipped, so it's safe to run again after it's been
+    interrupted.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help="The directory of the log files, if not "
+                            "OSLER_AUDIT_LOG_DIR.")
+        parser.add_argument('--include-open', action='store_true',
+                            help="Also load the files still open for "
+                            "writing. Only use this for the files of "
+                            "processes that have died, since the page "
+                            "views their processes log after this are "
+                            "deleted with them.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="The number of page views to load at a "
+                            "time.")
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.OSLER_AUDIT_LOG_DIR
+        if not directory:
+            raise CommandError("No directory given, and OSLER_AUDIT_LOG_DIR "
+                               "isn't set.")
+
+        n_files = n_records = 0
+        for path in log_files(directory, options['include_open']):
+            with transaction.atomic():
+                n_records += ingest(path, batch_size=options['batch_size'])
+            os.remove(path)
+            n_files += 1
+
+        self.stdout.write("Loaded %s page views from %s files." %
+                          (n_records, n_files))
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from audit.access import access_history
+from audit.archive import search
+
+COLUMNS = ['timestamp', 'user_id', 'role_id', 'user_ip', 'method',
+           'status_code', 'object_type', 'object_id', 'url']
+
+
+class Command(BaseCommand):
+    help = '''Print every page view of a patient's chart (or of one of their
+    notes), latest first, as tab separated columns: %s.''' % \
+        ", ".join(COLUMNS)
+
+    def add_arguments(self, parser):
+        parser.add_argument('patient_id', type=int)
+        parser.add_argument('--include-archive', action='store_true',
+                            help="Also print the archived page views (see "
+                            "archive_audit_records), after the others. "
+                            "Reads every archive.")
+        parser.add_argument('--archive-dir', default=None,
+                            help="The directory of the archives, if not "
+                            "OSLER_AUDIT_ARCHIVE_DIR.")
+
+    def write(self, values):
+        values['timestamp'] = values['timestamp'].isoformat()
+        self.stdout.write("\t".join(
+            '' if values[column] is None else '%s' % values[column]
+            for column in COLUMNS))
+
+    def handle(self, *args, **options):
+        for values in access_history(options['patient_id']) \
+                .values(*COLUMNS).iterator():
+            self.write(values)
+
+        if options['include_archive']:
+            archived = list(search(
+                options['archive_dir'] or settings.OSLER_AUDIT_ARCHIVE_DIR,
+                patient_id=options['patient_id']))
+            for values in reversed(archived):
+                self.write(values)
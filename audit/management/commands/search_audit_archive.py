@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import make_aware
+
+from audit.archive import search
+
+COLUMNS = ['timestamp', 'user_id', 'role_id', 'user_ip', 'method',
+           'status_code', 'url', 'referrer']
+
+
+def parse_date(value):
+    try:
+        return make_aware(datetime.datetime.strptime(value, '%Y-%m-%d'))
+    except ValueError:
+        raise CommandError("%s isn't a date (YYYY-MM-DD)." % value)
+
+
+class Command(BaseCommand):
+    help = '''Search the archived page views (see archive_audit_records),
+    printing those found as tab separated columns: %s.''' % \
+        ", ".join(COLUMNS)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since',
+                            help="Only page views on or after this date "
+                            "(YYYY-MM-DD).")
+        parser.add_argument('--until',
+                            help="Only page views before this date "
+                            "(YYYY-MM-DD).")
+        parser.add_argument('--user',
+                            help="Only page views by the user with this "
+                            "username.")
+        parser.add_argument('--user-id', type=int,
+                            help="Only page views by the user with this id "
+                            "(e.g. if they've since been deleted).")
+        parser.add_argument('--url',
+                            help="Only page views of urls containing this.")
+        parser.add_argument('--dir', default=None,
+                            help="The directory of the archives, if not "
+                            "OSLER_AUDIT_ARCHIVE_DIR.")
+
+    def handle(self, *args, **options):
+        user_id = options['user_id']
+        if options['user'] is not None:
+            try:
+                user_id = User.objects.get(username=options['user']).pk
+            except User.DoesNotExist:
+                raise CommandError("There's no user %s." % options['user'])
+
+        found = search(
+            options['dir'] or settings.OSLER_AUDIT_ARCHIVE_DIR,
+            since=parse_date(options['since']) if options['since'] else None,
+            until=parse_date(options['until']) if options['until'] else None,
+            user_id=user_id, url=options['url'])
+
+        for values in found:
+            values['timestamp'] = values['timestamp'].isoformat()
+            self.stdout.write("\t".join(
+                '' if values[column] is None else '%s' % values[column]
+                for column in COLUMNS))
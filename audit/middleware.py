@@ -2,9 +2,11 @@ from __future__ import unicode_literals
 from builtins import object
 from django.contrib.auth.models import AnonymousUser
 
+from .access import resolve_url
 from .models import PageviewRecord
+from .writer import write_record
 
-from pttrack.models import ProviderType
+from pttrack.middleware import current_provider_type
 
 from django.conf import settings
 
@@ -26,22 +28,26 @@ class AuditMiddleware(object):
         else:
             user_ip = request.META.get('REMOTE_ADDR')
 
-        role = request.session.get('clintype_pk', None)
-
-        if role is not None:
-            role = ProviderType.objects.get(pk=role)
+        role = current_provider_type(request)
 
         if user_ip not in settings.OSLER_AUDIT_BLACK_LIST:
-            PageviewRecord.objects.create(
+            # only what the url says, so no queries are made before the
+            # response (see audit.access)
+            patient_id, object_type, object_id = resolve_url(
+                request.path_info)
+
+            write_record(PageviewRecord(
                 user=(None if isinstance(request.user, AnonymousUser)
                       else request.user),
                 role=role,
-                #role=ProviderType.objects.get(pk=role),
                 user_ip=user_ip,
                 method=request.method,
                 url=request.get_full_path(),
                 referrer=request.META.get('HTTP_REFERER', None),
-                status_code=response.status_code
-            )
+                status_code=response.status_code,
+                patient_id=patient_id,
+                object_type=object_type,
+                object_id=object_id
+            ))
 
         return response
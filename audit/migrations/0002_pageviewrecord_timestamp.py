@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pageviewrecord',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now,
+                                       editable=False),
+        ),
+    ]
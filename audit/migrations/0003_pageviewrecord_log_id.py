@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0002_pageviewrecord_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageviewrecord',
+            name='log_id',
+            field=models.CharField(blank=True, editable=False, max_length=32,
+                                   null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0003_pageviewrecord_log_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pageviewrecord',
+            index=models.Index(fields=['user', 'timestamp'], name='audit_pv_user_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pageviewrecord',
+            index=models.Index(fields=['timestamp'], name='audit_pv_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pttrack', '0015_patientphone'),
+        ('audit', '0004_pageviewrecord_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageviewrecord',
+            name='patient',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='pttrack.Patient'),
+        ),
+        migrations.AddField(
+            model_name='pageviewrecord',
+            name='object_type',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='pageviewrecord',
+            name='object_id',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pageviewrecord',
+            index=models.Index(fields=['patient', 'timestamp'], name='audit_pv_patient_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pageviewrecord',
+            index=models.Index(fields=['object_type', 'object_id'], name='audit_pv_object_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
+from builtins import object
 
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 from pttrack import models as core_models
@@ -8,6 +10,21 @@ from pttrack import models as core_models
 
 class PageviewRecord(models.Model):
 
+    class Meta(object):
+        # for finding a user's page views, and page views by time (which is
+        # also how old ones are archived, see audit.archive)
+        indexes = [
+            models.Index(fields=['user', 'timestamp'],
+                         name='audit_pv_user_timestamp_idx'),
+            models.Index(fields=['timestamp'],
+                         name='audit_pv_timestamp_idx'),
+            # for finding who accessed a patient (see audit.access)
+            models.Index(fields=['patient', 'timestamp'],
+                         name='audit_pv_patient_timestamp_idx'),
+            models.Index(fields=['object_type', 'object_id'],
+                         name='audit_pv_object_idx'),
+        ]
+
     HTTP_METHODS = ['GET', 'POST', 'HEAD', 'PUT', 'PATCH', 'DELETE',
                     'CONNECT', 'OPTIONS', 'TRACE']
 
@@ -25,7 +42,24 @@ class PageviewRecord(models.Model):
 
     status_code = models.PositiveSmallIntegerField()
 
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # the patient the page was of, and the note (or other object) of theirs,
+    # if any (see audit.access). Not a constraint, so that page views of a
+    # patient outlive them.
+    patient = models.ForeignKey(core_models.Patient, blank=True, null=True,
+                                on_delete=models.DO_NOTHING,
+                                db_constraint=False, db_index=False,
+                                related_name='+')
+    object_type = models.CharField(max_length=100, blank=True, null=True)
+    object_id = models.PositiveIntegerField(blank=True, null=True)
+
+    # not auto_now_add, which would be the time the record was written,
+    # rather than the time of the page view (see audit.writer).
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    # the id of the record in the audit log file it was ingested from, if
+    # any (see audit.log), so that it's only ingested once.
+    log_id = models.CharField(max_length=32, unique=True, blank=True,
+                              null=True, editable=False)
 
     def __str__(self):
         return '%s by %s to %s at %s' % (self.method, self.user, self.url,
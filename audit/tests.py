@@ -1,15 +1,29 @@
 from __future__ import unicode_literals
 from builtins import str
+from builtins import range
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.management import call_command
 from django.test import TestCase, override_settings
 from django.test import Client
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
+from django.utils.six import StringIO
+from django.utils.timezone import now
 
-from pttrack.models import ProviderType
+from pttrack.models import ProviderType, Patient, ActionItem, \
+    ActionInstruction
 from pttrack.test_views import build_provider, log_in_provider
 
 from .models import PageviewRecord
 from .middleware import AuditMiddleware
+from . import access, archive, log, writer
+from .writer import AuditWriter
 
 class TestAudit(TestCase):
 
@@ -99,3 +113,328 @@ class TestAudit(TestCase):
 
         n_records = PageviewRecord.objects.count()
         self.assertEquals(n_records, 0)
+
+
+class UnthreadedAuditWriter(AuditWriter):
+    '''An AuditWriter whose records are only written when it's flushed (or
+    its queue is full), since a background thread wouldn't see the test's
+    transaction.'''
+
+    def start(self):
+        return threading.current_thread()
+
+
+@override_settings(OSLER_AUDIT_BATCH_SIZE=2, OSLER_AUDIT_MAX_BUFFER=3)
+class TestAuditWriter(TestCase):
+
+    fixtures = ['pttrack.json']
+
+    def record(self, url='/pttrack/'):
+        return PageviewRecord(
+            user_ip='128.0.0.1', role=ProviderType.objects.first(),
+            method='GET', url=url, status_code=200)
+
+    def test_buffered(self):
+        writer = UnthreadedAuditWriter()
+
+        records = [self.record('/pttrack/%s' % i) for i in range(3)]
+        for record in records:
+            writer.write(record)
+        self.assertEqual(PageviewRecord.objects.count(), 0)
+
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(writer.flush(), 0)
+
+        # the records are written as they were, at the time of the views
+        self.assertEqual(
+            list(PageviewRecord.objects.order_by('pk')
+                 .values_list('url', 'timestamp')),
+            [(r.url, r.timestamp) for r in records])
+
+    def test_full_buffer_written_synchronously(self):
+        writer = UnthreadedAuditWriter()
+
+        for i in range(4):
+            writer.write(self.record())
+        self.assertEqual(PageviewRecord.objects.count(), 1)
+
+        writer.stop()
+        self.assertEqual(PageviewRecord.objects.count(), 4)
+
+        # once stopped, records are written synchronously
+        writer.write(self.record())
+        self.assertEqual(PageviewRecord.objects.count(), 5)
+
+    def test_bad_record_dropped(self):
+        writer = UnthreadedAuditWriter()
+
+        bad = self.record('/pttrack/bad')
+        bad.status_code = None
+        for record in [self.record(), bad, self.record()]:
+            writer.write(record)
+
+        # the rest of the batch is written, and the bad record isn't
+        # tried again
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(PageviewRecord.objects.count(), 2)
+
+    @override_settings(OSLER_AUDIT_BUFFERED=True)
+    def test_create_on_view_buffered(self):
+        buffered = UnthreadedAuditWriter()
+        old_writer, writer.writer = writer.writer, buffered
+        try:
+            log_in_provider(self.client, build_provider(["Attending"]))
+            self.client.get(reverse('home'))
+            self.assertEqual(PageviewRecord.objects.count(), 0)
+
+            buffered.flush()
+        finally:
+            writer.writer = old_writer
+
+        self.assertEqual(PageviewRecord.objects.filter(
+            url=reverse('home'), role='Attending').count(), 1)
+
+
+class TestAuditLog(TestCase):
+
+    fixtures = ['pttrack.json']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, url='/pttrack/'):
+        return PageviewRecord(
+            user_ip='128.0.0.1', role=ProviderType.objects.first(),
+            method='GET', url=url, status_code=200)
+
+    def test_ingest(self):
+        audit_log = log.AuditLog(self.directory)
+        records = [self.record('/pttrack/%s' % i) for i in range(3)]
+        for record in records:
+            audit_log.write(record)
+
+        # nothing is ingested until the file is closed
+        call_command('ingest_audit_log', dir=self.directory)
+        self.assertEqual(PageviewRecord.objects.count(), 0)
+
+        audit_log.close()
+        call_command('ingest_audit_log', dir=self.directory)
+
+        self.assertEqual(
+            list(PageviewRecord.objects.order_by('pk')
+                 .values_list('url', 'role', 'timestamp')),
+            [(r.url, r.role_id, r.timestamp) for r in records])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_ingest_idempotent(self):
+        audit_log = log.AuditLog(self.directory)
+        for i in range(3):
+            audit_log.write(self.record())
+        audit_log.close()
+
+        path = log.log_files(self.directory)[0]
+        # a line the process died in the middle of writing
+        with open(path, 'a') as f:
+            f.write('{"id":"abc')
+
+        self.assertEqual(log.ingest(path), 3)
+        self.assertEqual(log.ingest(path), 0)
+        self.assertEqual(PageviewRecord.objects.count(), 3)
+
+    @override_settings(OSLER_AUDIT_LOG_MAX_BYTES=500)
+    def test_rotation(self):
+        audit_log = log.AuditLog(self.directory)
+        for i in range(10):
+            audit_log.write(self.record())
+        audit_log.close()
+
+        paths = log.log_files(self.directory)
+        self.assertGreater(len(paths), 1)
+        self.assertEqual(sum(len(log.read_log(p)) for p in paths), 10)
+
+    def test_rotation_by_age(self):
+        audit_log = log.AuditLog(self.directory)
+        audit_log.write(self.record())
+        self.assertEqual(log.log_files(self.directory), [])
+
+        # the next write after the file is old enough closes it first
+        audit_log.opened_at -= settings.OSLER_AUDIT_LOG_ROTATE_SECONDS
+        audit_log.write(self.record())
+        paths = log.log_files(self.directory)
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(len(log.read_log(paths[0])), 1)
+
+        audit_log.close()
+        self.assertEqual(len(log.log_files(self.directory)), 2)
+
+    def test_create_on_view_logged(self):
+        with override_settings(OSLER_AUDIT_LOG_DIR=self.directory):
+            try:
+                log_in_provider(self.client, build_provider(["Attending"]))
+                self.client.get(reverse('home'))
+            finally:
+                log.audit_log.close()
+
+        self.assertEqual(PageviewRecord.objects.count(), 0)
+
+        call_command('ingest_audit_log', dir=self.directory)
+        self.assertEqual(PageviewRecord.objects.filter(
+            url=reverse('home'), role='Attending').count(), 1)
+
+
+class TestAuditArchive(TestCase):
+
+    fixtures = ['pttrack.json']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, timestamp, url='/pttrack/', user=None):
+        return PageviewRecord.objects.create(
+            user=user, user_ip='128.0.0.1',
+            role=ProviderType.objects.first(), method='GET', url=url,
+            status_code=200, timestamp=timestamp)
+
+    def test_archive_and_search(self):
+        user = build_provider(["Attending"]).associated_user
+        old = now() - datetime.timedelta(days=400)
+        older = old - datetime.timedelta(days=40)
+
+        self.record(older, url='/pttrack/patient/1/', user=user)
+        self.record(older, url='/pttrack/patient/2/')
+        self.record(old, url='/pttrack/patient/1/', user=user)
+        recent = self.record(now())
+
+        out = StringIO()
+        call_command('archive_audit_records', dir=self.directory,
+                     batch_size=2, stdout=out)
+        self.assertIn("Archived 3 page views.", out.getvalue())
+
+        self.assertEqual(list(PageviewRecord.objects.all()), [recent])
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+        found = list(archive.search(self.directory, user_id=user.pk))
+        self.assertEqual([values['timestamp'] for values in found],
+                         [older, old])
+
+        found = list(archive.search(
+            self.directory, url='patient/1',
+            since=old - datetime.timedelta(days=1)))
+        self.assertEqual(len(found), 1)
+
+        out = StringIO()
+        call_command('search_audit_archive', dir=self.directory,
+                     user=user.username, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+    def test_search_skips_repeats(self):
+        record = self.record(now() - datetime.timedelta(days=400))
+        values = PageviewRecord.objects.values(*archive.ARCHIVE_FIELDS) \
+            .get(pk=record.pk)
+
+        # as if archiving was interrupted after writing the archive
+        path = archive.archive_path(
+            self.directory, archive.archive_month(record.timestamp))
+        archive.append_archive(path, [archive.archive_line(values)])
+
+        archive.archive(now(), self.directory)
+        self.assertEqual(PageviewRecord.objects.count(), 0)
+        self.assertEqual(len(list(archive.search(self.directory))), 1)
+
+
+class TestPatientAccess(TestCase):
+
+    fixtures = ['pttrack.json']
+
+    def setUp(self):
+        self.provider = log_in_provider(
+            self.client, build_provider(["Attending"]))
+        self.patient = Patient.objects.get(pk=1)
+        self.action_item = ActionItem.objects.create(
+            instruction=ActionInstruction.objects.first(), comments="",
+            due_date=now().date(), author=self.provider,
+            author_type=self.provider.clinical_roles.first(),
+            patient=self.patient)
+
+    def test_record_patient(self):
+        self.client.get(reverse('patient-detail', args=(self.patient.pk,)))
+        self.client.get(reverse('update-action-item',
+                                args=(self.action_item.pk,)))
+        self.client.get(reverse('home'))
+
+        self.assertEqual(
+            list(access.access_history(self.patient.pk)
+                 .values_list('object_type', 'object_id')),
+            [('pttrack.actionitem', self.action_item.pk), (None, None)])
+
+        # the history is a single query, on the patient alone
+        with self.assertNumQueries(1):
+            list(access.access_history(self.patient.pk))
+
+    @override_settings(OSLER_AUDIT_BUFFERED=True)
+    def test_record_patient_buffered(self):
+        buffered = UnthreadedAuditWriter()
+        old_writer, writer.writer = writer.writer, buffered
+        try:
+            self.client.get(reverse('update-action-item',
+                                    args=(self.action_item.pk,)))
+            buffered.flush()
+        finally:
+            writer.writer = old_writer
+
+        # queued records' patients are looked up when they're written
+        self.assertEqual(PageviewRecord.objects.filter(
+            object_type='pttrack.actionitem',
+            patient=self.patient).count(), 1)
+
+    def test_backfill(self):
+        for url in [reverse('patient-detail', args=(self.patient.pk,)),
+                    reverse('update-action-item',
+                            args=(self.action_item.pk,)) + '?next=/',
+                    reverse('home')]:
+            PageviewRecord.objects.create(
+                user_ip='128.0.0.1', method='GET', url=url, status_code=200)
+
+        out = StringIO()
+        call_command('backfill_pageview_patients', batch_size=2,
+                     restart=True, stdout=out)
+        self.assertIn("Filled in 2 page views.", out.getvalue())
+
+        # the next run only looks at page views recorded since
+        PageviewRecord.objects.filter(patient=self.patient).update(
+            patient=None, object_type=None, object_id=None)
+        self.assertEqual(access.backfill(), 0)
+        self.assertEqual(access.backfill(restart=True), 2)
+
+        self.assertEqual(
+            set(access.access_history(self.patient.pk)
+                .values_list('object_type', 'object_id')),
+            {('pttrack.actionitem', self.action_item.pk), (None, None)})
+
+        out = StringIO()
+        call_command('patient_access_report', self.patient.pk, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+    def test_report_view(self):
+        self.client.get(reverse('patient-detail', args=(self.patient.pk,)))
+        url = reverse('patient-access', args=(self.patient.pk,))
+
+        # only for staff
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+        user = self.provider.associated_user
+        user.is_staff = True
+        user.save()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(
+            response, reverse('patient-detail', args=(self.patient.pk,)))
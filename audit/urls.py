@@ -0,0 +1,10 @@
+from __future__ import unicode_literals
+from django.conf.urls import url
+
+from . import views
+
+urlpatterns = [
+    url(r'^patient/(?P<pk>[0-9]+)/$',
+        views.patient_access,
+        name='patient-access'),
+]
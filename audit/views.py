@@ -0,0 +1,35 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.shortcuts import render
+
+from pttrack.models import Patient
+
+from .access import access_history
+
+
+@staff_member_required
+def patient_access(request, pk):
+    '''Everyone who viewed the patient with pk's chart (or one of their
+    notes), latest first. Works for patients who have since been deleted,
+    too.'''
+
+    paginator = Paginator(access_history(pk),
+                          settings.OSLER_AUDIT_ACCESS_PER_PAGE,
+                          allow_empty_first_page=True)
+
+    page = request.GET.get('page')
+    try:
+        pageviews = paginator.page(page)
+    except PageNotAnInteger:
+        pageviews = paginator.page(1)
+    except EmptyPage:
+        pageviews = paginator.page(paginator.num_pages)
+
+    return render(request, 'audit/patient-access.html', {
+        'patient': Patient.objects.filter(pk=pk).first(),
+        'patient_id': pk,
+        'object_list': pageviews,
+    })
@@ -0,0 +1,163 @@
+'''Writing PageviewRecords without holding up the response.
+
+With OSLER_AUDIT_BUFFERED set, records are queued in the memory of the
+process and written (with bulk_create) by a background thread, whenever
+OSLER_AUDIT_BATCH_SIZE of them have been queued or every
+OSLER_AUDIT_FLUSH_SECONDS, and when the process exits. If the queue
+reaches OSLER_AUDIT_MAX_BUFFER records (because the database is slow),
+more are written synchronously. A batch that fails to be written is
+written a record at a time instead, and any record that still can't be
+written is logged and dropped.
+
+Without it (the default), each record is written before the response is
+returned, so that no page view can go unrecorded if the process dies.
+'''
+from __future__ import unicode_literals
+from builtins import object
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .access import fill_patients
+from .log import audit_log
+from .models import PageviewRecord
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter(object):
+    '''Queues PageviewRecords, and writes them in batches from a background
+    thread.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # only one batch is written at a time, so that they're in order
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.reset()
+        atexit.register(self.stop)
+
+    def reset(self):
+        self.buffer = []
+        self.thread = None
+        self.stopping = False
+        self.pid = os.getpid()
+
+    def write(self, record):
+        '''Queue record to be written, or write it now if the queue is
+        full (or the writer has been stopped).'''
+        with self.lock:
+            if self.pid != os.getpid():
+                # forked (e.g. into a worker) since the queue was made; the
+                # thread didn't come with us, and the parent will write its
+                # own records.
+                self.reset()
+
+            if (self.stopping or
+                    len(self.buffer) >= settings.OSLER_AUDIT_MAX_BUFFER):
+                queued = None
+            else:
+                self.buffer.append(record)
+                queued = len(self.buffer)
+
+            if queued is not None and self.thread is None:
+                self.thread = self.start()
+
+        if queued is None:
+            record.save()
+        elif queued >= settings.OSLER_AUDIT_BATCH_SIZE:
+            self.wakeup.set()
+
+    def start(self):
+        '''Start the background thread, returning it.'''
+        thread = threading.Thread(target=self.run, name='audit-writer')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def flush(self):
+        '''Write every queued record, returning how many were written.'''
+        with self.flush_lock:
+            with self.lock:
+                records, self.buffer = self.buffer, []
+
+            if not records:
+                return 0
+
+            try:
+                with transaction.atomic():
+                    fill_patients(records)
+            except Exception:
+                logger.exception("Couldn't find the patients of %s page "
+                                 "views; backfill_pageview_patients will.",
+                                 len(records))
+
+            try:
+                with transaction.atomic():
+                    PageviewRecord.objects.bulk_create(
+                        records, batch_size=settings.OSLER_AUDIT_BATCH_SIZE)
+                return len(records)
+            except Exception:
+                logger.exception("Couldn't write %s page view records at "
+                                 "once; writing them one by one.",
+                                 len(records))
+
+            # so that one bad record can't hold up (or, put back on the
+            # queue, endlessly retry) the rest of the batch
+            written = 0
+            for record in records:
+                try:
+                    with transaction.atomic():
+                        record.save()
+                    written += 1
+                except Exception:
+                    logger.exception("Couldn't write page view record %s; "
+                                     "it has been dropped.", record)
+
+            return written
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(settings.OSLER_AUDIT_FLUSH_SECONDS)
+            self.wakeup.clear()
+
+            self.flush()
+            # the thread has its own connection; don't hold it open (or let
+            # it go stale) between batches.
+            connection.close()
+
+    def stop(self):
+        '''Stop the background thread, and write whatever is still
+        queued.'''
+        self.stopping = True
+        self.wakeup.set()
+
+        thread = self.thread
+        if (thread is not None and thread.is_alive() and
+                thread is not threading.current_thread()):
+            thread.join(settings.OSLER_AUDIT_FLUSH_SECONDS)
+
+        self.flush()
+
+
+# each process has its own queue
+writer = AuditWriter()
+
+
+def write_record(record):
+    '''Write the PageviewRecord record, to the audit log file if
+    OSLER_AUDIT_LOG_DIR is set (see audit.log), or else to the database,
+    or queue it to be written, as set by OSLER_AUDIT_BUFFERED.'''
+    if settings.OSLER_AUDIT_LOG_DIR:
+        audit_log.write(record)
+    elif settings.OSLER_AUDIT_BUFFERED:
+        writer.write(record)
+    else:
+        # the queued and logged records' patients are filled in when
+        # they're written to the database
+        fill_patients([record])
+        record.save()
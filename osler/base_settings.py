@@ -45,6 +45,7 @@ MIDDLEWARE = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'pttrack.middleware.ProviderMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -127,9 +128,56 @@ OSLER_WORKUP_COPY_FORWARD_MESSAGE = (u"Migrated from previous workup on {date}"
                                      u". Please delete this heading and modify"
                                      u" the following:\n\n{contents}")
 
+# How long (in seconds) to keep the lists of patients behind the patient
+# list API. They're invalidated whenever they change, so this only bounds
+# the memory used by lists nobody asks for again.
+OSLER_PT_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# How many patients to load and serialize at a time when streaming the
+# patient list API (?stream=true).
+OSLER_PT_LIST_STREAM_CHUNK_SIZE = 100
+
+# How many patients the patient search API returns by default, and at most
+# (?limit=).
+OSLER_PATIENT_SEARCH_LIMIT = 20
+OSLER_PATIENT_SEARCH_MAX_LIMIT = 100
+
+# The small tables of reference data that are cached in each process (see
+# pttrack/reference.py), and how often (in seconds) each process checks
+# whether another has changed one of them.
+OSLER_REFERENCE_MODELS = [
+    ('pttrack', 'Language'),
+    ('pttrack', 'Ethnicity'),
+    ('pttrack', 'Gender'),
+    ('pttrack', 'ContactMethod'),
+    ('pttrack', 'ActionInstruction'),
+    ('pttrack', 'ProviderType'),
+    ('pttrack', 'ReferralType'),
+    ('pttrack', 'DocumentType'),
+    ('pttrack', 'Outcome'),
+    ('workup', 'DiagnosisType'),
+    ('workup', 'ClinicType'),
+    ('followup', 'ContactResult'),
+    ('followup', 'NoAptReason'),
+    ('followup', 'NoShowReason'),
+    ('demographics', 'IncomeRange'),
+    ('demographics', 'EducationLevel'),
+    ('demographics', 'WorkStatus'),
+    ('demographics', 'ResourceAccess'),
+    ('demographics', 'ChronicCondition'),
+    ('demographics', 'TransportationOption')]
+OSLER_REFERENCE_CACHE_CHECK_SECONDS = 5
+
+# How long (in seconds) to keep the choices of providers (and their HTML)
+# offered by forms like the workup's. They're invalidated whenever providers
+# change, so this only bounds the memory used by stale choices.
+OSLER_PROVIDER_CHOICES_CACHE_TIMEOUT = 60 * 60 * 24
+
 # Dashboard settings
 OSLER_CLINIC_DAYS_PER_PAGE = 20
 
+OSLER_PATIENTS_PER_PAGE = 50
+
 OSLER_DEFAULT_DASHBOARD = 'home'
 OSLER_PROVIDERTYPE_DASHBOARDS = {
     'Attending': 'dashboard-attending'
@@ -137,3 +185,31 @@ OSLER_PROVIDERTYPE_DASHBOARDS = {
 
 # List of IP addresses to exclude from audit
 OSLER_AUDIT_BLACK_LIST = []
+
+# Whether page views are recorded by a background thread, in batches of
+# OSLER_AUDIT_BATCH_SIZE or every OSLER_AUDIT_FLUSH_SECONDS, rather than
+# before each response (see audit/writer.py). Past OSLER_AUDIT_MAX_BUFFER
+# queued records, they're written before the response again.
+OSLER_AUDIT_BUFFERED = False
+OSLER_AUDIT_BATCH_SIZE = 100
+OSLER_AUDIT_FLUSH_SECONDS = 2
+OSLER_AUDIT_MAX_BUFFER = 10000
+
+# If set, the directory page views are instead logged to, as files that
+# are loaded into the database by `manage.py ingest_audit_log` (see
+# audit/log.py). Each process' file is synced to disk at most every
+# OSLER_AUDIT_LOG_FSYNC_SECONDS, and closed (ready to be loaded) once it
+# reaches OSLER_AUDIT_LOG_MAX_BYTES or is OSLER_AUDIT_LOG_ROTATE_SECONDS
+# old.
+OSLER_AUDIT_LOG_DIR = None
+OSLER_AUDIT_LOG_FSYNC_SECONDS = 1
+OSLER_AUDIT_LOG_MAX_BYTES = 16 * 1024 * 1024
+OSLER_AUDIT_LOG_ROTATE_SECONDS = 60 * 60
+
+# Where page views older than OSLER_AUDIT_ARCHIVE_AFTER_DAYS are moved by
+# `manage.py archive_audit_records` (see audit/archive.py).
+OSLER_AUDIT_ARCHIVE_DIR = os.path.join(BASE_DIR, 'audit_archive/')
+OSLER_AUDIT_ARCHIVE_AFTER_DAYS = 365
+
+# How many page views the patient access history shows at a time.
+OSLER_AUDIT_ACCESS_PER_PAGE = 100
@@ -46,3 +46,13 @@ DATABASES = {
         'OPTIONS': {'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"}
     }
 }
+
+# the cache must be shared between processes, so that saving a note in one
+# invalidates the patient lists cached by all of them. Create the table
+# with `manage.py createcachetable`.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'osler_cache',
+    }
+}
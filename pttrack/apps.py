@@ -0,0 +1,63 @@
+from __future__ import unicode_literals
+
+from django.apps import AppConfig
+from django.db.models.signals import pre_save, post_save, post_delete, \
+    m2m_changed
+
+
+class PttrackConfig(AppConfig):
+    name = 'pttrack'
+
+    def ready(self):
+        from workup.models import ClinicDate, Workup
+        from .models import Patient, todo_list_models, summarize_patient, \
+            resummarize_note_patient, resummarize_clinic_date_patients, \
+            index_patient_search_tokens, index_patient_phones, Provider, \
+            ProviderType
+        from . import duplicates, reference, provider_choices
+
+        post_save.connect(summarize_patient, sender=Patient,
+                          dispatch_uid='patient_summary_patient')
+
+        post_save.connect(index_patient_search_tokens, sender=Patient,
+                          dispatch_uid='patient_search_tokens')
+        post_save.connect(index_patient_phones, sender=Patient,
+                          dispatch_uid='patient_phones')
+
+        pre_save.connect(duplicates.set_name_keys, sender=Patient,
+                         dispatch_uid='duplicates_name_keys')
+        post_save.connect(duplicates.index_patient, sender=Patient,
+                          dispatch_uid='duplicates_index_save')
+        post_delete.connect(duplicates.unindex_patient, sender=Patient,
+                            dispatch_uid='duplicates_index_delete')
+
+        for model in [Workup] + todo_list_models():
+            post_save.connect(resummarize_note_patient, sender=model,
+                              dispatch_uid='patient_summary_save_%s' %
+                              model._meta.label_lower)
+            post_delete.connect(resummarize_note_patient, sender=model,
+                                dispatch_uid='patient_summary_delete_%s' %
+                                model._meta.label_lower)
+
+        post_save.connect(resummarize_clinic_date_patients, sender=ClinicDate,
+                          dispatch_uid='patient_summary_clinic_date')
+
+        for model in reference.reference_models():
+            post_save.connect(reference.invalidate, sender=model,
+                              dispatch_uid='reference_save_%s' %
+                              model._meta.label_lower)
+            post_delete.connect(reference.invalidate, sender=model,
+                                dispatch_uid='reference_delete_%s' %
+                                model._meta.label_lower)
+        reference.install()
+
+        for model in [Provider, ProviderType]:
+            post_save.connect(provider_choices.invalidate, sender=model,
+                              dispatch_uid='provider_choices_save_%s' %
+                              model._meta.label_lower)
+            post_delete.connect(provider_choices.invalidate, sender=model,
+                                dispatch_uid='provider_choices_delete_%s' %
+                                model._meta.label_lower)
+        m2m_changed.connect(provider_choices.invalidate,
+                            sender=Provider.clinical_roles.through,
+                            dispatch_uid='provider_choices_roles')
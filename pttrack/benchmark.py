@@ -0,0 +1,162 @@
+'''A benchmark of Osler's heaviest pages against synthetic clinics of
+increasing size (built with the generate_clinic_data command).
+
+For each page and clinic size we record the number of queries, the wall
+time and (where tracemalloc is available) the peak memory allocated while
+handling the request. A page whose query count keeps growing with the size
+of the clinic is making queries per row, which is what the benchmark is
+mostly there to catch.
+'''
+from __future__ import unicode_literals
+from __future__ import division
+from builtins import object
+from builtins import zip
+from collections import OrderedDict, namedtuple
+import time
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+
+from workup.models import Workup
+from . import models
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+PT_LIST_FILTERS = [None, 'active', 'ai_active', 'ai_inactive',
+                   'unsigned_workup', 'user_cases', 'ai_priority']
+
+Measurement = namedtuple('Measurement',
+                         ['status_code', 'queries', 'seconds', 'peak_bytes'])
+
+
+def pages(patient, workup):
+    '''The (name, url) of each page benchmarked. The patient and workup
+    pages are shown for the given patient and workup.'''
+
+    urls = [
+        ('home_page', reverse('home')),
+        ('all_patients', reverse('all-patients')),
+        ('patient_detail', reverse('patient-detail', args=(patient.pk,))),
+        ('clinic_date_list', reverse('clindate-list')),
+        ('dashboard_attending', reverse('dashboard-attending')),
+        ('appointment_list', reverse('appointment-list')),
+        ('pdf_workup', reverse('workup-pdf', args=(workup.pk,))),
+        ('pt_search', reverse('pt_search_api') + '?q=' + patient.last_name),
+    ]
+
+    for filter_name in PT_LIST_FILTERS:
+        url = reverse('pt_list_api') + '?sort=latest_workup'
+        if filter_name is not None:
+            url += '&filter=' + filter_name
+        urls.append(('pt_list:%s' % filter_name, url))
+
+    return urls
+
+
+def measure(client, url):
+    '''Request url with client, and measure the queries, time and memory
+    it takes.'''
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        seconds = time.time() - start
+
+    peak_bytes = None
+    if tracemalloc is not None:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return Measurement(response.status_code, len(queries), seconds,
+                       peak_bytes)
+
+
+class Benchmark(object):
+    '''Grows a synthetic clinic through each of sizes (numbers of
+    patients), measuring every page at each size.'''
+
+    def __init__(self, sizes, seed=0):
+        self.sizes = sorted(sizes)
+        self.seed = seed
+        self.results = OrderedDict()
+
+    def log_in(self, client):
+        '''Sign in as the attending who has seen the most patients, as a
+        coordinator, so that every page (including staff-only ones) can
+        be shown.'''
+
+        provider = models.Provider.objects \
+            .filter(clinical_roles__signs_charts=True) \
+            .annotate(n_workups=Count('attending_physician')) \
+            .order_by('-n_workups', 'pk') \
+            .first()
+
+        coordinator = models.ProviderType.objects \
+            .filter(staff_view=True).first()
+        provider.clinical_roles.add(coordinator)
+
+        client.force_login(provider.associated_user)
+        session = client.session
+        session['clintype_pk'] = coordinator.pk
+        session.save()
+
+    def run(self):
+        n_patients = 0
+        for size in self.sizes:
+            call_command('generate_clinic_data',
+                         patients=size - n_patients,
+                         providers=max(size // 20, 5),
+                         seed=self.seed + size, years=1,
+                         stdout=StringIO())
+            n_patients = size
+
+            # the busiest patient, so that their chart grows with the clinic
+            patient = models.Patient.objects \
+                .annotate(n_workups=Count('workup')) \
+                .order_by('-n_workups', 'pk') \
+                .first()
+            workup = Workup.objects.filter(patient=patient).first()
+
+            client = Client()
+            self.log_in(client)
+
+            for name, url in pages(patient, workup):
+                # the first request warms up caches (ours and django's)
+                client.get(url)
+                self.results.setdefault(name, []).append(
+                    measure(client, url))
+
+        return self.results
+
+    def scaling_pages(self):
+        '''The names of the pages whose query count grew between the two
+        largest clinics.'''
+        return [name for name, measurements in self.results.items()
+                if measurements[-1].queries > measurements[-2].queries]
+
+    def report(self):
+        '''A table of the results, one row per page and size.'''
+
+        lines = ['%-28s %8s %6s %8s %10s %10s' % (
+            'page', 'patients', 'status', 'queries', 'ms', 'peak KiB')]
+        for name, measurements in self.results.items():
+            for size, m in zip(self.sizes, measurements):
+                lines.append('%-28s %8d %6d %8d %10.1f %10s' % (
+                    name, size, m.status_code, m.queries, m.seconds * 1000,
+                    '-' if m.peak_bytes is None else m.peak_bytes // 1024))
+
+        return '\n'.join(lines)
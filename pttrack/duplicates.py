@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+'''Finding the patients who might already be in Osler, before a new one is
+taken in (preintake).
+
+Each patient's names are stored normalized (name_key()) and as Soundex
+codes (soundex()), next to the names themselves, so that the index can be
+built from the database without recomputing them. The index lives in the
+memory of each process: the distinct last names starting with each letter
+are kept in a BK-tree, which finds every name within a few edits of a
+query without comparing it to all of them.
+
+The index is kept up to date as patients are saved and deleted (see
+PttrackConfig.ready()). Once committed, every change to a patient's last
+name (including adding or deleting the patient) also bumps a "generation"
+in the cache, and is kept in the cache under its new generation, so that
+the other
+processes can catch up by applying the changes they missed. A process
+only rebuilds its index from the database when it has missed more than
+MAX_CHANGES, or some of them are no longer in the cache (e.g. after a
+bulk change, which only bumps the generation).
+'''
+from __future__ import unicode_literals
+from builtins import object
+from builtins import range
+from collections import defaultdict
+from functools import partial
+import unicodedata
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'duplicate_index_generation'
+CHANGE_KEY = 'duplicate_index_change:%s'
+
+# how many changes a process will catch up on before it would rather
+# rebuild its index, and how long (in seconds) each is kept for
+MAX_CHANGES = 1000
+CHANGE_TIMEOUT = 60 * 60 * 24
+
+# how many generations a process will try to claim for a change before
+# giving up on recording it (see record_change())
+MAX_CLAIM_ATTEMPTS = 10
+
+SOUNDEX_CODES = dict(
+    [(letter, '1') for letter in 'bfpv'] +
+    [(letter, '2') for letter in 'cgjkqsxz'] +
+    [(letter, '3') for letter in 'dt'] +
+    [('l', '4')] +
+    [(letter, '5') for letter in 'mn'] +
+    [('r', '6')])
+
+
+def name_key(name):
+    '''The letters of name, lower case and without accents, e.g.
+    "O'Brien-Núñez" -> "obriennunez".'''
+    if not name:
+        return ''
+
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in decomposed.lower() if 'a' <= c <= 'z')
+
+
+def soundex(key):
+    '''The (American) Soundex code of a name_key(), e.g. "robert" and
+    "rupert" -> "r163", or '' for an empty key.'''
+    if not key:
+        return ''
+
+    code = key[0]
+    last = SOUNDEX_CODES.get(key[0])
+    for c in key[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit is not None and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w don't separate letters with the same code; vowels do.
+        if c not in 'hw':
+            last = digit
+
+    return code.ljust(4, '0')
+
+
+def edit_distance(a, b):
+    '''The Levenshtein distance between a and b: the fewest letters that
+    must be added, removed or changed to turn one into the other.'''
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a):
+        current = [i + 1]
+        for j, cb in enumerate(b):
+            current.append(min(previous[j + 1] + 1,
+                               current[j] + 1,
+                               previous[j] + (ca != cb)))
+        previous = current
+
+    return previous[-1]
+
+
+def max_edits(key):
+    '''How many typos to allow in a name that is key: none in very short
+    names (which are all within a couple of edits of each other), and
+    more in long ones.'''
+    if len(key) < 3:
+        return 0
+    if len(key) < 8:
+        return 1
+    return 2
+
+
+def name_distance(query_key, key, sound):
+    '''How far the name key (whose soundex() is sound) is from query_key,
+    or None if it is too far to be the same name. Names that sound the
+    same always match; otherwise the first letter (which people rarely
+    get wrong) must match, and only a few typos are allowed.'''
+    if key == query_key:
+        return 0
+
+    distance = edit_distance(query_key, key)
+    if key[:1] == query_key[:1] and distance <= max_edits(query_key):
+        return distance
+    if sound == soundex(query_key):
+        return distance
+
+    return None
+
+
+def first_name_distance(query_key, key, sound):
+    '''Like name_distance(), except that first names are often
+    abbreviated (ben for benjamin), so names starting with query_key
+    match too.'''
+    if key.startswith(query_key):
+        return 0
+    return name_distance(query_key, key, sound)
+
+
+def date_of_birth_distance(query, date_of_birth):
+    '''0 if the dates of birth match (or query is None), 1 if they might
+    be the same date mistyped (one of the year, month and day wrong, or
+    the month and day swapped), and 2 otherwise.'''
+    if query is None or query == date_of_birth:
+        return 0
+
+    same = [query.year == date_of_birth.year,
+            query.month == date_of_birth.month,
+            query.day == date_of_birth.day]
+    swapped = (query.year == date_of_birth.year and
+               query.month == date_of_birth.day and
+               query.day == date_of_birth.month)
+
+    return 1 if sum(same) == 2 or swapped else 2
+
+
+class BKTree(object):
+    '''A Burkhard-Keller tree of strings under edit distance.
+
+    Each node's children are keyed by their distance from it, so (by the
+    triangle inequality) a search for the words within n edits of a query
+    that is d edits from a node only has to visit the children between
+    d - n and d + n. Words can be added, but not removed.
+    '''
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+
+        node_word, children = self.root
+        while True:
+            distance = edit_distance(word, node_word)
+            if distance == 0:
+                return
+            if distance not in children:
+                children[distance] = (word, {})
+                return
+            node_word, children = children[distance]
+
+    def search(self, word, max_distance):
+        '''The words in the tree within max_distance edits of word.'''
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= max_distance:
+                found.append(node_word)
+
+            nodes.extend(
+                child for child_distance, child in children.items()
+                if abs(child_distance - distance) <= max_distance)
+
+        return found
+
+
+def generation():
+    '''The current generation of the patients' names.'''
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        current = 0
+        cache.add(GENERATION_KEY, current, None)
+
+    return current
+
+
+def bump_generation():
+    '''Bump the generation of the patients' names, returning the new
+    generation.'''
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        # the generation has not been set yet (or has been evicted)
+        cache.add(GENERATION_KEY, 1, None)
+        return None
+
+
+def record_change(change):
+    '''Record change, a (pk, last name key, last name sound) of a
+    patient, under a new generation of its own, returning the generation
+    (or None if it couldn't be recorded, in which case the other processes
+    will rebuild their indexes).
+
+    incr() isn't atomic on every cache backend (e.g. the database cache),
+    so two processes may be handed the same generation. It's only claimed
+    by adding the change under it, which fails for all but one of them;
+    the others move on to the next generation.'''
+    for attempt in range(MAX_CLAIM_ATTEMPTS):
+        new_generation = bump_generation()
+        if new_generation is None:
+            return None
+        if cache.add(CHANGE_KEY % new_generation, change, CHANGE_TIMEOUT):
+            return new_generation
+
+    return None
+
+
+class DuplicateIndex(object):
+    '''The names of every patient, indexed for finding near matches.'''
+
+    def __init__(self):
+        self.generation = None
+        self.clear()
+
+    def clear(self):
+        # the first letter of last names -> BKTree of those last names
+        self.trees = defaultdict(BKTree)
+        # soundex code -> last names with it
+        self.sounds = defaultdict(set)
+        # last name -> pks of patients with it
+        self.last_names = defaultdict(set)
+        # pk -> last name of the patient
+        self.patients = {}
+
+    def add(self, pk, last_name_key, last_name_sound):
+        self.remove(pk)
+        if not last_name_key:
+            return
+
+        self.patients[pk] = last_name_key
+        self.last_names[last_name_key].add(pk)
+        self.trees[last_name_key[0]].add(last_name_key)
+        self.sounds[last_name_sound].add(last_name_key)
+
+    def remove(self, pk):
+        # the name stays in the trees (which can't remove it), but won't
+        # lead to any patients.
+        last_name_key = self.patients.pop(pk, None)
+        if last_name_key is not None:
+            self.last_names[last_name_key].discard(pk)
+
+    def rebuild(self):
+        Patient = apps.get_model('pttrack', 'Patient')
+
+        self.generation = generation()
+        self.clear()
+        for pk, key, sound in Patient.objects.values_list(
+                'pk', 'last_name_key', 'last_name_sound').iterator():
+            self.add(pk, key, sound)
+
+    def apply(self, pk, last_name_key, last_name_sound):
+        if last_name_key is None:
+            self.remove(pk)
+        else:
+            self.add(pk, last_name_key, last_name_sound)
+
+    def sync(self):
+        '''Bring the index up to date with the patients changed since it
+        was built (or last synced), by this process or another.'''
+        current = generation()
+        if self.generation == current:
+            return
+
+        if (self.generation is None or
+                not 0 < current - self.generation <= MAX_CHANGES):
+            self.rebuild()
+            return
+
+        keys = [CHANGE_KEY % g
+                for g in range(self.generation + 1, current + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            # expired, evicted, or a bulk change that wasn't recorded
+            self.rebuild()
+            return
+
+        for key in keys:
+            self.apply(*changes[key])
+        self.generation = current
+
+    def changed(self, pk, last_name_key=None, last_name_sound=None):
+        '''Record that the patient with pk was saved with the given last
+        name, or deleted if last_name_key is None. The other processes
+        are told once the transaction commits, so that none of them can
+        rebuild its index without the change under the new generation.'''
+        self.apply(pk, last_name_key, last_name_sound)
+
+        transaction.on_commit(
+            partial(self.publish, pk, last_name_key, last_name_sound))
+
+    def publish(self, pk, last_name_key, last_name_sound):
+        new_generation = record_change(
+            (pk, last_name_key, last_name_sound))
+
+        # if no other process changed a patient since this one last saw
+        # the generation, the index is still complete.
+        if (self.generation is not None and new_generation is not None and
+                new_generation == self.generation + 1):
+            self.generation = new_generation
+
+    def candidates(self, last_name_key):
+        '''The pks of the patients whose last names are near last_name_key.
+        '''
+        self.sync()
+
+        last_names = set(self.sounds.get(soundex(last_name_key), ()))
+        if last_name_key[0] in self.trees:
+            last_names.update(self.trees[last_name_key[0]].search(
+                last_name_key, max_edits(last_name_key)))
+
+        return set().union(*[self.last_names.get(name, ())
+                             for name in last_names])
+
+    def find(self, first_name, last_name, date_of_birth=None):
+        '''The patients who might be the patient named first_name
+        last_name, the likeliest (by date_of_birth, if it's given, and
+        then by how close their names are) first.'''
+        Patient = apps.get_model('pttrack', 'Patient')
+
+        first_name_key = name_key(first_name)
+        last_name_key = name_key(last_name)
+        if not first_name_key or not last_name_key:
+            return []
+
+        pks = self.candidates(last_name_key)
+        if not pks:
+            return []
+
+        # the names are checked again, as loaded, in case this process
+        # hasn't heard that a patient was renamed.
+        matches = []
+        for patient in Patient.objects.filter(pk__in=pks):
+            last_distance = name_distance(
+                last_name_key, patient.last_name_key,
+                patient.last_name_sound)
+            first_distance = first_name_distance(
+                first_name_key, patient.first_name_key,
+                patient.first_name_sound)
+            if last_distance is None or first_distance is None:
+                continue
+
+            matches.append(((
+                date_of_birth_distance(date_of_birth,
+                                       patient.date_of_birth),
+                first_distance + last_distance,
+                patient.last_name, patient.first_name, patient.pk),
+                patient))
+
+        return [patient for _, patient in sorted(matches)]
+
+
+# each process has its own index
+index = DuplicateIndex()
+
+
+def name_keys(first_name, last_name):
+    '''The values of a patient's name key fields, by field name.'''
+    first_name_key = name_key(first_name)
+    last_name_key = name_key(last_name)
+
+    return {
+        'first_name_key': first_name_key,
+        'last_name_key': last_name_key,
+        'first_name_sound': soundex(first_name_key),
+        'last_name_sound': soundex(last_name_key),
+    }
+
+
+def set_name_keys(sender, instance, **kwargs):
+    '''Store the normalized and phonetic forms of a patient's names on
+    them. Connected to pre_save, so that it also happens when patients
+    are loaded from fixtures.
+
+    Whether the last name's keys changed (or the patient is new) is noted
+    on the patient, for index_patient().'''
+    keys = name_keys(instance.first_name, instance.last_name)
+
+    instance._last_name_changed = (
+        instance._state.adding or
+        instance.last_name_key != keys['last_name_key'] or
+        instance.last_name_sound != keys['last_name_sound'])
+
+    for field, value in keys.items():
+        setattr(instance, field, value)
+
+
+def index_patient(sender, instance, **kwargs):
+    if getattr(instance, '_last_name_changed', True):
+        index.changed(instance.pk, instance.last_name_key,
+                      instance.last_name_sound)
+
+
+def unindex_patient(sender, instance, **kwargs):
+    index.changed(instance.pk)
@@ -5,8 +5,8 @@ from builtins import str
 from builtins import range
 from builtins import object
 from bootstrap3_datetime.widgets import DateTimePicker
-from django.forms import (Form, CharField, ModelForm, EmailField,
-                          CheckboxSelectMultiple, ModelMultipleChoiceField)
+from django.forms import (Form, CharField, DateField, ModelForm, EmailField,
+                          CheckboxSelectMultiple)
 from django.contrib.auth.forms import AuthenticationForm
 
 from crispy_forms.helper import FormHelper
@@ -14,6 +14,7 @@ from crispy_forms.layout import Submit
 from crispy_forms.bootstrap import InlineCheckboxes
 from crispy_forms.layout import ButtonHolder, Submit
 from . import models
+from .provider_choices import ProviderMultipleChoiceField
 
 from crispy_forms.layout import Field
 from django import forms
@@ -30,6 +31,8 @@ class CustomCheckbox(Field):
 class DuplicatePatientForm(Form):
     first_name = CharField(label='First Name')
     last_name = CharField(label='Last Name')
+    date_of_birth = DateField(label='Date of Birth', required=False,
+                              help_text='MM/DD/YYYY')
 
     def __init__(self, *args, **kwargs):
         super(DuplicatePatientForm, self).__init__(*args, **kwargs)
@@ -46,11 +49,9 @@ class PatientForm(ModelForm):
     # limit the options for the case_managers field to Providers with
     # ProviderType with staff_view=True
 
-    case_managers = ModelMultipleChoiceField(
+    case_managers = ProviderMultipleChoiceField(
+        {'staff_view': True},
         required=False,
-        queryset=models.Provider.objects.filter(
-            clinical_roles__in=models.ProviderType.objects.filter(
-                staff_view=True)).distinct().order_by("last_name"),
     )
 
     def __init__(self, *args, **kwargs):
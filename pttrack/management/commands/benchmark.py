@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, \
+    teardown_test_environment
+
+from pttrack.benchmark import Benchmark
+
+
+class Command(BaseCommand):
+    help = '''Benchmark Osler's heaviest pages against synthetic clinics of
+    increasing size, reporting query counts, time and peak memory, and fail
+    if any page's query count grows with the size of the clinic. Runs in a
+    throwaway test database, so it's safe to run anywhere.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[100, 200, 400],
+                            help="The numbers of patients to benchmark at.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if len(options['sizes']) < 2:
+            raise CommandError("At least two sizes are needed to tell "
+                               "whether query counts scale.")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+        try:
+            benchmark = Benchmark(options['sizes'], seed=options['seed'])
+            benchmark.run()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(benchmark.report())
+
+        scaling = benchmark.scaling_pages()
+        if scaling:
+            raise CommandError(
+                "Query counts grow with the number of patients on: %s" %
+                ", ".join(scaling))
@@ -0,0 +1,485 @@
+from __future__ import unicode_literals
+from builtins import range
+from builtins import zip
+from builtins import object
+from bisect import bisect_left
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import Max
+from django.utils.timezone import now
+
+from api import caching
+from appointment.models import Appointment
+from audit.models import PageviewRecord
+from demographics.models import Demographics
+from followup.models import ContactResult
+from pttrack import duplicates, models, provider_choices
+from referral.models import Referral, FollowupRequest, PatientContact
+from workup.models import ClinicType, ClinicDate, Workup
+
+FIRST_NAMES = ["James", "Mary", "Jose", "Maria", "Wei", "Fatima", "Olga",
+               "Ahmed", "Linh", "Carlos", "Aisha", "John", "Patricia",
+               "Juan", "Mei", "Omar", "Sofia", "David", "Grace", "Samuel"]
+LAST_NAMES = ["Smith", "Johnson", "Garcia", "Nguyen", "Williams", "Brown",
+              "Rodriguez", "Lee", "Martinez", "Davis", "Hernandez", "Khan",
+              "Lopez", "Wilson", "Tran", "Anderson", "Thomas", "Jackson",
+              "Ali", "Moore", "Kim", "Patel", "Ivanov", "Okafor"]
+COMPLAINTS = ["cough", "back pain", "headache", "rash", "med refill",
+              "abdominal pain", "hypertension follow-up", "diabetes check",
+              "knee pain", "anxiety"]
+
+
+def bulk_create(model, objs, batch_size, history_date=None):
+    '''Insert objs with bulk_create, set their pks, and write their
+    historical records (if model has any).
+
+    bulk_create only sets pks on PostgreSQL, so they're looked up as the
+    rows above the previous high-water mark. This assumes nothing else
+    is writing to the table at the same time.
+    '''
+
+    start = model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+    model.objects.bulk_create(objs, batch_size=batch_size)
+
+    pks = model.objects \
+        .filter(pk__gt=start) \
+        .order_by('pk') \
+        .values_list('pk', flat=True)
+    for obj, pk in zip(objs, pks):
+        obj.pk = pk
+
+    # bulk_create doesn't send the signals simple_history relies on
+    history_attr = getattr(model._meta, 'simple_history_manager_attribute',
+                           None)
+    if history_attr is not None:
+        history_model = getattr(model, history_attr).model
+        records = []
+        for obj in objs:
+            record = history_model(
+                history_date=history_date(obj) if history_date else now(),
+                history_type='+')
+            for field in model._meta.fields:
+                setattr(record, field.attname, getattr(obj, field.attname))
+            records.append(record)
+        history_model.objects.bulk_create(records, batch_size=batch_size)
+
+    return objs
+
+
+def bulk_add(relation, pairs, batch_size):
+    '''Add pairs of (source pk, target pk) to a many-to-many relation,
+    e.g. Patient.languages, in bulk.'''
+
+    through = relation.through
+    source = relation.field.m2m_field_name() + '_id'
+    target = relation.field.m2m_reverse_field_name() + '_id'
+
+    through.objects.bulk_create(
+        [through(**{source: s, target: t}) for s, t in pairs],
+        batch_size=batch_size)
+
+
+class ClinicDataGenerator(object):
+    '''Builds a synthetic, but realistically shaped, clinic: providers,
+    weekly clinic dates, and patients with workups, action items,
+    referrals (with followup requests and patient contacts),
+    appointments, demographics, documents and pageview records.
+
+    All randomness comes from a generator seeded with seed, so the same
+    arguments build the same clinic (relative to today's date).
+    '''
+
+    def __init__(self, seed=0, batch_size=1000, years=3):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.today = now().date()
+        self.start_date = self.today - datetime.timedelta(days=365 * years)
+
+    def random_date(self, start, end):
+        return start + datetime.timedelta(
+            days=self.rng.randint(0, max((end - start).days, 0)))
+
+    def random_datetime(self, date):
+        return now().replace(
+            year=date.year, month=date.month, day=date.day,
+            hour=self.rng.randint(8, 20), minute=self.rng.randint(0, 59))
+
+    def reference_data(self):
+        '''Load the reference data this generator depends on, creating a
+        minimal set of anything that scripts/init_db.py hasn't.'''
+
+        if not models.Gender.objects.exists():
+            for name in ["Male", "Female", "Other"]:
+                models.Gender.objects.create(long_name=name,
+                                             short_name=name[0])
+        for name, signs, staff in [("Attending", True, False),
+                                   ("Clinical", False, False),
+                                   ("Coordinator", False, True)]:
+            if not models.ProviderType.objects.filter(
+                    signs_charts=signs, staff_view=staff).exists():
+                models.ProviderType.objects.create(
+                    long_name=name, short_name=name,
+                    signs_charts=signs, staff_view=staff)
+        for model, field, default in [
+                (models.Language, 'name', "English"),
+                (models.Ethnicity, 'name', "Other"),
+                (models.ContactMethod, 'name', "Phone"),
+                (models.ActionInstruction, 'instruction', "Other"),
+                (models.ReferralType, 'name', "PCP"),
+                (models.DocumentType, 'name', "Other"),
+                (ClinicType, 'name', "Basic Care Clinic")]:
+            if not model.objects.exists():
+                model.objects.create(**{field: default})
+        if not models.ReferralLocation.objects.exists():
+            location = models.ReferralLocation.objects.create(
+                name="Clinic", address="")
+            location.care_availiable.add(*models.ReferralType.objects.all())
+        if not ContactResult.objects.exists():
+            ContactResult.objects.create(
+                name="Communicated health information to patient")
+
+        # in a fixed order, so that the same seed makes the same choices
+        def ordered(model):
+            return list(model.objects.order_by('pk'))
+
+        self.genders = ordered(models.Gender)
+        self.languages = ordered(models.Language)
+        self.ethnicities = ordered(models.Ethnicity)
+        self.contact_methods = ordered(models.ContactMethod)
+        self.instructions = ordered(models.ActionInstruction)
+        self.referral_types = ordered(models.ReferralType)
+        self.referral_locations = ordered(models.ReferralLocation)
+        self.document_types = ordered(models.DocumentType)
+        self.contact_results = ordered(ContactResult)
+        self.clinic_types = ordered(ClinicType)
+        self.attending_type = models.ProviderType.objects \
+            .filter(signs_charts=True).first()
+        self.coordinator_type = models.ProviderType.objects \
+            .filter(staff_view=True).first()
+        self.volunteer_type = models.ProviderType.objects \
+            .filter(signs_charts=False, staff_view=False).first()
+
+    def providers(self, n):
+        '''Create n providers (and their users), a fifth of them attendings
+        and a fifth coordinators.'''
+
+        first_username = User.objects.count()
+        password = make_password(None)
+        users = bulk_create(User, [
+            User(username='synthetic%s' % (first_username + i),
+                 password=password)
+            for i in range(n)], self.batch_size)
+
+        roles = [self.attending_type, self.coordinator_type] + \
+            [self.volunteer_type] * 3
+        providers = bulk_create(models.Provider, [
+            models.Provider(
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                phone='314-555-%04d' % self.rng.randint(0, 9999),
+                gender=self.rng.choice(self.genders),
+                associated_user=user)
+            for user in users], self.batch_size)
+
+        self.provider_roles = {}
+        for i, provider in enumerate(providers):
+            self.provider_roles[provider.pk] = roles[i % len(roles)]
+        bulk_add(models.Provider.clinical_roles,
+                 [(pk, role.pk) for pk, role in self.provider_roles.items()],
+                 self.batch_size)
+
+        def of_type(provider_type):
+            return [p for p in providers
+                    if self.provider_roles[p.pk] == provider_type] or \
+                providers
+
+        self.attendings = of_type(self.attending_type)
+        self.coordinators = of_type(self.coordinator_type)
+        self.volunteers = of_type(self.volunteer_type)
+
+    def clinic_dates(self):
+        '''Create a clinic date every Saturday since the start date, unless
+        there already are clinic dates since then, in which case those are
+        used (so that a clinic can be grown a step at a time).'''
+
+        existing = list(ClinicDate.objects
+                        .filter(clinic_date__gte=self.start_date)
+                        .order_by('clinic_date', 'pk'))
+        if existing:
+            self.clinic_days = existing
+        else:
+            day = self.start_date + datetime.timedelta(
+                days=(5 - self.start_date.weekday()) % 7)
+
+            dates = []
+            while day <= self.today:
+                clinic_type = self.clinic_types[
+                    len(dates) % len(self.clinic_types)]
+                dates.append(ClinicDate(clinic_type=clinic_type,
+                                        clinic_date=day))
+                day += datetime.timedelta(days=7)
+
+            self.clinic_days = bulk_create(ClinicDate, dates,
+                                           self.batch_size)
+
+        self.clinic_day_dates = [d.clinic_date for d in self.clinic_days]
+
+    def note(self, author, patient):
+        return {'author': author,
+                'author_type': self.provider_roles[author.pk],
+                'patient': patient}
+
+    def patients(self, n):
+        '''Create n patients, along with their notes. Each patient was
+        taken in on a random date, and only has notes after it.'''
+
+        rng = self.rng
+        intake = {}
+        patients = []
+        for _ in range(n):
+            patient = models.Patient(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                middle_name=rng.choice(FIRST_NAMES) if rng.random() < 0.3
+                else '',
+                phone='314-555-%04d' % rng.randint(0, 9999),
+                gender=rng.choice(self.genders),
+                address='%s %s St.' % (rng.randint(1, 9999),
+                                       rng.choice(LAST_NAMES)),
+                zip_code='63%03d' % rng.randint(0, 999),
+                date_of_birth=self.random_date(
+                    datetime.date(1930, 1, 1), datetime.date(2005, 1, 1)),
+                patient_comfortable_with_english=rng.random() < 0.7,
+                preferred_contact_method=rng.choice(self.contact_methods),
+                needs_workup=rng.random() < 0.05)
+            patients.append(patient)
+            intake[id(patient)] = self.random_date(self.start_date,
+                                                   self.today)
+            patient.intake_datetime = self.random_datetime(
+                intake[id(patient)])
+            duplicates.set_name_keys(models.Patient, patient)
+
+        bulk_create(models.Patient, patients, self.batch_size,
+                    lambda p: p.intake_datetime)
+
+        bulk_add(models.Patient.languages,
+                 [(p.pk, rng.choice(self.languages).pk) for p in patients],
+                 self.batch_size)
+        bulk_add(models.Patient.ethnicities,
+                 [(p.pk, rng.choice(self.ethnicities).pk) for p in patients],
+                 self.batch_size)
+        bulk_add(models.Patient.case_managers,
+                 [(p.pk, rng.choice(self.coordinators).pk)
+                  for p in patients if rng.random() < 0.3],
+                 self.batch_size)
+
+        self.workups(patients, intake)
+        self.action_items(patients, intake)
+        self.referrals(patients, intake)
+        self.appointments(patients)
+        self.demographics(patients, intake)
+        self.documents(patients)
+        self.pageviews(patients)
+
+    def workups(self, patients, intake):
+        rng = self.rng
+        workups = []
+        for patient in patients:
+            days = self.clinic_days[bisect_left(self.clinic_day_dates,
+                                                intake[id(patient)]):]
+            n = min(len(days), rng.choice([0, 1, 1, 1, 2, 2, 3, 4]))
+            for clinic_day in rng.sample(days, n):
+                signed = rng.random() < 0.9
+                workups.append(Workup(
+                    clinic_day=clinic_day,
+                    chief_complaint=rng.choice(COMPLAINTS),
+                    diagnosis=rng.choice(COMPLAINTS),
+                    HPI="Synthetic history of present illness.",
+                    PMH_PSH="None", meds="None", allergies="NKDA",
+                    fam_hx="Noncontributory", soc_hx="Noncontributory",
+                    ros="Negative", pe="Normal", A_and_P="Follow up.",
+                    hr=rng.randint(55, 110), rr=rng.randint(10, 22),
+                    bp_sys=rng.randint(100, 170), bp_dia=rng.randint(60, 100),
+                    attending=rng.choice(self.attendings),
+                    signer=rng.choice(self.attendings) if signed else None,
+                    signed_date=now() if signed else None,
+                    **self.note(rng.choice(self.volunteers), patient)))
+
+        bulk_create(Workup, workups, self.batch_size)
+
+    def action_items(self, patients, intake):
+        rng = self.rng
+        items = []
+        for patient in patients:
+            for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+                due_date = self.random_date(
+                    intake[id(patient)],
+                    self.today + datetime.timedelta(days=60))
+                item = models.ActionItem(
+                    due_date=due_date,
+                    instruction=rng.choice(self.instructions),
+                    priority=rng.random() < 0.1,
+                    comments="Synthetic action item.",
+                    **self.note(rng.choice(self.coordinators), patient))
+                if due_date < self.today and rng.random() < 0.7:
+                    item.mark_done(rng.choice(self.coordinators))
+                items.append(item)
+
+        bulk_create(models.ActionItem, items, self.batch_size)
+
+    def referrals(self, patients, intake):
+        rng = self.rng
+        referrals = []
+        for patient in patients:
+            for _ in range(rng.choice([0, 0, 0, 1, 1, 2])):
+                referrals.append(Referral(
+                    kind=rng.choice(self.referral_types),
+                    comments="Synthetic referral.",
+                    **self.note(rng.choice(self.volunteers), patient)))
+        bulk_create(Referral, referrals, self.batch_size)
+
+        bulk_add(Referral.location,
+                 [(r.pk, rng.choice(self.referral_locations).pk)
+                  for r in referrals],
+                 self.batch_size)
+
+        requests = []
+        for referral in referrals:
+            due_date = self.random_date(
+                intake[id(referral.patient)],
+                self.today + datetime.timedelta(days=30))
+            request = FollowupRequest(
+                referral=referral,
+                contact_instructions="Call about the referral.",
+                due_date=due_date,
+                **self.note(rng.choice(self.coordinators), referral.patient))
+            if due_date < self.today and rng.random() < 0.7:
+                request.mark_done(rng.choice(self.coordinators))
+            requests.append(request)
+        bulk_create(FollowupRequest, requests, self.batch_size)
+
+        contacts = []
+        for request in requests:
+            if request.done():
+                contacts.append(PatientContact(
+                    followup_request=request,
+                    referral=request.referral,
+                    contact_method=rng.choice(self.contact_methods),
+                    contact_status=rng.choice(self.contact_results),
+                    has_appointment=rng.choice(PatientContact.PTSHOW_OPTS)[0],
+                    **self.note(request.completion_author, request.patient)))
+        bulk_create(PatientContact, contacts, self.batch_size)
+
+    def appointments(self, patients):
+        rng = self.rng
+        appointments = []
+        for patient in patients:
+            for _ in range(rng.choice([0, 0, 1, 2])):
+                clindate = self.random_date(
+                    self.today - datetime.timedelta(days=60),
+                    self.today + datetime.timedelta(days=60))
+                appointments.append(Appointment(
+                    clindate=clindate,
+                    clintime=datetime.time(rng.randint(9, 16)),
+                    appointment_type=rng.choice(
+                        Appointment.APPOINTMENT_TYPES)[0],
+                    comment="Synthetic appointment.",
+                    pt_showed=(rng.random() < 0.8
+                               if clindate < self.today else None),
+                    **self.note(rng.choice(self.coordinators), patient)))
+
+        bulk_create(Appointment, appointments, self.batch_size)
+
+    def demographics(self, patients, intake):
+        rng = self.rng
+        bulk_create(Demographics, [
+            Demographics(
+                patient=patient,
+                creation_date=intake[id(patient)],
+                has_insurance=rng.choice([None, True, False]),
+                lives_alone=rng.choice([None, True, False]),
+                dependents=rng.randint(0, 5),
+                currently_employed=rng.choice([None, True, False]))
+            for patient in patients if rng.random() < 0.7], self.batch_size)
+
+    def documents(self, patients):
+        rng = self.rng
+        bulk_create(models.Document, [
+            models.Document(
+                title="Synthetic document",
+                image='synthetic.pdf',
+                comments="",
+                document_type=rng.choice(self.document_types),
+                **self.note(rng.choice(self.volunteers), patient))
+            for patient in patients if rng.random() < 0.05], self.batch_size)
+
+    def pageviews(self, patients):
+        rng = self.rng
+        records = []
+        for patient in patients:
+            url = reverse('patient-detail', args=(patient.pk,))
+            for _ in range(rng.randint(0, 4)):
+                provider = rng.choice(self.volunteers + self.coordinators)
+                records.append(PageviewRecord(
+                    user_id=provider.associated_user_id,
+                    user_ip='127.0.0.1',
+                    role=self.provider_roles[provider.pk],
+                    method='GET', url=url, status_code=200))
+
+        PageviewRecord.objects.bulk_create(records,
+                                           batch_size=self.batch_size)
+
+
+class Command(BaseCommand):
+    help = '''Fill the database with a reproducible, synthetic clinic of the
+    given size, for performance testing. Never run this against a
+    production database.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--providers', type=int, default=50)
+        parser.add_argument(
+            '--years', type=int, default=3,
+            help="How many years of weekly clinic dates to spread "
+                 "patients over.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        generator = ClinicDataGenerator(seed=options['seed'],
+                                        batch_size=options['batch_size'],
+                                        years=options['years'])
+
+        with transaction.atomic():
+            generator.reference_data()
+            generator.providers(options['providers'])
+            generator.clinic_dates()
+
+            # patients are built a batch at a time to bound memory use
+            for start in range(0, options['patients'],
+                               options['batch_size']):
+                generator.patients(min(options['batch_size'],
+                                       options['patients'] - start))
+
+            # bulk_create doesn't send the signals that keep the patient
+            # summaries and search index up to date...
+            models.PatientSummary.objects.rebuild(
+                batch_size=options['batch_size'])
+            models.PatientSearchToken.objects.rebuild(
+                batch_size=options['batch_size'])
+            models.PatientPhone.objects.rebuild(
+                batch_size=options['batch_size'])
+
+        # ...or that invalidate the patient lists cached by the api, the
+        # duplicate patient index and the cached choices of providers.
+        caching.invalidate()
+        duplicates.bump_generation()
+        provider_choices.invalidate()
+
+        self.stdout.write("Generated %s patients." % options['patients'])
@@ -0,0 +1,23 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from pttrack.models import PatientPhone, PatientSearchToken
+
+
+class Command(BaseCommand):
+    help = '''Rebuild the tokens that patients are searched for by, and
+    their normalized phone numbers. Needed after any bulk change to
+    patients (which doesn't keep them up to date by itself).'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="The number of patients to index at a "
+                            "time.")
+
+    def handle(self, *args, **options):
+        n = PatientSearchToken.objects.rebuild(
+            batch_size=options['batch_size'])
+        PatientPhone.objects.rebuild(batch_size=options['batch_size'])
+
+        self.stdout.write("Indexed %s patients." % n)
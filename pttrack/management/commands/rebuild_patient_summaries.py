@@ -0,0 +1,23 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from api import caching
+from pttrack.models import PatientSummary
+
+
+class Command(BaseCommand):
+    help = '''Recompute the summary of every patient shown in the patient
+    lists. Needed after any bulk change to patients or their notes (which
+    doesn't keep the summaries up to date by itself).'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="The number of patients to summarize at "
+                            "a time.")
+
+    def handle(self, *args, **options):
+        n = PatientSummary.objects.rebuild(batch_size=options['batch_size'])
+        caching.invalidate()
+
+        self.stdout.write("Summarized %s patients." % n)
@@ -0,0 +1,67 @@
+from __future__ import unicode_literals
+from builtins import object
+from builtins import str
+
+from .models import Provider, ProviderType
+
+# the attribute User.provider is cached in, once it's been looked up
+PROVIDER_CACHE_NAME = Provider._meta.get_field('associated_user') \
+    .remote_field.get_cache_name()
+
+
+def current_provider_type(request):
+    '''The ProviderType the user chose for this session (i.e. the one in
+    request.session['clintype_pk']), or None if they haven't chosen.
+
+    It's usually one of the provider's roles loaded by ProviderMiddleware,
+    and is only loaded again if the choice changed during the request.
+    '''
+    pk = request.session.get('clintype_pk', None)
+    if pk is None:
+        return None
+
+    provider_type = getattr(request, 'provider_type', None)
+    if provider_type is not None and str(provider_type.pk) == str(pk):
+        return provider_type
+
+    provider = getattr(request, 'provider', None)
+    roles = provider.clinical_roles.all() if provider is not None else []
+    for role in roles:
+        if str(role.pk) == str(pk):
+            provider_type = role
+            break
+    else:
+        provider_type = ProviderType.objects.filter(pk=pk).first()
+
+    request.provider_type = provider_type
+    return provider_type
+
+
+class ProviderMiddleware(object):
+    '''Loads the signed in user's Provider, with their roles, and their
+    active ProviderType once per request, so that the decorators and views
+    that need them (often several times a request) don't each query for
+    them.
+
+    The provider is cached as request.user.provider (and is also
+    request.provider, which is None if the user has no provider), and the
+    provider type is available from current_provider_type(request).
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.provider = None
+        request.provider_type = None
+
+        if request.user.is_authenticated:
+            request.provider = Provider.objects \
+                .filter(associated_user=request.user) \
+                .prefetch_related('clinical_roles') \
+                .first()
+            setattr(request.user, PROVIDER_CACHE_NAME, request.provider)
+
+            current_provider_type(request)
+
+        return self.get_response(request)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pttrack', '0009_set_orderings_20190902_2116'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['last_name'], name='pttrack_pt_last_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['first_name'], name='pttrack_pt_first_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provider',
+            index=models.Index(fields=['last_name'], name='pttrack_prov_last_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provider',
+            index=models.Index(fields=['first_name'], name='pttrack_prov_first_name_idx'),
+        ),
+    ]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils.timezone import localdate
+import django.db.models.deletion
+
+# the models of OSLER_TODO_LIST_MANAGERS when the summaries were added
+TODO_LIST_MODELS = [('pttrack', 'ActionItem'), ('referral', 'FollowupRequest')]
+
+BATCH_SIZE = 500
+
+
+def summarize_patients(apps, schema_editor):
+    '''Create the summary of every existing patient, as
+    PatientSummary.objects.summarize() does, BATCH_SIZE patients at a
+    time.'''
+
+    Patient = apps.get_model('pttrack', 'Patient')
+    HistoricalPatient = apps.get_model('pttrack', 'HistoricalPatient')
+    PatientSummary = apps.get_model('pttrack', 'PatientSummary')
+    ActionItem = apps.get_model('pttrack', 'ActionItem')
+    Workup = apps.get_model('workup', 'Workup')
+    todo_list_models = [apps.get_model(app, model)
+                        for app, model in TODO_LIST_MODELS]
+
+    patient_ids = list(Patient.objects.order_by('pk')
+                       .values_list('pk', flat=True))
+
+    for i in range(0, len(patient_ids), BATCH_SIZE):
+        batch = patient_ids[i:i + BATCH_SIZE]
+
+        # the first historical record is the one written at intake
+        intakes = dict(HistoricalPatient.objects
+                       .filter(id__in=batch)
+                       .order_by()
+                       .values('id')
+                       .annotate(first=Min('history_date'))
+                       .values_list('id', 'first'))
+
+        # the workup on the earliest clinic date, like
+        # Patient.latest_workup()
+        latest_workups = {}
+        unsigned = set()
+        workups = Workup.objects \
+            .filter(patient__in=batch) \
+            .order_by('patient', 'clinic_day__clinic_date', 'pk') \
+            .values_list('patient', 'pk', 'clinic_day__clinic_date',
+                         'signer')
+        for patient_id, workup_id, clinic_date, signer_id in workups:
+            latest_workups.setdefault(patient_id, (workup_id, clinic_date))
+            if signer_id is None:
+                unsigned.add(patient_id)
+
+        priority = set(ActionItem.objects
+                       .filter(patient__in=batch, priority=True,
+                               completion_date=None)
+                       .values_list('patient', flat=True))
+
+        open_due_dates = defaultdict(list)
+        done_counts = defaultdict(int)
+        for model in todo_list_models:
+            items = model.objects \
+                .filter(patient__in=batch) \
+                .order_by() \
+                .values_list('patient', 'due_date', 'completion_author')
+
+            for patient_id, due_date, completion_author_id in items:
+                if completion_author_id is None:
+                    open_due_dates[patient_id].append(due_date)
+                else:
+                    done_counts[patient_id] += 1
+
+        summaries = []
+        for patient_id in batch:
+            due_dates = sorted(open_due_dates[patient_id])
+            intake_datetime = intakes.get(patient_id)
+            workup_id, latest_activity_date = latest_workups.get(
+                patient_id, (None, None))
+
+            if latest_activity_date is None and intake_datetime is not None:
+                latest_activity_date = localdate(intake_datetime)
+
+            summaries.append(PatientSummary(
+                patient_id=patient_id,
+                latest_workup_id=workup_id,
+                latest_activity_date=latest_activity_date,
+                intake_datetime=intake_datetime,
+                has_unsigned_workup=patient_id in unsigned,
+                has_priority_item=patient_id in priority,
+                open_due_dates=",".join(d.isoformat() for d in due_dates),
+                soonest_due_date=due_dates[0] if due_dates else None,
+                done_count=done_counts[patient_id]))
+
+        PatientSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workup', '0006_remove_clinicdate_gcal_id'),
+        ('referral', '0002_auto_20190902_2116'),
+        ('pttrack', '0010_name_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSummary',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='pttrack.Patient')),
+                ('latest_activity_date', models.DateField(db_index=True, null=True)),
+                ('intake_datetime', models.DateTimeField(null=True)),
+                ('has_unsigned_workup', models.BooleanField(default=False)),
+                ('has_priority_item', models.BooleanField(default=False)),
+                ('open_due_dates', models.TextField(blank=True)),
+                ('soonest_due_date', models.DateField(db_index=True, null=True)),
+                ('done_count', models.IntegerField(default=0)),
+                ('latest_workup', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='workup.Workup')),
+            ],
+        ),
+        migrations.RunPython(summarize_patients,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Min
+import django.utils.timezone
+
+
+def backfill_intake_datetime(apps, schema_editor):
+    '''Set each patient's intake_datetime (and that of each of their
+    historical records) to the date of their first historical record.
+
+    The dates are looked up first and then set patient by patient, since
+    MySQL can't update a table from a subquery of that same table.'''
+
+    Patient = apps.get_model('pttrack', 'Patient')
+    HistoricalPatient = apps.get_model('pttrack', 'HistoricalPatient')
+
+    first_records = dict(HistoricalPatient.objects
+                         .order_by()
+                         .values('id')
+                         .annotate(first=Min('history_date'))
+                         .values_list('id', 'first'))
+
+    for patient_id, intake_datetime in first_records.items():
+        Patient.objects.filter(pk=patient_id) \
+            .update(intake_datetime=intake_datetime)
+        HistoricalPatient.objects.filter(id=patient_id) \
+            .update(intake_datetime=intake_datetime)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pttrack', '0011_patientsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalpatient',
+            name='intake_datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='intake_datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(backfill_intake_datetime,
+                             migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='patientsummary',
+            name='intake_datetime',
+        ),
+    ]
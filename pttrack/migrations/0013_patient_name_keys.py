@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unicodedata
+
+from django.db import migrations, models
+
+# copied from pttrack.duplicates as it was when the keys were added, so
+# that later changes there don't change what this migration does.
+SOUNDEX_CODES = dict(
+    [(letter, '1') for letter in 'bfpv'] +
+    [(letter, '2') for letter in 'cgjkqsxz'] +
+    [(letter, '3') for letter in 'dt'] +
+    [('l', '4')] +
+    [(letter, '5') for letter in 'mn'] +
+    [('r', '6')])
+
+
+def name_key(name):
+    if not name:
+        return ''
+
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in decomposed.lower() if 'a' <= c <= 'z')
+
+
+def soundex(key):
+    if not key:
+        return ''
+
+    code = key[0]
+    last = SOUNDEX_CODES.get(key[0])
+    for c in key[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit is not None and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if c not in 'hw':
+            last = digit
+
+    return code.ljust(4, '0')
+
+
+def name_keys(first_name, last_name):
+    first_name_key = name_key(first_name)
+    last_name_key = name_key(last_name)
+
+    return {
+        'first_name_key': first_name_key,
+        'last_name_key': last_name_key,
+        'first_name_sound': soundex(first_name_key),
+        'last_name_sound': soundex(last_name_key),
+    }
+
+
+def backfill_name_keys(apps, schema_editor):
+    '''Set the name keys of every patient, and of their historical
+    records.'''
+
+    for model_name in ['Patient', 'HistoricalPatient']:
+        model = apps.get_model('pttrack', model_name)
+        names = model.objects \
+            .values_list('pk', 'first_name', 'last_name') \
+            .iterator()
+        for pk, first_name, last_name in names:
+            model.objects.filter(pk=pk) \
+                .update(**name_keys(first_name, last_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pttrack', '0012_patient_intake_datetime'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalpatient',
+            name='first_name_key',
+            field=models.CharField(default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='historicalpatient',
+            name='first_name_sound',
+            field=models.CharField(default='', editable=False, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='historicalpatient',
+            name='last_name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='historicalpatient',
+            name='last_name_sound',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='first_name_key',
+            field=models.CharField(default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='first_name_sound',
+            field=models.CharField(default='', editable=False, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='last_name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='last_name_sound',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=4),
+        ),
+        migrations.RunPython(backfill_name_keys, migrations.RunPython.noop),
+    ]
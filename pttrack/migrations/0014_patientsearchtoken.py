@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 500
+
+# the kinds of token, as in PatientSearchToken
+NAME = 'n'
+PHONE = 'p'
+ZIP_CODE = 'z'
+DATE_OF_BIRTH = 'd'
+
+
+# copied from pttrack as it was when the tokens were added, so that later
+# changes there don't change what this migration does.
+def name_key(name):
+    if not name:
+        return ''
+
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in decomposed.lower() if 'a' <= c <= 'z')
+
+
+def phone_digits(phone):
+    return re.sub(r'\D', '', phone or '')
+
+
+def patient_search_tokens(patient):
+    tokens = set()
+
+    for name in [patient.first_name, patient.middle_name, patient.last_name]:
+        for word in re.split(r'[\s-]+', name or '') + [name]:
+            if name_key(word):
+                tokens.add((NAME, name_key(word)))
+
+    phones = [patient.phone] + [getattr(patient, 'alternate_phone_%s' % i)
+                                for i in range(1, 5)]
+    for phone in phones:
+        digits = phone_digits(phone)
+        for suffix in [digits, digits[-7:], digits[-4:]]:
+            if suffix:
+                tokens.add((PHONE, suffix))
+
+    if patient.zip_code:
+        tokens.add((ZIP_CODE, patient.zip_code))
+
+    if patient.date_of_birth:
+        tokens.add((DATE_OF_BIRTH, patient.date_of_birth.isoformat()))
+
+    return tokens
+
+
+def index_patients(apps, schema_editor):
+    '''Build the search tokens of every existing patient, as
+    PatientSearchToken.objects.rebuild() does, BATCH_SIZE patients at a
+    time.'''
+
+    Patient = apps.get_model('pttrack', 'Patient')
+    PatientSearchToken = apps.get_model('pttrack', 'PatientSearchToken')
+
+    patient_ids = list(Patient.objects.order_by('pk')
+                       .values_list('pk', flat=True))
+
+    for i in range(0, len(patient_ids), BATCH_SIZE):
+        patients = Patient.objects.filter(
+            pk__in=patient_ids[i:i + BATCH_SIZE])
+        PatientSearchToken.objects.bulk_create([
+            PatientSearchToken(patient_id=patient.pk, kind=kind, token=token)
+            for patient in patients
+            for kind, token in patient_search_tokens(patient)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pttrack', '0013_patient_name_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('n', 'name'), ('p', 'phone'), ('z', 'zip code'), ('d', 'date of birth')], max_length=1)),
+                ('token', models.CharField(db_index=True, max_length=100)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='pttrack.Patient')),
+            ],
+        ),
+        migrations.RunPython(index_patients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 500
+
+
+def index_phones(apps, schema_editor):
+    '''Store the phone numbers of every existing patient, as
+    PatientPhone.objects.rebuild() does, BATCH_SIZE patients at a time.'''
+
+    Patient = apps.get_model('pttrack', 'Patient')
+    PatientPhone = apps.get_model('pttrack', 'PatientPhone')
+
+    patient_ids = list(Patient.objects.order_by('pk')
+                       .values_list('pk', flat=True))
+
+    for i in range(0, len(patient_ids), BATCH_SIZE):
+        phones = []
+        for patient in Patient.objects.filter(
+                pk__in=patient_ids[i:i + BATCH_SIZE]):
+            # as Patient.all_phones() was when the numbers were added
+            all_phones = [(patient.phone, '')] + [
+                (getattr(patient, 'alternate_phone_%s' % n),
+                 getattr(patient, 'alternate_phone_%s_owner' % n))
+                for n in range(1, 5)]
+
+            for phone, owner in all_phones:
+                digits = re.sub(r'\D', '', phone or '')
+                if digits:
+                    phones.append(PatientPhone(
+                        patient_id=patient.pk, number=digits,
+                        owner=owner or ''))
+
+        PatientPhone.objects.bulk_create(phones)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pttrack', '0014_patientsearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientPhone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.CharField(db_index=True, max_length=40)),
+                ('owner', models.CharField(blank=True, max_length=40)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='phones', to='pttrack.Patient')),
+            ],
+        ),
+        migrations.RunPython(index_phones, migrations.RunPython.noop),
+    ]
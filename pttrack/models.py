@@ -3,12 +3,21 @@ from __future__ import unicode_literals
 from builtins import str
 from builtins import range
 from builtins import object
+from collections import defaultdict
+from functools import reduce
 from itertools import chain
-
-from django.db import models
+import datetime
+import operator
+import re
+
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Case, Exists, F, Max, Min, OuterRef, Q, \
+    Subquery, Value, When
+from django.db.models.functions import Coalesce, Least
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.utils.timezone import now
+from django.utils.timezone import now, localdate
 from django.utils.text import slugify
 import os
 from django.core.urlresolvers import reverse
@@ -16,6 +25,7 @@ from django.core.urlresolvers import reverse
 from simple_history.models import HistoricalRecords
 
 from . import validators
+from .duplicates import name_key
 
 # pylint: disable=I0011,missing-docstring,E1305
 
@@ -175,6 +185,15 @@ class Person(models.Model):
 
 class Provider(Person):
 
+    class Meta(object):
+        # for searching by case manager
+        indexes = [
+            models.Index(fields=['last_name'],
+                         name='pttrack_prov_last_name_idx'),
+            models.Index(fields=['first_name'],
+                         name='pttrack_prov_first_name_idx'),
+        ]
+
     associated_user = models.OneToOneField(settings.AUTH_USER_MODEL,
                                            blank=True, null=True)
 
@@ -192,8 +211,173 @@ class Provider(Person):
         return self.name()
 
 
+def todo_list_models():
+    '''The Completable models (e.g. ActionItem) that are shown as action
+    items on the patient detail page, as set by OSLER_TODO_LIST_MANAGERS.'''
+    return [apps.get_model(app, model)
+            for app, model in settings.OSLER_TODO_LIST_MANAGERS]
+
+
+# The kinds of note in each patient's timeline (the same as those in
+# Patient.notes()), as (app_label, model_name, the related objects their
+# short_text() uses).
+TIMELINE_NOTE_MODELS = [
+    ('workup', 'Workup', []),
+    ('followup', 'GeneralFollowup', []),
+    ('followup', 'LabFollowup', []),
+    ('followup', 'VaccineFollowup', []),
+    ('followup', 'ReferralFollowup', ['noapt_reason', 'noshow_reason']),
+    ('pttrack', 'Document', []),
+]
+
+# newest first, with ties (notes written at the same moment) broken by the
+# type and pk of the note, so that every note has its own place.
+TIMELINE_ORDERING = ('-written_datetime', '-note_type', '-pk')
+
+
+def timeline_note_models():
+    return [apps.get_model(app, model)
+            for app, model, _ in TIMELINE_NOTE_MODELS]
+
+
+def timeline_notes(rows):
+    '''Load the notes for rows of Patient.timeline(), in the same order,
+    with one query per type of note among them. Each note is given the
+    note_type of its row.'''
+
+    rows = list(rows)
+    querysets = {}
+    for app, model_name, related in TIMELINE_NOTE_MODELS:
+        model = apps.get_model(app, model_name)
+        querysets[model._meta.model_name] = model.objects.select_related(
+            'author', 'author_type', *related)
+
+    pks_by_type = defaultdict(list)
+    for row in rows:
+        pks_by_type[row['note_type']].append(row['pk'])
+
+    notes = {}
+    for note_type, pks in pks_by_type.items():
+        for pk, note in querysets[note_type].in_bulk(pks).items():
+            note.note_type = note_type
+            notes[(note_type, pk)] = note
+
+    # notes deleted since the rows were fetched are left out
+    return [notes[(row['note_type'], row['pk'])] for row in rows
+            if (row['note_type'], row['pk']) in notes]
+
+
+def earliest(expressions):
+    '''Build an expression for the earliest non-null value among
+    expressions, which is null only if all of expressions are null.
+
+    LEAST() is null if any of its arguments are on some databases, so
+    each argument falls back on the others if it is null.
+    '''
+    expressions = list(expressions)
+    if len(expressions) == 1:
+        return expressions[0]
+
+    return Least(*[Coalesce(*(expressions[i:] + expressions[:i]))
+                   for i in range(len(expressions))])
+
+
+def _patient_item_aggregate(model, condition, aggregate, output_field):
+    '''Build a subquery that aggregates the items of type model matching
+    condition that belong to the patient of the outer query.'''
+    items = model.objects \
+        .filter(condition, patient=OuterRef('pk')) \
+        .order_by() \
+        .values('patient') \
+        .annotate(value=aggregate) \
+        .values('value')
+
+    return Subquery(items, output_field=output_field)
+
+
+def action_item_status(overdue_due_dates, next_due_date, n_done):
+    '''The status shown for a patient, given the due dates of their overdue
+    action items, the due date of their next pending one (or None) and the
+    number they've had done.'''
+
+    if len(overdue_due_dates) > 0:
+        due_dates = ", ".join([str((now().date()-due_date).days)
+                               for due_date in overdue_due_dates])
+        return "Action items " + due_dates + " days past due"
+    elif next_due_date is not None:
+        tdelta = next_due_date - now().date()
+        return "next action in "+str(tdelta.days)+" days"
+    elif n_done > 0:
+        return "all actions complete"
+    else:
+        return "no pending actions"
+
+
+class PatientQuerySet(models.QuerySet):
+
+    def search(self, query):
+        '''Filter for patients matching every word of query, where a word
+        matches a patient if it begins their first, middle or last name, or
+        the first or last name of one of their case managers.
+
+        Only prefixes are matched, so that the name indexes can be used.
+        '''
+
+        qs = self
+        for word in query.split():
+            case_managers = Provider.objects.filter(
+                Q(first_name__istartswith=word) |
+                Q(last_name__istartswith=word))
+
+            qs = qs.filter(
+                Q(first_name__istartswith=word) |
+                Q(middle_name__istartswith=word) |
+                Q(last_name__istartswith=word) |
+                Q(pk__in=Patient.case_managers.through.objects
+                  .filter(provider__in=case_managers)
+                  .values('patient')))
+
+        return qs
+
+    def with_action_items(self, condition):
+        '''Filter for patients with at least one action item (or item of
+        another model in OSLER_TODO_LIST_MANAGERS) matching condition, and
+        annotate each with soonest_due_date, the earliest due date among
+        those items.
+
+        The item tables are searched by subqueries, so this is one query
+        however many models there are, and the result is still a queryset
+        that can be filtered, ordered and paginated further.
+        '''
+
+        item_models = todo_list_models()
+
+        has_items = reduce(operator.or_, [
+            Q(pk__in=model.objects.filter(condition).values('patient'))
+            for model in item_models])
+
+        soonest_due_date = earliest([
+            _patient_item_aggregate(
+                model, condition, Min('due_date'), models.DateField())
+            for model in item_models])
+
+        return self \
+            .filter(has_items) \
+            .annotate(soonest_due_date=soonest_due_date)
+
+
 class Patient(Person):
 
+    class Meta(object):
+        indexes = [
+            models.Index(fields=['last_name'],
+                         name='pttrack_pt_last_name_idx'),
+            models.Index(fields=['first_name'],
+                         name='pttrack_pt_first_name_idx'),
+        ]
+
+    objects = PatientQuerySet.as_manager()
+
     case_managers = models.ManyToManyField(Provider)
 
     outcome = models.ForeignKey(Outcome, null=True, blank=True)
@@ -249,6 +433,23 @@ class Patient(Person):
 
     needs_workup = models.BooleanField(default=True)
 
+    # When the patient was entered into Osler. This is also the date of
+    # their first historical record, but that can't be loaded for many
+    # patients at once.
+    intake_datetime = models.DateTimeField(default=now, editable=False)
+
+    # The patient's names normalized and as Soundex codes, for finding
+    # possible duplicates of new patients. Set whenever the patient is
+    # saved (see duplicates.set_name_keys).
+    first_name_key = models.CharField(max_length=100, default='',
+                                      editable=False)
+    last_name_key = models.CharField(max_length=100, default='',
+                                     editable=False, db_index=True)
+    first_name_sound = models.CharField(max_length=4, default='',
+                                        editable=False)
+    last_name_sound = models.CharField(max_length=4, default='',
+                                       editable=False, db_index=True)
+
     history = HistoricalRecords()
 
     def age(self):
@@ -287,12 +488,8 @@ class Patient(Person):
             key=lambda ai: ai.due_date)
 
     def status(self):
-        # The active_action_items, done_action_items, and inactive_action_items
-        # aren't a big deal to use when getting just one patient
-        # For the all_patients page though (one of the pages that use status),
-        # hitting the db three times per patient adds up.
-        # Here, we only hit the db once by asking the db for all action items
-        # for a patient, then sorting them in memory.
+        # Here, we only hit the db once per model by asking the db for
+        # all action items for a patient, then sorting them in memory.
 
         # Combine action items with referral followup requests for status
         patient_action_items = self.actionitem_set.all()
@@ -300,21 +497,62 @@ class Patient(Person):
         patient_action_items = list(chain(patient_action_items,
                                           referral_followup_requests))
 
-        done = [ai for ai in patient_action_items if ai.completion_author is not None]
-        overdue = [ai for ai in patient_action_items if ai.completion_author is None and ai.due_date <= now().date()]
-        pending = [ai for ai in patient_action_items if ai.completion_author is None and ai.due_date > now().date()]
-
-        if len(overdue) > 0:
-            due_dates = ", ".join([str((now().date()-ai.due_date).days) for ai in overdue])
-            return "Action items " + due_dates + " days past due"
-        elif len(pending) > 0:
-            next_item = min(pending, key=lambda k: k.due_date)
-            tdelta = next_item.due_date - now().date()
-            return "next action in "+str(tdelta.days)+" days"
-        elif len(done) > 0:
-            return "all actions complete"
-        else:
-            return "no pending actions"
+        done = [ai for ai in patient_action_items
+                if ai.completion_author_id is not None]
+        overdue = [ai for ai in patient_action_items
+                   if ai.completion_author_id is None and
+                   ai.due_date <= now().date()]
+        pending = [ai for ai in patient_action_items
+                   if ai.completion_author_id is None and
+                   ai.due_date > now().date()]
+
+        next_due_date = min([ai.due_date for ai in pending] or [None])
+        n_done = len(done)
+
+        return action_item_status([ai.due_date for ai in overdue],
+                                  next_due_date, n_done)
+
+    def timeline(self, after=None):
+        '''The notes in self.notes(), ordered by TIMELINE_ORDERING (newest
+        first), as a queryset of {'written_datetime', 'note_type', 'pk'}
+        rows. The tables of each kind of note are merged and sorted by the
+        database, with a UNION, so a page of the timeline can be had
+        without loading every note; timeline_notes() then loads the notes
+        on it.
+
+        If after is the (written_datetime, note_type, pk) of a row, only
+        the rows that come after it are included. This can't be done by
+        filtering the union, so it's done to each table before they're
+        merged.
+        '''
+
+        parts = []
+        for model in timeline_note_models():
+            note_type = model._meta.model_name
+            notes = model.objects.filter(patient=self)
+
+            if after is not None:
+                written_datetime, after_type, after_pk = after
+
+                later = Q(written_datetime__lt=written_datetime)
+                if note_type < after_type:
+                    later |= Q(written_datetime=written_datetime)
+                elif note_type == after_type:
+                    later |= Q(written_datetime=written_datetime,
+                               pk__lt=after_pk)
+                notes = notes.filter(later)
+
+            # the parts of a union can't be ordered, so the default
+            # ordering of notes is cleared.
+            parts.append(notes
+                         .order_by()
+                         .annotate(note_type=Value(
+                             note_type, output_field=models.CharField()))
+                         .values('written_datetime', 'note_type', 'pk'))
+
+        return parts[0] \
+            .union(*parts[1:], all=True) \
+            .order_by(*TIMELINE_ORDERING)
 
     def followup_set(self):
         followups = []
@@ -333,7 +571,7 @@ class Patient(Person):
             gets all patients in prefetch_related instead of requesting for
             latest_workup individually.
         """
-        wu_set = self.workup_set
+        wu_set = self.workup_set.select_related('clinic_day', 'signer')
         return wu_set.order_by("clinic_day__clinic_date").first()
 
     def notes(self):
@@ -445,6 +683,14 @@ class CompletableManager(models.Manager):
             .exclude(completion_author=None)\
             .order_by('completion_date')
 
+    def get_all(self, patient):
+        """ Returns all elements of Completable class, along with the
+        related objects their blurbs show."""
+        return self.get_queryset()\
+            .filter(patient=patient)\
+            .select_related('author', *self.model.BLURB_RELATED_FIELDS)\
+            .order_by('completion_date', '-written_datetime', '-last_modified')
+
 
 class CompletableMixin(models.Model):
     """CompleteableMixin is for anything that goes in that list of
@@ -457,6 +703,10 @@ class CompletableMixin(models.Model):
 
     objects = CompletableManager()
 
+    # The related objects that short_name(), summary() and mark_done_url()
+    # use, so that CompletableManager.get_all() can load them up front.
+    BLURB_RELATED_FIELDS = []
+
     completion_date = models.DateTimeField(blank=True, null=True)
     completion_author = models.ForeignKey(
         Provider,
@@ -505,6 +755,7 @@ class ActionItem(Note, CompletableMixin):
     comments = models.TextField()
 
     MARK_DONE_URL_NAME = 'done-action-item'
+    BLURB_RELATED_FIELDS = ['instruction']
 
     history = HistoricalRecords()
 
@@ -535,3 +786,427 @@ class ActionItem(Note, CompletableMixin):
     def __str__(self):
         return " ".join(["AI for", str(self.patient) + ":",
                          str(self.instruction), "due on", str(self.due_date)])
+
+
+class PatientSummaryManager(models.Manager):
+
+    def summarize(self, patient_ids):
+        '''Compute (but don't save) the PatientSummary of each patient in
+        patient_ids. Costs a constant number of queries however many
+        patients there are.'''
+
+        Workup = apps.get_model('workup', 'Workup')
+        patient_ids = list(patient_ids)
+
+        # like Patient.latest_workup(), this is the workup on the earliest
+        # clinic date, so that lists agree with the rest of Osler.
+        workups = Workup.objects \
+            .filter(patient=OuterRef('pk')) \
+            .order_by('clinic_day__clinic_date', 'pk')
+
+        rows = Patient.objects \
+            .filter(pk__in=patient_ids) \
+            .annotate(
+                summary_workup=Subquery(
+                    workups.values('pk')[:1],
+                    output_field=models.IntegerField()),
+                summary_workup_date=Subquery(
+                    workups.values('clinic_day__clinic_date')[:1],
+                    output_field=models.DateField()),
+                summary_unsigned=Exists(Workup.objects.filter(
+                    patient=OuterRef('pk'), signer=None)),
+                summary_priority=Exists(ActionItem.objects.filter(
+                    patient=OuterRef('pk'), priority=True,
+                    completion_date=None))) \
+            .values('pk', 'intake_datetime', 'summary_workup',
+                    'summary_workup_date', 'summary_unsigned',
+                    'summary_priority')
+
+        open_due_dates = defaultdict(list)
+        done_counts = defaultdict(int)
+        for model in todo_list_models():
+            items = model.objects \
+                .filter(patient__in=patient_ids) \
+                .order_by() \
+                .values_list('patient', 'due_date', 'completion_author')
+
+            for patient_id, due_date, completion_author_id in items:
+                if completion_author_id is None:
+                    open_due_dates[patient_id].append(due_date)
+                else:
+                    done_counts[patient_id] += 1
+
+        summaries = []
+        for row in rows:
+            due_dates = sorted(open_due_dates[row['pk']])
+            latest_activity_date = row['summary_workup_date'] or \
+                localdate(row['intake_datetime'])
+
+            summaries.append(self.model(
+                patient_id=row['pk'],
+                latest_workup_id=row['summary_workup'],
+                latest_activity_date=latest_activity_date,
+                has_unsigned_workup=bool(row['summary_unsigned']),
+                has_priority_item=bool(row['summary_priority']),
+                open_due_dates=",".join(d.isoformat() for d in due_dates),
+                soonest_due_date=due_dates[0] if due_dates else None,
+                done_count=done_counts[row['pk']]))
+
+        return summaries
+
+    def refresh(self, patient_ids, create=False):
+        '''Recompute and save the summaries of the patients in patient_ids.
+
+        Only summaries that already exist are updated, unless create is
+        set, so that notes deleted along with their patient don't bring
+        its summary back.
+        '''
+
+        fields = [f.attname for f in self.model._meta.concrete_fields
+                  if not f.primary_key]
+
+        for summary in self.summarize(patient_ids):
+            updated = self.filter(pk=summary.pk).update(
+                **{field: getattr(summary, field) for field in fields})
+
+            if not updated and create:
+                summary.save(force_insert=True)
+
+    def rebuild(self, batch_size=500):
+        '''Throw away every summary and recompute them all, batch_size
+        patients at a time. Returns the number of patients summarized.'''
+
+        patient_ids = list(Patient.objects.order_by('pk')
+                           .values_list('pk', flat=True))
+
+        with transaction.atomic():
+            self.all().delete()
+            for i in range(0, len(patient_ids), batch_size):
+                self.bulk_create(
+                    self.summarize(patient_ids[i:i + batch_size]))
+
+        return len(patient_ids)
+
+
+class PatientSummary(models.Model):
+    '''What the patient lists show about each patient, worked out ahead of
+    time so that the lists needn't look through every patient's notes.
+
+    The summary of a patient is brought up to date whenever they, their
+    workups or their action items (and the other models of
+    OSLER_TODO_LIST_MANAGERS) are saved or deleted, and all of them can be
+    rebuilt with the rebuild_patient_summaries command. Bulk updates
+    don't send signals, so they need a rebuild afterwards.
+    '''
+
+    objects = PatientSummaryManager()
+
+    patient = models.OneToOneField(
+        Patient, primary_key=True, related_name='summary')
+
+    latest_workup = models.ForeignKey(
+        'workup.Workup', null=True, blank=True, related_name='+',
+        on_delete=models.SET_NULL)
+
+    # the clinic date of latest_workup or, if there isn't one, the date of
+    # intake.
+    latest_activity_date = models.DateField(null=True, db_index=True)
+
+    has_unsigned_workup = models.BooleanField(default=False)
+    has_priority_item = models.BooleanField(default=False)
+
+    # the (comma separated, ISO format) due dates of every action item
+    # that isn't done, soonest first. These are kept rather than counts of
+    # overdue and pending items, which change with the date.
+    open_due_dates = models.TextField(blank=True)
+    soonest_due_date = models.DateField(null=True, db_index=True)
+
+    done_count = models.IntegerField(default=0)
+
+    def open_due_date_list(self):
+        return [datetime.datetime.strptime(d, '%Y-%m-%d').date()
+                for d in self.open_due_dates.split(',') if d]
+
+    def status(self):
+        '''The same as Patient.status(), without any queries.'''
+
+        today = now().date()
+        due_dates = self.open_due_date_list()
+
+        return action_item_status(
+            [d for d in due_dates if d <= today],
+            min([d for d in due_dates if d > today] or [None]),
+            self.done_count)
+
+    def __str__(self):
+        return "Summary of %s" % self.patient_id
+
+
+def summarize_patient(sender, instance, **kwargs):
+    '''Receives Patient's post_save, to (re)summarize the patient.'''
+    PatientSummary.objects.refresh([instance.pk], create=True)
+
+
+def resummarize_note_patient(sender, instance, **kwargs):
+    '''Receives the post_save and post_delete of summarized notes (e.g.
+    workups and action items), to bring the summary of the note's patient
+    up to date.'''
+    PatientSummary.objects.refresh([instance.patient_id])
+
+
+def resummarize_clinic_date_patients(sender, instance, **kwargs):
+    '''Receives ClinicDate's post_save, since its date may be the date of
+    some patients' latest activity.'''
+    PatientSummary.objects.refresh(
+        instance.workup_set.values_list('patient', flat=True))
+
+
+def phone_digits(phone):
+    '''The digits of the phone number phone, e.g. "(314) 555-0123" ->
+    "3145550123".'''
+    return re.sub(r'\D', '', phone or '')
+
+
+def phone_digits_variants(digits):
+    '''The ways the phone number whose digits are digits may have been
+    written down: with or without the US country code.'''
+    variants = [digits]
+    if len(digits) == 11 and digits.startswith('1'):
+        variants.append(digits[1:])
+    elif len(digits) == 10:
+        variants.append('1' + digits)
+
+    return variants
+
+
+# the formats dates of birth may be searched for in, besides ISO
+SEARCH_DATE_FORMATS = ['%m/%d/%Y', '%m-%d-%Y']
+
+
+def patient_search_tokens(patient):
+    '''The set of (kind, token) that patient can be found by: each word of
+    their names (normalized like duplicates.name_key()), the digits of
+    each of their phone numbers (and their last 7 and 4 digits, since
+    area and country codes are often left off), their zip code and their
+    date of birth.'''
+
+    Token = PatientSearchToken
+    tokens = set()
+
+    for name in [patient.first_name, patient.middle_name, patient.last_name]:
+        # both the words of names like "Van der Berg" and the whole name
+        for word in re.split(r'[\s-]+', name or '') + [name]:
+            if name_key(word):
+                tokens.add((Token.NAME, name_key(word)))
+
+    for phone, _ in patient.all_phones():
+        digits = phone_digits(phone)
+        for suffix in [digits, digits[-7:], digits[-4:]]:
+            if suffix:
+                tokens.add((Token.PHONE, suffix))
+
+    if patient.zip_code:
+        tokens.add((Token.ZIP_CODE, patient.zip_code))
+
+    if patient.date_of_birth:
+        tokens.add((Token.DATE_OF_BIRTH, patient.date_of_birth.isoformat()))
+
+    return tokens
+
+
+def search_terms(query):
+    '''Parse a patient search into terms, as (kinds of token the term may
+    match, token, whether the term may match just the beginning of a
+    token). Dates are only matched exactly; numbers match the beginning of
+    phone numbers and zip codes, and anything else the beginning of a
+    name.'''
+
+    Token = PatientSearchToken
+    terms = []
+    for word in query.split():
+        date = None
+        for date_format in ['%Y-%m-%d'] + SEARCH_DATE_FORMATS:
+            try:
+                date = datetime.datetime.strptime(word, date_format).date()
+                break
+            except ValueError:
+                continue
+
+        if date is not None:
+            terms.append(([Token.DATE_OF_BIRTH], date.isoformat(), False))
+        elif not re.search(r'[^\W\d_]', word, re.UNICODE):
+            digits = phone_digits(word)
+            if digits:
+                terms.append(([Token.PHONE, Token.ZIP_CODE], digits, True))
+        elif name_key(word):
+            terms.append(([Token.NAME], name_key(word), True))
+
+    return terms
+
+
+class PatientSearchTokenManager(models.Manager):
+
+    def index(self, patients):
+        '''Replace the search tokens of each of patients.'''
+
+        patients = list(patients)
+        with transaction.atomic():
+            self.filter(patient__in=[p.pk for p in patients]).delete()
+            self.bulk_create([
+                self.model(patient_id=patient.pk, kind=kind, token=token)
+                for patient in patients
+                for kind, token in patient_search_tokens(patient)])
+
+    def rebuild(self, batch_size=500):
+        '''Throw away every search token and index every patient again,
+        batch_size patients at a time. Returns the number of patients
+        indexed.'''
+
+        patient_ids = list(Patient.objects.order_by('pk')
+                           .values_list('pk', flat=True))
+
+        with transaction.atomic():
+            self.all().delete()
+            for i in range(0, len(patient_ids), batch_size):
+                self.index(Patient.objects.filter(
+                    pk__in=patient_ids[i:i + batch_size]))
+
+        return len(patient_ids)
+
+    def search(self, query, limit):
+        '''The ids of (at most limit of) the patients matching every term
+        of query (see search_terms()), best first. A term matching a whole
+        token scores more than one matching only its beginning; ties are
+        broken by name.'''
+
+        terms = search_terms(query)
+        if not terms:
+            return []
+
+        scores = {}
+        any_term = Q()
+        for i, (kinds, token, prefix) in enumerate(terms):
+            exact = Q(kind__in=kinds, token=token)
+            begins = Q(kind__in=kinds, token__startswith=token) if prefix \
+                else exact
+
+            any_term |= begins
+            scores['term_%s' % i] = Max(Case(
+                When(exact, then=Value(2)),
+                When(begins, then=Value(1)),
+                default=Value(0),
+                output_field=models.IntegerField()))
+
+        return list(self
+                    .filter(any_term)
+                    .values('patient')
+                    .annotate(**scores)
+                    .filter(**{'%s__gt' % name: 0 for name in scores})
+                    .annotate(score=reduce(operator.add,
+                                           [F(name) for name in scores]))
+                    .order_by('-score', 'patient__last_name',
+                              'patient__first_name', 'patient')
+                    .values_list('patient', flat=True)[:limit])
+
+
+class PatientSearchToken(models.Model):
+    '''A word or number that a patient can be searched for by (see
+    patient_search_tokens()). Searches only match the beginnings of
+    tokens, so they can use the index on them.
+
+    A patient's tokens are replaced whenever they're saved, and all of
+    them can be rebuilt with the rebuild_patient_search_index command.
+    '''
+
+    NAME = 'n'
+    PHONE = 'p'
+    ZIP_CODE = 'z'
+    DATE_OF_BIRTH = 'd'
+    KIND_CHOICES = [(NAME, 'name'), (PHONE, 'phone'), (ZIP_CODE, 'zip code'),
+                    (DATE_OF_BIRTH, 'date of birth')]
+
+    objects = PatientSearchTokenManager()
+
+    patient = models.ForeignKey(Patient, related_name='search_tokens')
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    token = models.CharField(max_length=100, db_index=True)
+
+    def __str__(self):
+        return "%s: %s" % (self.get_kind_display(), self.token)
+
+
+def index_patient_search_tokens(sender, instance, **kwargs):
+    '''Receives Patient's post_save, to replace the patient's search
+    tokens.'''
+    PatientSearchToken.objects.index([instance])
+
+
+class PatientPhoneManager(models.Manager):
+
+    def index(self, patients):
+        '''Replace the phone numbers of each of patients.'''
+
+        patients = list(patients)
+        with transaction.atomic():
+            self.filter(patient__in=[p.pk for p in patients]).delete()
+            self.bulk_create([
+                self.model(patient_id=patient.pk, number=phone_digits(phone),
+                           owner=owner or '')
+                for patient in patients
+                for phone, owner in patient.all_phones()
+                if phone_digits(phone)])
+
+    def rebuild(self, batch_size=500):
+        '''Throw away every phone number and index every patient's again,
+        batch_size patients at a time. Returns the number of patients
+        indexed.'''
+
+        patient_ids = list(Patient.objects.order_by('pk')
+                           .values_list('pk', flat=True))
+
+        with transaction.atomic():
+            self.all().delete()
+            for i in range(0, len(patient_ids), batch_size):
+                self.index(Patient.objects.filter(
+                    pk__in=patient_ids[i:i + batch_size]))
+
+        return len(patient_ids)
+
+    def lookup(self, phone):
+        '''The phone numbers (with their patients) that phone, written any
+        which way, might be.'''
+
+        digits = phone_digits(phone)
+        if not digits:
+            return self.none()
+
+        return self \
+            .filter(number__in=phone_digits_variants(digits)) \
+            .select_related('patient') \
+            .order_by('patient__last_name', 'patient__first_name', 'pk')
+
+
+class PatientPhone(models.Model):
+    '''One of a patient's phone numbers (see Patient.all_phones()), as
+    digits only, so that who's calling can be looked up by the index on
+    them rather than by searching every phone field in every format.
+
+    A patient's phone numbers are replaced whenever they're saved, and all
+    of them can be rebuilt with the rebuild_patient_search_index command.
+    '''
+
+    objects = PatientPhoneManager()
+
+    patient = models.ForeignKey(Patient, related_name='phones')
+    number = models.CharField(max_length=40, db_index=True)
+    owner = models.CharField(max_length=40, blank=True)
+
+    def __str__(self):
+        return "%s (%s)" % (self.number, self.owner) if self.owner \
+            else self.number
+
+
+def index_patient_phones(sender, instance, **kwargs):
+    '''Receives Patient's post_save, to replace the patient's phone
+    numbers.'''
+    PatientPhone.objects.index([instance])
@@ -0,0 +1,147 @@
+'''Cached choices of providers, for the form fields (like the workup's
+attending) that offer every provider with some kind of role.
+
+The choices, and the HTML of the widgets rendering them, are stored in the
+cache under the current "generation", which is bumped whenever a provider,
+their roles or a provider type is saved or deleted, and again when the
+change is committed (see PttrackConfig.ready()).
+'''
+from __future__ import unicode_literals
+from builtins import str
+import hashlib
+import uuid
+
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Provider, ProviderType
+
+GENERATION_KEY = 'provider_choices_generation'
+
+
+def generation():
+    '''The current generation of the provider choices.'''
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        current = uuid.uuid4().hex
+        cache.add(GENERATION_KEY, current, None)
+        # another process may have got there first
+        current = cache.get(GENERATION_KEY, current)
+
+    return current
+
+
+def bump_generation():
+    '''Move the provider choices on to a new (random, as in api.caching)
+    generation.'''
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate(*args, **kwargs):
+    '''Invalidate every cached provider choice, now and when the current
+    transaction commits (so that choices built by another request before
+    the commit aren't kept). Takes (and ignores) any arguments, so that it
+    can be connected to signals directly.'''
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+
+def cache_key(prefix, key_parts):
+    return '%s:%s:%s' % (
+        prefix, generation(),
+        hashlib.sha1(str(key_parts).encode('utf-8')).hexdigest())
+
+
+def providers_with_roles(**role_filter):
+    '''The providers with any role matching role_filter (e.g.
+    signs_charts=True), each once, by last name.'''
+    return Provider.objects \
+        .filter(clinical_roles__in=ProviderType.objects.filter(**role_filter)) \
+        .distinct() \
+        .order_by('last_name', 'first_name', 'pk')
+
+
+def provider_choices(**role_filter):
+    '''The (pk, name) choices of providers_with_roles(**role_filter), from
+    the cache if they're there.'''
+    key = cache_key('provider_choices', sorted(role_filter.items()))
+
+    choices = cache.get(key)
+    if choices is None:
+        choices = [(provider.pk, str(provider)) for provider in
+                   providers_with_roles(**role_filter).only(
+                       'pk', 'first_name', 'middle_name', 'last_name')]
+        cache.set(key, choices, settings.OSLER_PROVIDER_CHOICES_CACHE_TIMEOUT)
+
+    return choices
+
+
+class ProviderChoiceIterator(forms.models.ModelChoiceIterator):
+    '''Iterates over the cached choices of a provider choice field.'''
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for choice in provider_choices(**self.field.role_filter):
+            yield choice
+
+    def __len__(self):
+        return (len(provider_choices(**self.field.role_filter)) +
+                (1 if self.field.empty_label is not None else 0))
+
+
+class CachedRenderMixin(object):
+    '''Caches the HTML of a choice widget for each value it renders. Its
+    field sets choices_key to something identifying its choices.'''
+
+    choices_key = None
+
+    def render(self, name, value, attrs=None, renderer=None):
+        if self.choices_key is None:
+            return super(CachedRenderMixin, self).render(
+                name, value, attrs=attrs, renderer=renderer)
+
+        key = cache_key('provider_choices_html', (
+            self.choices_key, name, value, sorted(self.attrs.items()),
+            sorted((attrs or {}).items()), self.is_required))
+
+        html = cache.get(key)
+        if html is None:
+            html = super(CachedRenderMixin, self).render(
+                name, value, attrs=attrs, renderer=renderer)
+            cache.set(key, html, settings.OSLER_PROVIDER_CHOICES_CACHE_TIMEOUT)
+
+        return html
+
+
+class ProviderSelect(CachedRenderMixin, forms.Select):
+    pass
+
+
+class ProviderSelectMultiple(CachedRenderMixin, forms.SelectMultiple):
+    pass
+
+
+class ProviderChoiceMixin(object):
+    '''A ModelChoiceField of the providers with a role matching role_filter
+    (e.g. signs_charts=True), whose choices come from the cache.'''
+
+    iterator = ProviderChoiceIterator
+
+    def __init__(self, role_filter, *args, **kwargs):
+        self.role_filter = role_filter
+        super(ProviderChoiceMixin, self).__init__(
+            providers_with_roles(**role_filter), *args, **kwargs)
+        self.widget.choices_key = (
+            sorted(role_filter.items()), self.empty_label)
+
+
+class ProviderChoiceField(ProviderChoiceMixin, forms.ModelChoiceField):
+    widget = ProviderSelect
+
+
+class ProviderMultipleChoiceField(ProviderChoiceMixin,
+                                  forms.ModelMultipleChoiceField):
+    widget = ProviderSelectMultiple
@@ -0,0 +1,220 @@
+'''A cache, in each process, of the small tables of reference data that
+almost never change (genders, languages, provider types and the other
+models of OSLER_REFERENCE_MODELS).
+
+Every table is loaded whole the first time it's needed, and then form
+choices and foreign keys to it (e.g. patient.gender) are read from memory
+(see install()). Saving or deleting a row of any of the tables bumps a
+"generation" in the cache (and again when the change is committed); each
+process checks the generation at most every
+OSLER_REFERENCE_CACHE_CHECK_SECONDS, and reloads the tables it has cached
+when it has moved on.
+'''
+from __future__ import unicode_literals
+from builtins import object
+from functools import partial
+import time
+import uuid
+
+from django import forms
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.fields.related_descriptors import \
+    ForwardManyToOneDescriptor
+
+GENERATION_KEY = 'reference_generation'
+
+
+def reference_models():
+    return [apps.get_model(app, model)
+            for app, model in settings.OSLER_REFERENCE_MODELS]
+
+
+def generation():
+    '''The current generation of the reference tables.'''
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        current = uuid.uuid4().hex
+        cache.add(GENERATION_KEY, current, None)
+        # another process may have got there first
+        current = cache.get(GENERATION_KEY, current)
+
+    return current
+
+
+def bump_generation():
+    '''Move the reference tables on to a new (random, as in
+    api.caching) generation, and forget this process' tables.'''
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+    reference_cache.clear()
+
+
+class ReferenceCache(object):
+    '''The reference tables loaded by this process.'''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # model label -> (generation, objects, {pk: object})
+        self.tables = {}
+        self.generation = None
+        self.checked_at = None
+
+    def current_generation(self):
+        if (self.checked_at is None or time.time() - self.checked_at >=
+                settings.OSLER_REFERENCE_CACHE_CHECK_SECONDS):
+            self.generation = generation()
+            self.checked_at = time.time()
+
+        return self.generation
+
+    def table(self, model):
+        current = self.current_generation()
+        table = self.tables.get(model._meta.label)
+        if table is None or table[0] != current:
+            objects = list(model._default_manager.all())
+            table = (current, objects, {obj.pk: obj for obj in objects})
+            self.tables[model._meta.label] = table
+
+        return table
+
+    def all(self, model):
+        '''Every row of model, in its default order. These are the cached
+        objects themselves, shared by every caller, so mustn't be changed
+        or handed out.'''
+        return self.table(model)[1]
+
+    def get(self, model, pk):
+        '''A copy of the row of model with pk, or None if there isn't
+        one. The copy is the caller's own (e.g. to change and save), as
+        if it had been loaded from the database.'''
+        obj = self.table(model)[2].get(pk)
+        if obj is None:
+            return None
+
+        fields = model._meta.concrete_fields
+        return model.from_db(obj._state.db,
+                             [f.attname for f in fields],
+                             [getattr(obj, f.attname) for f in fields])
+
+
+# each process has its own cache
+reference_cache = ReferenceCache()
+
+
+def invalidate(*args, **kwargs):
+    '''Invalidate the reference tables cached by every process, now and
+    when the current transaction commits (so that tables reloaded by
+    another process before the commit aren't kept). Takes (and ignores)
+    any arguments, so that it can be connected to signals directly.'''
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+
+def is_whole_table(queryset):
+    '''Whether queryset is every row of a reference table in the default
+    order, and so can be read from the cache.'''
+    query = queryset.query
+    return (queryset.model in reference_models() and
+            not query.has_filters() and not query.order_by and
+            not query.low_mark and query.high_mark is None)
+
+
+class ReferenceChoiceIterator(forms.models.ModelChoiceIterator):
+    '''Iterates over the choices of a field from the reference cache, if
+    its queryset is the whole of a reference table.'''
+
+    def __iter__(self):
+        if not is_whole_table(self.queryset):
+            for choice in super(ReferenceChoiceIterator, self).__iter__():
+                yield choice
+            return
+
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in reference_cache.all(self.queryset.model):
+            yield self.choice(obj)
+
+    def __len__(self):
+        if not is_whole_table(self.queryset):
+            return super(ReferenceChoiceIterator, self).__len__()
+
+        return (len(reference_cache.all(self.queryset.model)) +
+                (1 if self.field.empty_label is not None else 0))
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    '''A ModelChoiceField whose choices, and the object chosen, come from
+    the reference cache.'''
+
+    iterator = ReferenceChoiceIterator
+
+    def to_python(self, value):
+        model = self.queryset.model
+        # foreign keys' form fields name the primary key as to_field_name
+        if (value in self.empty_values or
+                self.to_field_name not in (None, model._meta.pk.name) or
+                not is_whole_table(self.queryset)):
+            return super(ReferenceChoiceField, self).to_python(value)
+
+        try:
+            obj = reference_cache.get(model, model._meta.pk.to_python(value))
+        except ValidationError:
+            obj = None
+
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'],
+                                  code='invalid_choice')
+        return obj
+
+
+class ReferenceMultipleChoiceField(forms.ModelMultipleChoiceField):
+    '''A ModelMultipleChoiceField whose choices come from the reference
+    cache.'''
+
+    iterator = ReferenceChoiceIterator
+
+
+class ReferenceDescriptor(ForwardManyToOneDescriptor):
+    '''Reads the object a foreign key to a reference table refers to from
+    the reference cache, rather than the database.'''
+
+    def get_object(self, instance):
+        obj = reference_cache.get(self.field.remote_field.model,
+                                  getattr(instance, self.field.attname))
+        if obj is None:
+            # not (yet) in this process' cache
+            return super(ReferenceDescriptor, self).get_object(instance)
+        return obj
+
+
+def reference_formfield(db_field, form_class, **kwargs):
+    kwargs.setdefault('form_class', form_class)
+    return type(db_field).formfield(db_field, **kwargs)
+
+
+def install():
+    '''Make every foreign key and many to many field to a reference table
+    (in every installed app, including historical models) read the table
+    from the cache: for foreign keys, when following them, and for both,
+    in forms.'''
+
+    models = reference_models()
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if (not field.concrete or not field.is_relation or
+                    field.auto_created or
+                    field.remote_field.model not in models):
+                continue
+
+            if field.many_to_one:
+                setattr(model, field.name, ReferenceDescriptor(field))
+                field.formfield = partial(
+                    reference_formfield, field, ReferenceChoiceField)
+            elif field.many_to_many:
+                field.formfield = partial(
+                    reference_formfield, field, ReferenceMultipleChoiceField)
@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from .benchmark import Benchmark
+
+BASIC_FIXTURE = 'pttrack.json'
+
+# Pages that still make queries per row. Take pages off this list as
+# they're fixed, so that they stay fixed.
+KNOWN_SCALING = {
+    'patient_detail',
+    'clinic_date_list',
+    'dashboard_attending',
+    'appointment_list',
+}
+
+
+class BenchmarkTest(TestCase):
+    fixtures = [BASIC_FIXTURE]
+
+    def test_benchmark(self):
+        benchmark = Benchmark([10, 20, 40])
+        results = benchmark.run()
+
+        for name, measurements in results.items():
+            self.assertEqual(len(measurements), 3)
+            for measurement in measurements:
+                self.assertEqual(measurement.status_code, 200, name)
+
+        self.assertLessEqual(set(benchmark.scaling_pages()), KNOWN_SCALING)
+        self.assertIn('pdf_workup', benchmark.report())
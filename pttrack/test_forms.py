@@ -165,3 +165,39 @@ class TestPatientCreateForms(TestCase):
         form = forms.PatientForm(data=form_data)
         # we expect errors on the empty alternate_phone_1_owner field
         self.assertNotEqual(form['alternate_phone_1_owner'].errors, [])
+
+    def test_casemanager_choices_cached(self):
+        '''The case manager choices list each provider once, are cached,
+        and change as providers and their roles do.'''
+
+        casemanager = ProviderType.objects.create(
+            long_name='Case Manager', short_name='CM',
+            signs_charts=False, staff_view=True)
+        social_worker = ProviderType.objects.create(
+            long_name='Social Worker', short_name='SW',
+            signs_charts=False, staff_view=True)
+
+        provider = Provider.objects.create(
+            first_name="Firstname", last_name="Lastname",
+            gender=Gender.objects.first())
+        provider.clinical_roles.add(casemanager, social_worker)
+
+        def choices():
+            return [c[0] for c in forms.PatientForm()['case_managers']
+                    .field.choices]
+
+        self.assertEqual(choices(), [provider.pk])
+
+        # neither the choices nor their HTML are built again
+        str(forms.PatientForm()['case_managers'])
+        with self.assertNumQueries(0):
+            self.assertEqual(choices(), [provider.pk])
+            str(forms.PatientForm()['case_managers'])
+
+        provider.clinical_roles.remove(casemanager, social_worker)
+        self.assertEqual(choices(), [])
+
+        provider.clinical_roles.add(casemanager)
+        provider.first_name = "Newname"
+        provider.save()
+        self.assertIn("Newname", str(forms.PatientForm()['case_managers']))
@@ -0,0 +1,257 @@
+from __future__ import unicode_literals
+import datetime
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.timezone import now, localdate
+
+from referral.models import Referral, FollowupRequest, PatientContact
+from workup.models import ClinicDate, ClinicType, Workup
+
+from . import forms, models, reference
+from .test_views import build_provider
+
+BASIC_FIXTURE = 'pttrack.json'
+
+
+class PatientStatusTest(TestCase):
+    fixtures = [BASIC_FIXTURE]
+
+    def setUp(self):
+        self.provider = build_provider()
+        self.note_kwargs = {
+            'author': self.provider,
+            'author_type': self.provider.clinical_roles.first(),
+        }
+
+        pt_prototype = {
+            'phone': '+49 178 236 5288',
+            'gender': models.Gender.objects.first(),
+            'address': 'Schulstrasse 9',
+            'city': 'Munich',
+            'state': 'BA',
+            'zip_code': '63108',
+            'date_of_birth': datetime.date(1990, 1, 1),
+        }
+
+        self.pt_overdue = models.Patient.objects.create(
+            first_name="Juggie", last_name="Brodeltein", **pt_prototype)
+        self.pt_pending = models.Patient.objects.create(
+            first_name="Asdf", last_name="Lkjh", **pt_prototype)
+        self.pt_done = models.Patient.objects.create(
+            first_name="No", last_name="Action", **pt_prototype)
+
+        today = now().date()
+        for pt, due_in, done in [(self.pt_overdue, -1, False),
+                                 (self.pt_overdue, 0, False),
+                                 (self.pt_overdue, 5, False),
+                                 (self.pt_pending, 3, False),
+                                 (self.pt_pending, 10, False),
+                                 (self.pt_pending, -4, True),
+                                 (self.pt_done, -2, True)]:
+            ai = models.ActionItem(
+                due_date=today + datetime.timedelta(days=due_in),
+                instruction=models.ActionInstruction.objects.first(),
+                comments="", patient=pt, **self.note_kwargs)
+            if done:
+                ai.mark_done(self.provider)
+            ai.save()
+
+        referral = Referral.objects.create(
+            kind=models.ReferralType.objects.first(),
+            patient=self.pt_pending, **self.note_kwargs)
+        FollowupRequest.objects.create(
+            referral=referral, contact_instructions="Call him",
+            due_date=today + datetime.timedelta(days=2),
+            patient=self.pt_pending, **self.note_kwargs)
+
+    def test_status(self):
+        self.assertIn(self.pt_overdue.status(),
+                      ["Action items 0, 1 days past due",
+                       "Action items 1, 0 days past due"])
+        self.assertEqual(self.pt_pending.status(), "next action in 2 days")
+        self.assertEqual(self.pt_done.status(), "all actions complete")
+        self.assertEqual(models.Patient.objects.get(pk=1).status(),
+                         "no pending actions")
+
+    def test_summary_status(self):
+        expected = {pt.pk: pt.status() for pt in models.Patient.objects.all()}
+
+        summaries = models.PatientSummary.objects.all()
+        with self.assertNumQueries(1):
+            statuses = {s.pk: s.status() for s in summaries}
+
+        self.assertEqual(statuses.pop(self.pt_overdue.pk),
+                         "Action items 1, 0 days past due")
+        expected.pop(self.pt_overdue.pk)
+        self.assertEqual(statuses, expected)
+
+    def test_summary_follows_notes(self):
+        pt = models.Patient.objects.get(pk=1)
+        summary = models.PatientSummary.objects.get(patient=pt)
+        self.assertIsNone(summary.latest_workup)
+        self.assertEqual(summary.latest_activity_date,
+                         localdate(pt.intake_datetime))
+
+        clinic_type = ClinicType.objects.create(name="Basic Care Clinic")
+        wus = [Workup.objects.create(
+            clinic_day=ClinicDate.objects.create(
+                clinic_type=clinic_type,
+                clinic_date=now().date() - datetime.timedelta(days=days)),
+            chief_complaint="SOB", diagnosis="MI", HPI="", PMH_PSH="",
+            meds="", allergies="", fam_hx="", soc_hx="", ros="", pe="",
+            A_and_P="", patient=pt, **self.note_kwargs)
+            for days in [3, 10]]
+
+        # like Patient.latest_workup(), the summary has the earliest
+        summary.refresh_from_db()
+        self.assertEqual(summary.latest_workup, pt.latest_workup())
+        self.assertEqual(summary.latest_workup, wus[1])
+        self.assertEqual(summary.latest_activity_date,
+                         wus[1].clinic_day.clinic_date)
+        self.assertTrue(summary.has_unsigned_workup)
+
+        for wu in wus:
+            wu.signer = self.provider
+            wu.save()
+        summary.refresh_from_db()
+        self.assertFalse(summary.has_unsigned_workup)
+
+        ai = models.ActionItem.objects.create(
+            due_date=now().date(), priority=True, comments="",
+            instruction=models.ActionInstruction.objects.first(),
+            patient=pt, **self.note_kwargs)
+        summary.refresh_from_db()
+        self.assertTrue(summary.has_priority_item)
+        self.assertEqual(summary.soonest_due_date, now().date())
+
+        wus[1].delete()
+        ai.delete()
+        summary.refresh_from_db()
+        self.assertEqual(summary.latest_workup, wus[0])
+        self.assertFalse(summary.has_priority_item)
+        self.assertEqual(summary.status(), "no pending actions")
+
+        # deleting a patient takes their summary (and notes) with them
+        pt.delete()
+        self.assertFalse(
+            models.PatientSummary.objects.filter(pk=1).exists())
+
+    def test_rebuild(self):
+        expected = {s.pk: s.status()
+                    for s in models.PatientSummary.objects.all()}
+
+        models.ActionItem.objects.update(completion_date=None,
+                                         completion_author=None)
+        models.PatientSummary.objects.all().delete()
+
+        self.assertEqual(
+            models.PatientSummary.objects.rebuild(batch_size=2),
+            models.Patient.objects.count())
+        statuses = {s.pk: s.status()
+                    for s in models.PatientSummary.objects.all()}
+
+        self.assertEqual(statuses[self.pt_done.pk],
+                         "Action items 2 days past due")
+        self.assertEqual(set(statuses), set(expected))
+
+
+class GenerateClinicDataTest(TestCase):
+    fixtures = [BASIC_FIXTURE]
+
+    def generate(self):
+        call_command('generate_clinic_data', patients=30, providers=10,
+                     seed=4, batch_size=7, years=1)
+
+    def test_generate_clinic_data(self):
+        n_patients = models.Patient.objects.count()
+        self.generate()
+
+        patients = models.Patient.objects.filter(pk__gt=n_patients) \
+            .order_by('pk')
+        self.assertEqual(patients.count(), 30)
+        self.assertGreater(Workup.objects.count(), 0)
+        self.assertGreater(models.ActionItem.objects.count(), 0)
+        self.assertGreater(FollowupRequest.objects.count(), 0)
+        self.assertGreater(PatientContact.objects.count(), 0)
+
+        # everyone was taken in within the last year, with a history
+        # record to show for it.
+        for patient in patients:
+            intake = patient.history.last()
+            self.assertEqual(intake.history_type, '+')
+            self.assertEqual(intake.history_date, patient.intake_datetime)
+            self.assertLessEqual((now() - intake.history_date).days, 366)
+        self.assertEqual(
+            models.ActionItem.history.count(),
+            models.ActionItem.objects.count())
+        self.assertEqual(
+            models.PatientSummary.objects.filter(patient__in=patients)
+            .exclude(latest_activity_date=None).count(), 30)
+
+        # the same seed builds the same clinic
+        self.generate()
+        names = [p.name() for p in models.Patient.objects.order_by('pk')]
+        self.assertEqual(names[-30:], names[-60:-30])
+
+
+class ReferenceCacheTest(TestCase):
+    fixtures = [BASIC_FIXTURE]
+
+    def setUp(self):
+        reference.reference_cache.clear()
+
+    def gender_choices(self):
+        return [label for _, label in
+                forms.PatientForm().fields['gender'].choices]
+
+    def test_choices_and_foreign_keys(self):
+        expected = ["---------"] + [
+            str(gender) for gender in models.Gender.objects.all()]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.gender_choices(), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.gender_choices(), expected)
+
+        # the object chosen comes from the cache too
+        male = models.Gender.objects.get(pk="Male")
+        with self.assertNumQueries(0):
+            field = forms.PatientForm().fields['gender']
+            self.assertEqual(field.clean("Male"), male)
+
+        patient = models.Patient.objects.first()
+        with self.assertNumQueries(0):
+            self.assertEqual(str(patient.gender), patient.gender_id)
+
+    def test_objects_are_copies(self):
+        patient = models.Patient.objects.first()
+        gender = patient.gender
+        gender.short_name = "X"
+
+        # changing one patient's gender doesn't change anyone else's
+        self.assertIsNot(models.Patient.objects.first().gender, gender)
+        self.assertNotEqual(
+            models.Patient.objects.first().gender.short_name, "X")
+
+        field = forms.PatientForm().fields['gender']
+        self.assertIsNot(field.clean(patient.gender_id), gender)
+        self.assertNotEqual(field.clean(patient.gender_id).short_name, "X")
+
+    def test_invalidated_on_save_and_delete(self):
+        self.gender_choices()
+
+        gender = models.Gender.objects.create(
+            long_name="Nonbinary", short_name="N")
+        self.assertIn("Nonbinary", self.gender_choices())
+
+        gender.delete()
+        self.assertNotIn("Nonbinary", self.gender_choices())
+
+    def test_filtered_choices_not_cached(self):
+        field = forms.PatientForm().fields['gender']
+        field.queryset = models.Gender.objects.filter(short_name="F")
+
+        with self.assertNumQueries(1):
+            self.assertEqual([label for _, label in field.choices],
+                             ["---------", "Female"])
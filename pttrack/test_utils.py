@@ -1,80 +1,15 @@
+# -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+from builtins import range
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
 import datetime
+from . import duplicates
 from . import utils
 from . import models
 
 
-class AllVariationsTests(TestCase):
-    """all_variations is a function that is used to help search for all
-    variations of a string that have either added, removed, or changed
-    1 letter. Function returns a list of all variations of the input string.
-    """
-
-    def test_empty_string(self):
-        """empty string should return empty list"""
-        name = ''
-        return_val = utils.all_variations(name)
-        self.assertEqual(return_val, [])
-
-    def test_none(self):
-        """input = None should return empty list"""
-        name = None
-        return_val = utils.all_variations(name)
-        self.assertEqual(return_val, [])
-
-    def test_singleton_string(self):
-        """string of length 1 should return a list consisting of just
-        itself"""
-        name = 'b'
-        return_val = utils.all_variations(name)
-        self.assertEqual(return_val, [name])
-
-    def test_first_letter_is_constant(self):
-        """Every value created should start with the first letter of the
-         search input (You are less likely to mess up the first letter
-         and not realize it"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        for val in return_val:
-            self.assertEqual(val[0], name[0])
-
-    def test_last_letter_changed(self):
-        """Last letter can be deleted or changed"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        self.assertTrue('bek' in return_val)
-        self.assertTrue('be' in return_val)
-
-    def test_add_letter(self):
-        """Can add letter and still get proper values"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        self.assertTrue('bean' in return_val)
-        self.assertTrue('baen' in return_val)
-
-    def test_remove_letter(self):
-        """letter can be removed"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        self.assertTrue('bn' in return_val)
-
-    def test_initial_name_present(self):
-        """initial name should be returned"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        self.assertTrue(name in return_val)
-
-    def test_number_vals_returned(self):
-        """for each letter (other than the first letter) there should be
-        26 variations for changes in a letter, 26 for adding a letter,
-        and 1 for removing the letter, and also add the original input
-        giving a total of (len(input) - 1) * 53 + 1 changes """
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        self.assertEqual(len(return_val), (len(name) - 1) * 53 + 1)
-
-
 def create_pts():
     pt_prototype = {
         'phone': '+49 178 236 5288',
@@ -236,3 +171,136 @@ class return_duplicatesTests(TestCase):
         self.assertEqual(len(models.Patient.objects.all()), 5)
         result = utils.return_duplicates("art", "meller")
         self.assertEqual(len(result), 4)
+
+    def test_two_typos_in_long_name(self):
+        """Long names may have two letters wrong"""
+        create_pts()
+        result = utils.return_duplicates("bengamim", "katz")
+        self.assertEqual([pt.first_name for pt in result], ["Benjamin"])
+
+    def test_sounds_alike(self):
+        """Names that sound the same match, however many typos apart"""
+        create_pts()
+        result = utils.return_duplicates("benjamin", "kads")
+        self.assertEqual([pt.first_name for pt in result], ["Benjamin"])
+
+    def test_date_of_birth_ranking(self):
+        """Patients with the given date of birth come first, then those
+        with dates of birth that might be typos of it"""
+        create_pts()
+        for first_name, dob in [("Artr", datetime.date(1985, 6, 2)),
+                                ("Arthur", datetime.date(1985, 2, 6))]:
+            pt = models.Patient.objects.get(first_name=first_name)
+            pt.date_of_birth = dob
+            pt.save()
+
+        result = utils.return_duplicates("artur", "meller",
+                                         datetime.date(1985, 6, 2))
+        self.assertEqual([pt.first_name for pt in result],
+                         ["Artr", "Arthur", "Artur"])
+
+    def test_follows_renames_and_deletes(self):
+        """The index is kept up to date as patients change"""
+        create_pts()
+        self.assertEqual(len(utils.return_duplicates("benjamin", "katz")), 1)
+
+        pt = models.Patient.objects.get(first_name="Benjamin")
+        pt.last_name = "Oberkatz"
+        pt.save()
+        self.assertEqual(len(utils.return_duplicates("benjamin", "katz")), 0)
+        self.assertEqual(
+            list(utils.return_duplicates("benjamin", "oberkats")), [pt])
+
+        pt.delete()
+        self.assertEqual(
+            len(utils.return_duplicates("benjamin", "oberkatz")), 0)
+
+
+class DuplicatesTests(TestCase):
+    """The name keys and edit distance structures behind
+    return_duplicates"""
+
+    def test_name_key(self):
+        self.assertEqual(duplicates.name_key("O'Brien-Núñez"),
+                         "obriennunez")
+        self.assertEqual(duplicates.name_key(""), "")
+
+    def test_soundex(self):
+        for name, code in [("robert", "r163"), ("rupert", "r163"),
+                           ("ashcraft", "a261"), ("tymczak", "t522"),
+                           ("pfister", "p236"), ("lee", "l000")]:
+            self.assertEqual(duplicates.soundex(name), code)
+
+    def test_bk_tree(self):
+        tree = duplicates.BKTree()
+        words = ["katz", "kats", "kapz", "katzington", "meller", "muller",
+                 "k"]
+        for word in words:
+            tree.add(word)
+
+        for query in ["katz", "ktz", "mellor", "x"]:
+            for max_distance in range(4):
+                self.assertEqual(
+                    sorted(tree.search(query, max_distance)),
+                    sorted(w for w in words if duplicates.edit_distance(
+                        query, w) <= max_distance))
+
+    def test_name_keys_stored(self):
+        create_pts()
+        pt = models.Patient.objects.get(first_name="Benjamin")
+        self.assertEqual(
+            (pt.first_name_key, pt.last_name_key, pt.first_name_sound,
+             pt.last_name_sound),
+            ("benjamin", "katz", "b525", "k320"))
+
+    def run_on_commit(self):
+        """Run the callbacks waiting for the test's transaction to commit
+        (which it never does)"""
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in callbacks:
+            callback()
+
+    def test_index_catches_up_on_changes(self):
+        """Other processes apply the changes they missed, without going
+        back to the database, unless they can't all be found"""
+        create_pts()
+        self.run_on_commit()
+        other = duplicates.DuplicateIndex()
+        other.sync()
+
+        # only changes to last names are recorded, once they're committed
+        pt = models.Patient.objects.get(first_name="Benjamin")
+        generation = duplicates.generation()
+        pt.first_name = "Ben"
+        pt.save()
+        self.run_on_commit()
+        self.assertEqual(duplicates.generation(), generation)
+
+        pt.last_name = "Oberkatz"
+        pt.save()
+        self.assertEqual(duplicates.generation(), generation)
+        self.run_on_commit()
+        self.assertEqual(duplicates.generation(), generation + 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(other.candidates("oberkatz"), {pt.pk})
+        self.assertNotIn(pt.pk, other.candidates("katz"))
+
+        # bulk changes aren't recorded, so the index is rebuilt
+        duplicates.bump_generation()
+        with self.assertNumQueries(1):
+            self.assertEqual(other.candidates("oberkatz"), {pt.pk})
+
+    def test_changes_on_the_same_generation(self):
+        """A change can't take a generation another process was also
+        handed, and claimed first"""
+        generation = duplicates.generation()
+        cache.add(duplicates.CHANGE_KEY % (generation + 1),
+                             (1000, "katz", "k320"))
+
+        self.assertEqual(
+            duplicates.record_change((1001, "meller", "m460")),
+            generation + 2)
+        self.assertEqual(
+            cache.get(duplicates.CHANGE_KEY % (generation + 1)),
+            (1000, "katz", "k320"))
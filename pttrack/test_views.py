@@ -7,13 +7,15 @@ from builtins import range
 import datetime
 import json
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.utils.timezone import now
 from django.core.files import File
 from django.core import mail
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 # For live tests.
 from selenium.webdriver.chrome.webdriver import WebDriver
@@ -25,8 +27,10 @@ from selenium.webdriver.support import expected_conditions as EC
 from . import models
 from .test import SeleniumLiveTestCase
 from workup import models as workupModels
-from followup.models import ContactResult
+from followup.models import ContactResult, GeneralFollowup, LabFollowup, \
+    VaccineFollowup, ReferralFollowup
 from referral.models import Referral, FollowupRequest, PatientContact
+from appointment.models import Appointment
 from referral.forms import PatientContactForm
 
 # pylint: disable=invalid-name
@@ -507,7 +511,7 @@ class LiveTestPatientLists(SeleniumLiveTestCase):
         self.selenium.get(
             '%s%s' % (self.live_server_url, reverse("all-patients")))
 
-        pt_tbody = self.selenium.find_element_by_xpath("//div[@class='container']/table/tbody")
+        pt_tbody = self.selenium.find_element_by_xpath("//div[@id='all-patients-results']/table/tbody")
         pt1_attest_status = pt_tbody.find_element_by_xpath("//tr[5]/td[6]")
             # attested note is marked as having been attested by the attending
         self.assertEquals(pt1_attest_status.text, str(self.providers['attending']))
@@ -542,7 +546,7 @@ class LiveTestPatientLists(SeleniumLiveTestCase):
         # WebDriverWait(self.selenium, 60).until(EC.presence_of_element_located((By.ID, "ptlatest")))
 
         # test ordered by last name
-        pt_tbody = self.selenium.find_element_by_xpath("//div[@class='container']/table/tbody") # this line does throw an error if the id-ed element does not exist
+        pt_tbody = self.selenium.find_element_by_xpath("//div[@id='all-patients-results']/table/tbody") # this line does throw an error if the id-ed element does not exist
         first_patient_name = pt_tbody.find_element_by_xpath("//tr[2]/td[1]").text
         second_patient_name = pt_tbody.find_element_by_xpath("//tr[3]/td[1]").text
         self.assertLessEqual(first_patient_name, second_patient_name)
@@ -635,7 +639,19 @@ class LiveTestPatientLists(SeleniumLiveTestCase):
                 if t.is_displayed()
             ]
 
+        def wait_for_search(query):
+            """The search is run on the server once typing stops; wait
+            for its results to replace the table.
+            """
+            WebDriverWait(self.selenium, 10).until(
+                lambda driver: driver.execute_script(
+                    "return window.location.search") ==
+                "?q=" + query.replace(' ', '%20'))
+            WebDriverWait(self.selenium, 10).until(
+                EC.presence_of_element_located((By.ID, 'all-patients-table')))
+
         # only patient 1 should be present
+        wait_for_search(self.pt1.first_name)
         present_pt_names = get_present_pt_names()
         self.assertIn(str(self.pt1), present_pt_names)
         self.assertNotIn(str(self.pt2), present_pt_names)
@@ -651,6 +667,7 @@ class LiveTestPatientLists(SeleniumLiveTestCase):
             # time.sleep(600)
 
             # now all patients should be present
+            wait_for_search('')
             present_pt_names = get_present_pt_names()
             for pt in [self.pt1, self.pt2, self.pt3, self.pt4, self.pt5]:
                 self.assertIn(str(pt), present_pt_names)
@@ -661,6 +678,7 @@ class LiveTestPatientLists(SeleniumLiveTestCase):
         filter_box.send_keys(self.pt2.first_name.upper()[0:3])
 
         # only pt2 should be there now
+        wait_for_search(self.pt2.first_name.upper()[0:3])
         present_pt_names = get_present_pt_names()
         self.assertNotIn(str(self.pt1), present_pt_names)
         self.assertIn(str(self.pt2), present_pt_names)
@@ -670,6 +688,7 @@ class LiveTestPatientLists(SeleniumLiveTestCase):
         filter_box.send_keys(self.providers['coordinator'].first_name)
 
         # check for pt with coordinator
+        wait_for_search(self.providers['coordinator'].first_name)
         present_pt_names = get_present_pt_names()
         self.assertNotIn(str(self.pt1), present_pt_names)
         self.assertNotIn(str(self.pt2), present_pt_names)
@@ -832,6 +851,65 @@ class ViewsExistTest(TestCase):
         self.assertRedirects(response, reverse('home'))
 
 
+class AllPatientsTest(TestCase):
+    fixtures = [BASIC_FIXTURE]
+
+    def setUp(self):
+        self.provider = log_in_provider(self.client, build_provider())
+
+        pt_prototype = {
+            'phone': '+49 178 236 5288',
+            'gender': models.Gender.objects.first(),
+            'address': 'Schulstrasse 9',
+            'city': 'Munich',
+            'state': 'BA',
+            'zip_code': '63108',
+            'date_of_birth': datetime.date(1990, 1, 1),
+        }
+
+        self.pt1 = models.Patient.objects.get(pk=1)
+        self.pt2 = models.Patient.objects.create(
+            first_name="Juggie", last_name="Brodeltein", middle_name="Bayer",
+            **pt_prototype)
+        self.pt3 = models.Patient.objects.create(
+            first_name="Asdf", last_name="Lkjh", middle_name="Bayer",
+            **pt_prototype)
+        self.pt3.case_managers.add(self.provider)
+
+    def get_patients(self, **data):
+        response = self.client.get(reverse('all-patients'), data)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['object_list'])
+
+    def test_search(self):
+        self.assertEqual(self.get_patients(),
+                         [self.pt2, self.pt3, self.pt1])
+
+        # prefixes of any name, in any case, match
+        self.assertEqual(self.get_patients(q='brod'), [self.pt2])
+        self.assertEqual(self.get_patients(q='BAY'), [self.pt2, self.pt3])
+
+        # every word has to match
+        self.assertEqual(self.get_patients(q='bayer lk'), [self.pt3])
+        self.assertEqual(self.get_patients(q='bayer mcnath'), [])
+
+        # case managers' names match too
+        self.assertEqual(self.get_patients(q=self.provider.last_name),
+                         [self.pt3])
+
+    @override_settings(OSLER_PATIENTS_PER_PAGE=2)
+    def test_pagination(self):
+        self.assertEqual(self.get_patients(), [self.pt2, self.pt3])
+        self.assertEqual(self.get_patients(page=2), [self.pt1])
+        self.assertEqual(self.get_patients(page=99), [self.pt1])
+        self.assertEqual(self.get_patients(page='junk'),
+                         [self.pt2, self.pt3])
+
+        response = self.client.get(reverse('all-patients'), {'q': 'bayer'})
+        self.assertEqual(response.context['query'], 'bayer')
+        self.assertEqual(response.context['object_list'].paginator.count, 2)
+
+
 class ProviderCreateTest(TestCase):
     fixtures = [BASIC_FIXTURE]
 
@@ -926,6 +1004,20 @@ class ProviderTypeTest(TestCase):
         log_in_provider(self.client, build_provider(["Preclinical"]))
         self.assertEqual(get_url_pt_list_identifiers(self, url), ['activept'])
 
+    def test_provider_loaded_once_per_request(self):
+        # the decorators, the view and the audit log all need the provider
+        # and their role, which ProviderMiddleware loads just once.
+        log_in_provider(self.client, build_provider(["Attending"]))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, 200)
+
+        for table in ['pttrack_provider', 'pttrack_providertype']:
+            self.assertEqual(
+                len([q for q in queries
+                     if 'FROM "%s"' % table in q['sql']]), 1)
+
 
 class IntakeTest(TestCase):
     fixtures = [BASIC_FIXTURE]
@@ -1275,6 +1367,84 @@ class TestReferralPatientDetailIntegration(TestCase):
             name='COH', address='Euclid Ave.')
         self.refloc.care_availiable.add(self.reftype)
 
+    def add_one_of_everything(self):
+        """ Adds a note of every kind shown on the patient's chart."""
+
+        note_kwargs = {
+            'author': models.Provider.objects.first(),
+            'author_type': models.ProviderType.objects.first(),
+            'patient': self.pt
+        }
+        followup_kwargs = dict(
+            contact_method=self.contact_method,
+            contact_resolution=ContactResult.objects.get_or_create(
+                name="Reached", patient_reached=True)[0],
+            **note_kwargs)
+
+        workupModels.Workup.objects.create(
+            clinic_day=workupModels.ClinicDate.objects.create(
+                clinic_type=workupModels.ClinicType.objects.get_or_create(
+                    name="Basic Care Clinic")[0],
+                clinic_date=now().date()),
+            chief_complaint="SOB", diagnosis="MI", HPI="", PMH_PSH="",
+            meds="", allergies="", fam_hx="", soc_hx="", ros="", pe="",
+            A_and_P="", **note_kwargs)
+        workupModels.ProgressNote.objects.create(
+            title="Progress", text="Better", **note_kwargs)
+        models.Document.objects.create(
+            title="Prescription", image="prescription.pdf", comments="",
+            document_type=models.DocumentType.objects.first(), **note_kwargs)
+
+        GeneralFollowup.objects.create(comments="Called", **followup_kwargs)
+        LabFollowup.objects.create(
+            communication_success=True, **followup_kwargs)
+        VaccineFollowup.objects.create(subsq_dose=False, **followup_kwargs)
+        ReferralFollowup.objects.create(
+            has_appointment=False, **followup_kwargs)
+
+        models.ActionItem.objects.create(
+            instruction=models.ActionInstruction.objects.first(),
+            comments="", due_date=self.tomorrow, **note_kwargs)
+
+        referral = Referral.objects.create(
+            kind=self.reftype, **note_kwargs)
+        referral.location.add(self.refloc)
+        followup_request = FollowupRequest.objects.create(
+            referral=referral, contact_instructions="Call him",
+            due_date=self.yesterday, **note_kwargs)
+        PatientContact.objects.create(
+            followup_request=followup_request, referral=referral,
+            contact_method=self.contact_method,
+            contact_status=followup_kwargs['contact_resolution'],
+            has_appointment=PatientContact.PTSHOW_NO, **note_kwargs)
+
+        Appointment.objects.create(
+            clindate=self.tomorrow, comment="Checkup", **note_kwargs)
+        Appointment.objects.create(
+            clindate=self.yesterday, comment="Checkup", **note_kwargs)
+
+    def test_patient_detail_query_count(self):
+        """ The chart should cost the same number of queries however many
+        notes it shows."""
+
+        url = reverse('patient-detail', args=(self.pt.id,))
+
+        self.add_one_of_everything()
+        self.client.get(url)  # warm up the session and caches
+        with self.assertNumQueries(24), \
+                CaptureQueriesContext(connection) as short_chart:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for _ in range(3):
+            self.add_one_of_everything()
+
+        with self.assertNumQueries(len(short_chart)):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Workups (4)")
+        self.assertContains(response, "Followups (20)")
+
     def test_patient_detail(self):
         """ Creates several action items and referral followups to check if view
             is properly supplying Status, FQHC Referral Status, Referrals,
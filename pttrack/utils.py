@@ -1,56 +1,39 @@
 from __future__ import unicode_literals
-from builtins import range
-import string
-from django.db.models import Q
-from . import models
+from django.utils.dateparse import parse_date
+from . import duplicates
 
 
-def all_variations(name):
-    """all_variations is a function that is used to help search for all
-    variations of a string that have either added, removed, or changed
-    1 letter. Function returns a list of all variations of the input string.
+def return_duplicates(first_name_str, last_name_str, date_of_birth=None):
+    """search the duplicate patient index for patients whose first and last
+    names are a few typos from (or sound like) the given ones, and return
+    them, those with the same date of birth (if it is given) and closest
+    names first. First name may also be abbreviated (to cover cases like
+    ben and benjamin), but the first letter of each name must be correct
+    unless they sound the same.
     """
-    all_vars = []
-    if name is None or len(name) == 0:
-        return all_vars
-    if len(name) == 1:
-        all_vars.append(name)
-        return all_vars
-    else:
-        # try all variations of switching letters, other than first letter
-        for i in range(1, len(name)):
-            # remove letter
-            all_vars.append(name[:i] + name[i+1:])
-            # change letter and add letter
-            for j in string.ascii_lowercase:
-                all_vars.append(name[:i] + j + name[i+1:])
-                all_vars.append(name[:i] + j + name[i:])
-
-        all_vars.append(name)
-        return all_vars
-
-
-def return_duplicates(first_name_str, last_name_str):
-    """search database for all variations of first and last name off by 1
-    letter (except for first letter must be correct) and return matching
-    results.  First name may also be abbreviated (to cover cases like
-    ben and benjamin)
-    """
-    first_name_var = all_variations(first_name_str.capitalize())
-    last_name_var = all_variations(last_name_str.capitalize())
-    if len(first_name_var) == 0 or len(last_name_var) == 0:
+    if not first_name_str or not last_name_str:
         return
-    return models.Patient.objects.filter(
-        (Q(first_name__in=first_name_var) |
-         Q(first_name__startswith=first_name_str)) &
-        Q(last_name__in=last_name_var))
+    return duplicates.index.find(first_name_str, last_name_str,
+                                 date_of_birth)
+
 
 def get_names_from_url_query_dict(request):
-    """Get first_name and last_name from a request object in a dict.
+    """Get first_name, last_name and (if given) date_of_birth from a
+    request object in a dict.
     """
 
     qs_dict = {param: request.GET[param] for param
-               in ['first_name', 'last_name']
+               in ['first_name', 'last_name', 'date_of_birth']
                if param in request.GET}
 
     return qs_dict
+
+
+def parse_date_of_birth(date_of_birth_str):
+    """Parse a date of birth (YYYY-MM-DD) from a url query, returning None
+    if it is missing or invalid.
+    """
+    try:
+        return parse_date(date_of_birth_str or '')
+    except ValueError:
+        return None
@@ -7,30 +7,39 @@ import datetime
 from django.conf import settings
 from django.apps import apps
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponseRedirect, HttpResponseServerError
+from django.http import Http404, HttpResponseRedirect, \
+    HttpResponseServerError
 from django.views.generic.edit import FormView, UpdateView
 from django.views.generic.list import ListView
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db.models import Prefetch
 from django.utils.http import is_safe_url
+from django.utils.timezone import now
 
 from workup import models as workupmodels
+from followup import models as followupmodels
 from referral.models import Referral, FollowupRequest, PatientContact
 from appointment.models import Appointment
 
 from . import models as mymodels
 from . import forms as myforms
 from . import utils
+from .middleware import current_provider_type
 
 
 def get_current_provider_type(request):
     '''
     Given the request, produce the ProviderType of the logged in user. This is
-    done using session data.
+    done using session data, and is loaded at most once per request (see
+    ProviderMiddleware).
     '''
-    return get_object_or_404(mymodels.ProviderType,
-                             pk=request.session['clintype_pk'])
+    provider_type = current_provider_type(request)
+    if provider_type is None:
+        raise Http404("No ProviderType matches the given query.")
+
+    return provider_type
 
 
 class NoteFormView(FormView):
@@ -206,8 +215,9 @@ class PreIntakeSelect(ListView):
         if (initial.get('first_name', None) is None or
             initial.get('last_name', None) is None):
             return []
-        possible_duplicates = utils.return_duplicates(initial.get(
-            'first_name', None), initial.get('last_name', None))
+        possible_duplicates = utils.return_duplicates(
+            initial.get('first_name', None), initial.get('last_name', None),
+            utils.parse_date_of_birth(initial.get('date_of_birth', None)))
         return possible_duplicates
 
     def get_context_data(self, **kwargs):
@@ -220,6 +230,9 @@ class PreIntakeSelect(ListView):
             reverse("intake"),
             "first_name", initial.get('first_name', None),
             "last_name", initial.get('last_name', None))
+        if initial.get('date_of_birth', None):
+            context['new_pt_url'] += "&%s=%s" % (
+                "date_of_birth", initial['date_of_birth'])
         context['home'] = reverse("home")
         return context
 
@@ -239,11 +252,16 @@ class PreIntake(FormView):
     def form_valid(self, form):
         first_name_str = form.cleaned_data['first_name'].capitalize()
         last_name_str = form.cleaned_data['last_name'].capitalize()
+        date_of_birth = form.cleaned_data['date_of_birth']
         matching_patients = utils.return_duplicates(first_name_str,
-                                                    last_name_str)
+                                                    last_name_str,
+                                                    date_of_birth)
 
         querystr = '%s=%s&%s=%s' % ("first_name", first_name_str,
                                     "last_name", last_name_str)
+        if date_of_birth is not None:
+            querystr += '&%s=%s' % ("date_of_birth",
+                                    date_of_birth.isoformat())
         if len(matching_patients) > 0:
             intake_url = "%s?%s" % (reverse("preintake-select"), querystr)
             return HttpResponseRedirect(intake_url)
@@ -337,8 +355,7 @@ def choose_clintype(request):
 
 def home_page(request):
 
-    active_provider_type = get_object_or_404(mymodels.ProviderType,
-                                             pk=request.session['clintype_pk'])
+    active_provider_type = get_current_provider_type(request)
 
     if active_provider_type.signs_charts:
         title = "Attending Tasks"
@@ -382,8 +399,45 @@ def home_page(request):
 
 
 def patient_detail(request, pk):
+    """
+    Everything on the chart is loaded here, with select_related and
+    prefetch_related, so that it costs the same number of queries however
+    many notes the patient has.
+    """
 
-    pt = get_object_or_404(mymodels.Patient, pk=pk)
+    authored = ('author', 'author_type')
+
+    pt = get_object_or_404(
+        mymodels.Patient.objects
+        .select_related('gender', 'demographics')
+        .prefetch_related(
+            'languages', 'ethnicities', 'case_managers',
+            Prefetch('workup_set',
+                     queryset=workupmodels.Workup.objects
+                     .select_related(*authored)),
+            Prefetch('progressnote_set',
+                     queryset=workupmodels.ProgressNote.objects
+                     .select_related(*authored)),
+            Prefetch('document_set',
+                     queryset=mymodels.Document.objects
+                     .select_related('document_type', *authored)),
+            Prefetch('labfollowup_set',
+                     queryset=followupmodels.LabFollowup.objects
+                     .select_related(*authored)),
+            Prefetch('vaccinefollowup_set',
+                     queryset=followupmodels.VaccineFollowup.objects
+                     .select_related(*authored)),
+            Prefetch('generalfollowup_set',
+                     queryset=followupmodels.GeneralFollowup.objects
+                     .select_related(*authored)),
+            Prefetch('referralfollowup_set',
+                     queryset=followupmodels.ReferralFollowup.objects
+                     .select_related('noapt_reason', 'noshow_reason',
+                                     *authored)),
+            Prefetch('appointment_set',
+                     queryset=Appointment.objects
+                     .order_by('clindate', 'clintime'))),
+        pk=pk)
 
     #   Special zipped list of action item types so they can be looped over.
     #   List 1: Labels for the panel objects of the action items
@@ -399,18 +453,31 @@ def patient_detail(request, pk):
     # Add action items for apps that are turned on in Osler's base settings
     # OSLER_TODO_LIST_MANAGERS contains app names like referral which contain
     # tasks for clinical teams to carry out (e.g., followup with patient)
+    # Each kind is fetched once and split up here, the same way that the
+    # manager's get_active, get_inactive and get_completed would.
+    today = now().date()
     for app, model in settings.OSLER_TODO_LIST_MANAGERS:
         ai = apps.get_model(app, model)
 
-        active_ais.extend(ai.objects.get_active(patient=pt))
-        inactive_ais.extend(ai.objects.get_inactive(patient=pt))
-        done_ais.extend(ai.objects.get_completed(patient=pt))
+        for item in ai.objects.get_all(patient=pt):
+            if item.completion_author_id is not None:
+                done_ais.append(item)
+            elif item.due_date <= today:
+                active_ais.append(item)
+            else:
+                inactive_ais.append(item)
 
     # Calculate the total number of action items for this patient,
     # This total includes all apps that that have associated
     # tasks requiring clinical followup (e.g., referral followup request)
     total_ais = len(active_ais) + len(inactive_ais) + len(done_ais)
 
+    # the same as pt.status(), from the action items we already have
+    status = mymodels.action_item_status(
+        [ai.due_date for ai in active_ais],
+        min([ai.due_date for ai in inactive_ais] or [None]),
+        len(done_ais))
+
     zipped_ai_list = list(zip(['collapse5', 'collapse6', 'collapse7'],
                          [active_ais, inactive_ais, done_ais],
                          ['Active Action Items', 'Pending Action Items',
@@ -421,7 +488,7 @@ def patient_detail(request, pk):
     referrals = Referral.objects.filter(
         patient=pt,
         followuprequest__in=FollowupRequest.objects.all()
-    )
+    ).select_related('kind').prefetch_related('location')
 
     # Add FQHC referral status
     # Note it is possible for a patient to have been referred multiple times
@@ -432,23 +499,20 @@ def patient_detail(request, pk):
     referral_status_output = Referral.aggregate_referral_status(fqhc_referrals)
 
     # Pass referral follow up set to page
-    referral_followups = PatientContact.objects.filter(patient=pt)
-    total_followups = referral_followups.count() + len(pt.followup_set())
-
-    appointments = Appointment.objects \
-        .filter(patient=pt) \
-        .order_by('clindate', 'clintime')
-    # d = collections.OrderedDict()
-    # for a in appointments:
-    #     if a.clindate in d:
-    #         d[a.clindate].append(a)
-    #     else:
-    #         d[a.clindate] = [a]
-
-    future_date_appointments = appointments.filter(
-        clindate__gte=datetime.date.today()).order_by('clindate', 'clintime')
-    previous_date_appointments = appointments.filter(
-        clindate__lt=datetime.date.today()).order_by('-clindate', 'clintime')
+    referral_followups = PatientContact.objects.filter(patient=pt) \
+        .select_related('contact_status', *authored) \
+        .prefetch_related('appointment_location')
+    total_followups = len(referral_followups) + len(pt.followup_set())
+
+    # appointments are prefetched in order of date and time
+    appointments = pt.appointment_set.all()
+
+    future_date_appointments = [a for a in appointments
+                                if a.clindate >= datetime.date.today()]
+    # latest day first, but still in order of time within each day
+    previous_date_appointments = sorted(
+        [a for a in appointments if a.clindate < datetime.date.today()],
+        key=lambda a: a.clindate, reverse=True)
 
     future_apt = collections.OrderedDict()
     for a in future_date_appointments:
@@ -474,6 +538,7 @@ def patient_detail(request, pk):
                   'pttrack/patient_detail.html',
                   {'zipped_ai_list': zipped_ai_list,
                    'total_ais': total_ais,
+                   'status': status,
                    'referral_status': referral_status_output,
                    'referrals': referrals,
                    'referral_followups': referral_followups,
@@ -487,21 +552,35 @@ def all_patients(request):
     """
     Query is written to minimize hits to the database; number of db hits can be
         see on the django debug toolbar.
+
+    Patients are shown a page at a time, and can be searched by patient or
+    case manager name with the 'q' parameter.
     """
-    patient_list = mymodels.Patient.objects.all() \
-        .order_by('last_name') \
+    query = request.GET.get('q', '')
+
+    patient_list = mymodels.Patient.objects.search(query) \
+        .order_by('last_name', 'pk') \
         .select_related('gender') \
         .prefetch_related('case_managers') \
-        .prefetch_related(Prefetch('workup_set', queryset=workupmodels.Workup.objects.order_by('clinic_day__clinic_date'))) \
-        .prefetch_related('actionitem_set')
+        .select_related('summary__latest_workup__clinic_day',
+                        'summary__latest_workup__signer')
 
-    # Don't know how to prefetch history https://stackoverflow.com/questions/45713517/use-prefetch-related-in-django-simple-history
-    # Source code is https://github.com/treyhunner/django-simple-history/blob/master/simple_history/models.py if we want to try to figure out
+    paginator = Paginator(patient_list, settings.OSLER_PATIENTS_PER_PAGE)
+    page = request.GET.get('page')
+
+    try:
+        patients = paginator.page(page)
+    except PageNotAnInteger:
+        # If page is not an integer, deliver first page.
+        patients = paginator.page(1)
+    except EmptyPage:
+        # If page is out of range (e.g. 9999), deliver last page of results.
+        patients = paginator.page(paginator.num_pages)
 
     return render(request,
                   'pttrack/all_patients.html',
-                  {'object_list': patient_list})
-
+                  {'object_list': patients,
+                   'query': query})
 
 
 def patient_activate_detail(request, pk):
@@ -76,6 +76,7 @@ class FollowupRequest(Note, CompletableMixin):
 
     MARK_DONE_URL_NAME = 'new-patient-contact'
     ADMIN_URL_NAME = ''
+    BLURB_RELATED_FIELDS = ['referral']
 
     def class_name(self):
         return self.__class__.__name__
@@ -88,8 +89,8 @@ class FollowupRequest(Note, CompletableMixin):
 
     def mark_done_url(self):
         return reverse(self.MARK_DONE_URL_NAME,
-                       args=(self.referral.patient.id,
-                             self.referral.id,
+                       args=(self.referral.patient_id,
+                             self.referral_id,
                              self.id))
 
     def admin_url(self):
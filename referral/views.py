@@ -6,7 +6,8 @@ from django.views.generic.edit import FormView
 from django.http import HttpResponseRedirect
 from django.contrib import messages
 
-from pttrack.models import Patient, ProviderType, ReferralType
+from pttrack.models import Patient, ReferralType
+from pttrack.views import get_current_provider_type
 
 from .models import Referral, FollowupRequest, ReferralLocation
 from .forms import (FollowupRequestForm, ReferralForm, PatientContactForm,
@@ -82,8 +83,7 @@ class ReferralCreate(FormView):
 
         # Assign author and author type
         referral.author = self.request.user.provider
-        referral.author_type = get_object_or_404(
-            ProviderType, pk=self.request.session['clintype_pk'])
+        referral.author_type = get_current_provider_type(self.request)
         referral.patient = pt
 
         referral.save()
@@ -117,8 +117,7 @@ class FollowupRequestCreate(FormView):
         pt = get_object_or_404(Patient, pk=self.kwargs['pt_id'])
         followup_request = form.save(commit=False)
         followup_request.author = self.request.user.provider
-        followup_request.author_type = get_object_or_404(
-            ProviderType, pk=self.request.session['clintype_pk'])
+        followup_request.author_type = get_current_provider_type(self.request)
         followup_request.referral = get_object_or_404(
             Referral, pk=self.kwargs['referral_id'])
         followup_request.patient = pt
@@ -171,8 +170,7 @@ class PatientContactCreate(FormView):
 
         # Fill in remaining fields of form
         patient_contact.author = self.request.user.provider
-        patient_contact.author_type = get_object_or_404(
-            ProviderType, pk=self.request.session['clintype_pk'])
+        patient_contact.author_type = get_current_provider_type(self.request)
         patient_contact.referral = referral
         patient_contact.patient = pt
         patient_contact.followup_request = followup_request
@@ -5,7 +5,7 @@ from past.utils import old_div
 from decimal import Decimal, ROUND_HALF_UP
 
 from django.forms import (
-    fields, ModelForm, ModelChoiceField, ModelMultipleChoiceField, RadioSelect
+    fields, ModelForm, RadioSelect
 )
 
 from crispy_forms.helper import FormHelper
@@ -15,7 +15,8 @@ from crispy_forms.bootstrap import (
     InlineCheckboxes, AppendedText, PrependedText)
 from crispy_forms.utils import TEMPLATE_PACK, render_field
 
-from pttrack.models import Provider, ProviderType
+from pttrack.provider_choices import ProviderChoiceField, \
+    ProviderMultipleChoiceField
 from . import models
 
 
@@ -156,18 +157,14 @@ class WorkupForm(ModelForm):
     # limit the options for the attending, other_volunteer field to
     # Providers with ProviderType with signs_charts=True, False
     # (includes coordinators and volunteers)
-    attending = ModelChoiceField(
+    attending = ProviderChoiceField(
+        {'signs_charts': True},
         required=False,
-        queryset=Provider.objects.filter(
-            clinical_roles__in=ProviderType.objects.filter(
-                signs_charts=True)).order_by("last_name")
     )
 
-    other_volunteer = ModelMultipleChoiceField(
+    other_volunteer = ProviderMultipleChoiceField(
+        {'signs_charts': False},
         required=False,
-        queryset=Provider.objects.filter(
-            clinical_roles__in=ProviderType.objects.filter(
-                signs_charts=False)).distinct().order_by("last_name"),
     )
 
     def __init__(self, *args, **kwargs):
@@ -13,7 +13,7 @@ from django.views.generic.edit import FormView
 from django.conf import settings
 
 from pttrack.views import NoteFormView, NoteUpdate, get_current_provider_type
-from pttrack.models import Patient, ProviderType
+from pttrack.models import Patient
 
 from xhtml2pdf import pisa
 
@@ -92,14 +92,12 @@ class WorkupCreate(NoteFormView):
 
     def form_valid(self, form):
         pt = get_object_or_404(Patient, pk=self.kwargs['pt_id'])
-        active_provider_type = get_object_or_404(
-            ProviderType,
-            pk=self.request.session['clintype_pk'])
+        active_provider_type = get_current_provider_type(self.request)
 
         wu = form.save(commit=False)
         wu.patient = pt
         wu.author = self.request.user.provider
-        wu.author_type = get_current_provider_type(self.request)
+        wu.author_type = active_provider_type
         if wu.author_type.signs_charts:
             wu.sign(self.request.user, active_provider_type)
 
@@ -153,13 +151,11 @@ class ProgressNoteCreate(NoteFormView):
 
     def form_valid(self, form):
         pnote = form.save(commit=False)
-        active_provider_type = get_object_or_404(
-             ProviderType,
-             pk=self.request.session['clintype_pk'])
+        active_provider_type = get_current_provider_type(self.request)
         pt = get_object_or_404(Patient, pk=self.kwargs['pt_id'])
         pnote.patient = pt
         pnote.author = self.request.user.provider
-        pnote.author_type = get_current_provider_type(self.request)
+        pnote.author_type = active_provider_type
         if pnote.author_type.signs_charts:
             pnote.sign(self.request.user, active_provider_type)
         pnote.save()
@@ -222,8 +218,7 @@ def clinic_date_list(request):
 def sign_workup(request, pk):
 
     wu = get_object_or_404(models.Workup, pk=pk)
-    active_provider_type = get_object_or_404(ProviderType,
-                                             pk=request.session['clintype_pk'])
+    active_provider_type = get_current_provider_type(request)
 
     try:
         wu.sign(request.user, active_provider_type)
@@ -237,8 +232,7 @@ def sign_workup(request, pk):
 
 def sign_progress_note(request, pk):
     wu = get_object_or_404(models.ProgressNote, pk=pk)
-    active_provider_type = get_object_or_404(ProviderType,
-                                             pk=request.session['clintype_pk'])
+    active_provider_type = get_current_provider_type(request)
     try:
         wu.sign(request.user, active_provider_type)
         wu.save()
@@ -260,8 +254,7 @@ def error_workup(request, pk):
 def pdf_workup(request, pk):
 
     wu = get_object_or_404(models.Workup, pk=pk)
-    active_provider_type = get_object_or_404(ProviderType,
-                                             pk=request.session['clintype_pk'])
+    active_provider_type = get_current_provider_type(request)
 
     if active_provider_type.staff_view:
         data = {'workup': wu}